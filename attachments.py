@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.types import Message
+
+from metrics import REGISTRY
+from trello_api import AsyncTrelloManager
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENTS = REGISTRY.counter(
+    'attachments_total', 'Вложения заказов по результату загрузки', ('result',))
+
+# сколько частей файла одна загрузка может держать в памяти одновременно:
+# часть в запросе к Trello и до двух частей в буфере чтения ответа Telegram
+STREAM_BUFFER_CHUNKS = 3
+
+
+# вложения сообщения в виде, который можно сохранить в очереди заказов:
+# [{'file_id', 'file_unique_id', 'file_name', 'mime_type', 'file_size'}]
+def message_attachments(message: Message) -> List[Dict[str, Any]]:
+    if message.photo:
+        # Telegram присылает несколько размеров, последний - самый большой
+        photo = message.photo[-1]
+        return [{
+            'file_id': photo.file_id,
+            'file_unique_id': photo.file_unique_id,
+            'file_name': f"photo_{photo.file_unique_id}.jpg",
+            'mime_type': 'image/jpeg',
+            'file_size': photo.file_size,
+        }]
+    if message.document:
+        document = message.document
+        return [{
+            'file_id': document.file_id,
+            'file_unique_id': document.file_unique_id,
+            'file_name': document.file_name or f"file_{document.file_unique_id}",
+            'mime_type': document.mime_type or 'application/octet-stream',
+            'file_size': document.file_size,
+        }]
+    return []
+
+
+# бюджет памяти в байтах: загрузка ждет, пока освободится нужный ей объем
+class MemoryBudget:
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        size = min(max(1, size), self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+
+# передача файлов из Telegram в Trello.
+# файл читается из Telegram частями по chunk_size и сразу отправляется в Trello,
+# поэтому одна загрузка занимает в памяти несколько частей, а не весь файл.
+# загрузки одного заказа идут параллельно в пределах общего бюджета памяти
+class AttachmentUploader:
+    def __init__(self, trello: AsyncTrelloManager, memory_budget: int, chunk_size: int = 64 * 1024,
+                 timeout: float = 120, max_file_size: int = 20 * 1024 * 1024):
+        self.trello = trello
+        self.budget = MemoryBudget(memory_budget)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.max_file_size = max_file_size
+
+    # сколько памяти зарезервировать под загрузку: маленький файл - свой размер,
+    # большой - несколько частей (размер фото в Telegram известен заранее)
+    def buffer_size(self, attachment: Dict[str, Any]) -> int:
+        stream_size = self.chunk_size * STREAM_BUFFER_CHUNKS
+        return min(attachment.get('file_size') or stream_size, stream_size)
+
+    async def upload(self, bot: Bot, card_id: str, attachment: Dict[str, Any]) -> bool:
+        name = attachment['file_name']
+        if (attachment.get('file_size') or 0) > self.max_file_size:
+            logger.warning("Вложение %s слишком большое для Bot API: %s байт", name, attachment['file_size'])
+            ATTACHMENTS.inc('too_large')
+            return False
+
+        async with self.budget.reserve(self.buffer_size(attachment)):
+            try:
+                file = await bot.get_file(attachment['file_id'])
+                url = bot.session.api.file_url(bot.token, file.file_path)
+
+                def open_stream():
+                    return bot.session.stream_content(
+                        url, timeout=int(self.timeout), chunk_size=self.chunk_size)
+
+                uploaded = await self.trello.upload_attachment(
+                    card_id, name, attachment['mime_type'], open_stream, self.timeout)
+            except Exception as e:
+                # ошибка скачивания из Telegram прерывает и отправку в Trello
+                logger.error("Не удалось передать вложение %s: %s", name, e)
+                uploaded = False
+
+        ATTACHMENTS.inc('uploaded' if uploaded else 'failed')
+        return uploaded
+
+    # загрузить вложения к карточке параллельно; done - номера уже загруженных
+    # (при повторе задачи из очереди они пропускаются), on_uploaded вызывается после каждого.
+    # возвращает {название файла: загружен ли}
+    async def upload_all(self, bot: Bot, card_id: str, attachments: List[Dict[str, Any]],
+                         done: Optional[List[int]] = None,
+                         on_uploaded: Optional[Callable[[int], Awaitable[None]]] = None) -> Dict[str, bool]:
+        done = set(done or ())
+
+        async def upload_one(index: int, attachment: Dict[str, Any]) -> bool:
+            if index in done:
+                return True
+            uploaded = await self.upload(bot, card_id, attachment)
+            if uploaded and on_uploaded is not None:
+                await on_uploaded(index)
+            return uploaded
+
+        results = await asyncio.gather(*(upload_one(index, attachment)
+                                         for index, attachment in enumerate(attachments)))
+        return {attachment['file_name']: uploaded for attachment, uploaded in zip(attachments, results)}
+
+
+# сбор альбомов: Telegram присылает каждое фото альбома отдельным сообщением
+# с общим media_group_id (подпись обычно только у одного из них).
+# первое сообщение ждет, пока остальные перестанут приходить, и получает весь альбом
+class MediaGroupCollector:
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+        self._groups: Dict[str, List[Message]] = {}
+
+    # список сообщений для обработки или None, если сообщение досталось уже ждущему альбому
+    async def collect(self, message: Message) -> Optional[List[Message]]:
+        group_id = message.media_group_id
+        if group_id is None:
+            return [message]
+
+        messages = self._groups.get(group_id)
+        if messages is not None:
+            messages.append(message)
+            return None
+
+        messages = self._groups[group_id] = [message]
+        try:
+            count = 0
+            while count != len(messages):
+                count = len(messages)
+                await asyncio.sleep(self.delay)
+        finally:
+            del self._groups[group_id]
+        return sorted(messages, key=lambda item: item.message_id)
@@ -0,0 +1,205 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from config import Config
+from handlers import build_custom_fields_data
+from trello_api import TrelloManager
+from utils import parse_message, format_card_description, validate_required_fields, validate_field_values
+
+# микро-бенчмарки горячего пути обработки заказа.
+#   python bench.py                  - замер и сравнение с сохраненным baseline
+#   python bench.py --save-baseline  - сохранить текущие результаты как baseline
+# baseline зависит от машины: сохраняйте и сравнивайте его на одном и том же сервере
+
+BASELINE_FILE = 'bench_baseline.json'
+
+# обычный заказ в формате из /start
+REALISTIC_QUOTED = '''"имя карточки": "Кухонный гарнитур для Ивановой"
+"дата заказа": "10.09.2025"
+"крайний срок": "25.10.2025"
+"клиент": "Иванова Мария Петровна"
+"цвет": "белый глянец"
+"телефон": "+7 912 345 6789"
+"дополнительно": "доставка после 18:00, подъем на 5 этаж"'''
+
+REALISTIC_UNQUOTED = '''имя карточки: Кухонный гарнитур для Ивановой
+дата заказа: 10.09.2025
+крайний срок: 25.10.2025 18:00
+клиент: Иванова Мария Петровна
+цвет: белый глянец
+телефон: +7 912 345 6789
+дополнительно: доставка после 18:00, подъем на 5 этаж'''
+
+
+# худший случай: сообщение на 4096 символов (лимит Telegram) из множества
+# полей с длинными кириллическими значениями, кавычками и датами со временем
+def build_worst_case_message(limit: int = 4096) -> str:
+    lines = [
+        '"имя карточки": "Шкаф-купе трехстворчатый с зеркалами и подсветкой"',
+        'дата заказа: "10.09.2025 09:30"',
+        "крайний срок: '25.10.2025 18:00'",
+    ]
+    number = 0
+    while True:
+        number += 1
+        line = f'"поле номер {number}": "значение с кириллицей, пробелами и цифрами {number} — длинный текст описания"'
+        if number % 2:
+            line = f'дополнительное поле {number}: "Съешь же ещё этих мягких французских булок, да выпей чаю {number}"'
+        if len('\n'.join(lines + [line])) > limit:
+            break
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+WORST_CASE = build_worst_case_message()
+
+# кастомные поля доски: стандартные поля заказа и много посторонних
+CUSTOM_FIELDS = {
+    name: {'id': f"field{index:024d}", 'type': 'date' if name in ('дата заказа', 'крайний срок') else 'text'}
+    for index, name in enumerate(
+        ['дата заказа', 'крайний срок', 'клиент', 'цвет', 'имя', 'телефон',
+         Config.TELEGRAM_USER_FIELD.lower()] + [f"поле номер {n}" for n in range(1, 40, 2)])
+}
+
+
+def with_user(data: Dict[str, str]) -> Dict[str, str]:
+    return {**data, 'telegram пользователь': '@manager_ivanova'}
+
+
+REALISTIC_DATA = with_user(parse_message(REALISTIC_UNQUOTED))
+WORST_CASE_DATA = with_user(parse_message(WORST_CASE))
+DATE_PARSER = TrelloManager('key', 'token')
+
+BENCHMARKS: Dict[str, Callable[[], object]] = {
+    'parse_message/realistic_quoted': lambda: parse_message(REALISTIC_QUOTED),
+    'parse_message/realistic_unquoted': lambda: parse_message(REALISTIC_UNQUOTED),
+    'parse_message/worst_case_4096': lambda: parse_message(WORST_CASE),
+    'format_card_description/realistic': lambda: format_card_description(REALISTIC_DATA),
+    'format_card_description/worst_case': lambda: format_card_description(WORST_CASE_DATA),
+    'validate_required_fields/realistic': lambda: validate_required_fields(REALISTIC_DATA, Config.REQUIRED_FIELDS),
+    'validate_required_fields/missing': lambda: validate_required_fields({}, Config.REQUIRED_FIELDS),
+    'validate_field_values/realistic': lambda: validate_field_values(REALISTIC_DATA),
+    'parse_date_string/first_format': lambda: DATE_PARSER.parse_date_string('25.10.2025 18:00'),
+    'parse_date_string/last_format': lambda: DATE_PARSER.parse_date_string('10/25/2025'),
+    'parse_date_string/invalid': lambda: DATE_PARSER.parse_date_string('завтра'),
+    'field_mapping/realistic': lambda: build_custom_fields_data(REALISTIC_DATA, CUSTOM_FIELDS, Config.TRELLO_BOARD_ID),
+    'field_mapping/worst_case': lambda: build_custom_fields_data(WORST_CASE_DATA, CUSTOM_FIELDS, Config.TRELLO_BOARD_ID),
+}
+
+
+# замер скорости: лучший из repeat прогонов по ~min_time секунд
+def measure_speed(func: Callable[[], object], repeat: int, min_time: float) -> float:
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 10:
+            break
+        iterations *= 2
+    iterations = max(1, int(iterations * min_time / max(elapsed, 1e-9) / 10))
+
+    best = 0.0
+    gc.collect()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = time.perf_counter() - start
+        best = max(best, iterations / elapsed)
+    return best
+
+
+# замер памяти одного вызова: пиковый объем и число оставшихся после вызова блоков
+def measure_allocations(func: Callable[[], object]) -> Dict[str, int]:
+    func()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    # блоки самого tracemalloc (снимки) не учитываем
+    own = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    blocks = sum(stat.count_diff for stat in after.filter_traces(own).compare_to(before.filter_traces(own), 'filename')
+                 if stat.count_diff > 0)
+    return {'peak_bytes': peak - base, 'retained_blocks': blocks}
+
+
+def run(selected: str, repeat: int, min_time: float) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, func in BENCHMARKS.items():
+        if selected and selected not in name:
+            continue
+        results[name] = {'ops_per_sec': measure_speed(func, repeat, min_time), **measure_allocations(func)}
+    return results
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+# вывести таблицу результатов; вернуть число регрессий сильнее threshold
+def report(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> int:
+    regressions = 0
+    print(f"{'benchmark':<40} {'ops/sec':>12} {'peak B':>9} {'blocks':>7} {'vs baseline':>12}")
+    for name, result in results.items():
+        line = f"{name:<40} {result['ops_per_sec']:>12,.0f} {result['peak_bytes']:>9} {result['retained_blocks']:>7}"
+        base = baseline.get(name)
+        if base:
+            change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+            line += f" {change:>+11.1%}"
+            if change < -threshold:
+                regressions += 1
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки обработки заказа")
+    parser.add_argument('-k', dest='selected', default='', help="запускать только бенчмарки, содержащие строку")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.5, help="секунд на один прогон")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.15, help="допустимое замедление относительно baseline")
+    parser.add_argument('--log-level', default=Config.LOG_LEVEL)
+    args = parser.parse_args()
+
+    # уровень логов как в рабочем режиме: выключенные логи тоже чего-то стоят
+    logging.basicConfig(level=args.log_level, stream=open(os.devnull, 'w'))
+
+    results = run(args.selected, args.repeat, args.min_time)
+    regressions = report(results, load_baseline(args.baseline), args.threshold)
+
+    if args.save_baseline:
+        baseline = load_baseline(args.baseline)
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, ensure_ascii=False)
+        print(f"Baseline сохранен: {args.baseline}")
+
+    sys.exit(1 if regressions and not args.save_baseline else 0)
+
+
+if __name__ == '__main__':
+    main()
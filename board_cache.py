@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# метаданные доски: ID списков по названию и кастомные поля с типами
+class BoardMetadata:
+    def __init__(self, lists: Dict[str, str], custom_fields: Dict[str, Dict], fetched_at: Optional[float] = None):
+        self.lists = lists
+        self.custom_fields = custom_fields
+        self.fetched_at = time.monotonic() if fetched_at is None else fetched_at
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+# кэш метаданных досок с TTL (общим или своим для доски).
+# после истечения TTL отдаем старые данные и обновляем их в фоне
+# (stale-while-revalidate), одновременные обновления одной доски склеиваются в один запрос.
+# досок не больше max_boards: лишние вытесняются начиная с давно не использованных,
+# кроме досок с фоновым обновлением (основная доска бота).
+# если задан snapshot_path, метаданные после каждого обновления сохраняются в JSON-файл
+# и загружаются из него при старте: бот сразу работает со старыми данными и обновляет их в фоне
+class BoardMetadataCache:
+    def __init__(self, fetcher: Callable[[str], Awaitable[Optional[BoardMetadata]]], ttl: float = 300,
+                 snapshot_path: Optional[str] = None, max_boards: int = 50):
+        self._fetcher = fetcher
+        self.ttl = ttl
+        # TTL отдельных досок (set_ttl), остальные доски - ttl
+        self._ttls: Dict[str, float] = {}
+        self.snapshot_path = snapshot_path
+        self.max_boards = max(1, max_boards)
+        self._snapshot_lock = asyncio.Lock()
+        self._snapshot_task: Optional[asyncio.Task] = None
+        # в порядке использования: последняя - самая недавняя
+        self._entries: 'OrderedDict[str, BoardMetadata]' = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._auto_refresh: Dict[str, asyncio.Task] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # свой TTL доски: например, доска с webhook Trello узнает об изменениях сразу
+    # и может обновляться по таймеру реже остальных
+    def set_ttl(self, board_id: str, ttl: float):
+        self._ttls[board_id] = ttl
+
+    def ttl_for(self, board_id: str) -> float:
+        return self._ttls.get(board_id, self.ttl)
+
+    # получить метаданные доски; сетевой запрос только если доски еще нет в кэше
+    async def get(self, board_id: str) -> Optional[BoardMetadata]:
+        entry = self._entries.get(board_id)
+        if entry is None:
+            self.misses += 1
+            return await asyncio.shield(self._start_refresh(board_id))
+
+        self.hits += 1
+        self._entries.move_to_end(board_id)
+        if entry.age() > self.ttl_for(board_id):
+            self._start_refresh(board_id)
+        return entry
+
+    # загрузить метаданные до начала приема сообщений.
+    # wait=False - не ждать Trello: обновление идет в фоне, а первый заказ
+    # получит данные из снимка или дождется этого же обновления
+    async def warm_up(self, board_id: str, wait: bool = True) -> bool:
+        refresh = self._start_refresh(board_id)
+        if not wait:
+            return board_id in self._entries
+        entry = await refresh
+        if entry is None:
+            logger.warning("Не удалось прогреть кэш метаданных доски %s", board_id)
+            return False
+        logger.info(
+            "Кэш метаданных доски %s прогрет: списков %s, полей %s",
+            board_id, len(entry.lists), len(entry.custom_fields))
+        return True
+
+    # периодически обновлять метаданные в фоне, чтобы горячий путь не ходил в Trello
+    def start_auto_refresh(self, board_id: str):
+        if board_id not in self._auto_refresh:
+            self._auto_refresh[board_id] = asyncio.create_task(
+                self._auto_refresh_loop(board_id))
+
+    async def _auto_refresh_loop(self, board_id: str):
+        while True:
+            await asyncio.sleep(self.ttl_for(board_id))
+            await self._start_refresh(board_id)
+
+    # сбросить доску: следующий запрос загрузит метаданные заново
+    def invalidate(self, board_id: str):
+        self._entries.pop(board_id, None)
+
+    # перечитать доску в фоне: данные в Trello только что изменились.
+    # если загрузка уже идет, она могла начаться до изменения - запускаем еще одну следом
+    def refresh(self, board_id: str):
+        task = self._inflight.get(board_id)
+        if task is None:
+            self._start_refresh(board_id)
+        else:
+            task.add_done_callback(lambda _: self._start_refresh(board_id))
+
+    # изменить метаданные доски на месте, без запроса к Trello; False - доски нет в кэше
+    def patch(self, board_id: str, change: Callable[[BoardMetadata], None]) -> bool:
+        entry = self._entries.get(board_id)
+        if entry is None:
+            return False
+        change(entry)
+        if self.snapshot_path:
+            self._snapshot_task = asyncio.create_task(self.save_snapshot())
+        return True
+
+    # остановить фоновые обновления
+    async def close(self):
+        tasks = list(self._auto_refresh.values()) + list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._auto_refresh.clear()
+
+    def _start_refresh(self, board_id: str) -> asyncio.Task:
+        task = self._inflight.get(board_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(board_id))
+            self._inflight[board_id] = task
+            task.add_done_callback(
+                lambda _: self._inflight.pop(board_id, None))
+        return task
+
+    # при ошибке оставляем прежние данные, если они были
+    async def _refresh(self, board_id: str) -> Optional[BoardMetadata]:
+        self.refreshes += 1
+        try:
+            metadata = await self._fetcher(board_id)
+        except Exception as e:
+            logger.error("Ошибка при обновлении метаданных доски %s: %s", board_id, e)
+            metadata = None
+
+        if metadata is None:
+            self.refresh_errors += 1
+            return self._entries.get(board_id)
+
+        self._entries[board_id] = metadata
+        self._entries.move_to_end(board_id)
+        self._evict()
+        if self.snapshot_path:
+            await self.save_snapshot()
+        return metadata
+
+    # вытеснить давно не использованные доски сверх max_boards
+    def _evict(self):
+        excess = len(self._entries) - self.max_boards
+        if excess <= 0:
+            return
+        for board_id in [key for key in self._entries if key not in self._auto_refresh][:excess]:
+            del self._entries[board_id]
+            self.evictions += 1
+
+    async def save_snapshot(self):
+        try:
+            async with self._snapshot_lock:
+                await asyncio.to_thread(self._save_snapshot, self._snapshot_data())
+        except Exception as e:
+            logger.warning("Не удалось сохранить снимок метаданных: %s", e)
+
+    # загрузить снимок метаданных с диска; возвращает число загруженных досок.
+    # возраст записей берется из снимка, поэтому устаревшие данные сразу обновятся в фоне
+    def load_snapshot(self) -> int:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Не удалось прочитать снимок метаданных %s: %s", self.snapshot_path, e)
+            return 0
+
+        now_wall, now_monotonic = time.time(), time.monotonic()
+        loaded = 0
+        for board_id, item in snapshot.get('boards', {}).items():
+            if board_id in self._entries:
+                continue
+            age = max(0.0, now_wall - item['saved_at'])
+            self._entries[board_id] = BoardMetadata(item['lists'], item['custom_fields'], now_monotonic - age)
+            loaded += 1
+        self._evict()
+        return loaded
+
+    def _snapshot_data(self) -> Dict:
+        now_wall, now_monotonic = time.time(), time.monotonic()
+        return {'boards': {
+            board_id: {
+                'lists': entry.lists,
+                'custom_fields': entry.custom_fields,
+                'saved_at': now_wall - (now_monotonic - entry.fetched_at),
+            }
+            for board_id, entry in self._entries.items()
+        }}
+
+    # запись через временный файл: при сбое посреди записи старый снимок остается целым
+    def _save_snapshot(self, data: Dict):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.snapshot_path)
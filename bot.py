@@ -1,30 +1,365 @@
+import time
+# время импорта модулей входит в отчет о запуске
+IMPORTS_STARTED = time.perf_counter()
+
 import asyncio
+import os
+import signal
+from contextlib import contextmanager
+from functools import partial
+from typing import Optional
 from aiogram import Bot, Dispatcher, types
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
 
-from trello_api import TrelloManager
+from trello_api import AsyncTrelloManager
+from rate_limiter import TokenBucket
+from circuit_breaker import CircuitBreaker
 from config import Config, validate_config
-from handlers import setup_handlers
-from logging_setup import setup_logging
+from handlers import setup_handlers, process_order_job, report_failed_job
+from outbox import Outbox, OutboxWorkerPool
+from dedup import DedupCache
+from card_index import CardIndex
+from order_stats import OrderStats
+from reminders import ReminderScheduler
+from middlewares import ConcurrencyLimitMiddleware, ProfilingMiddleware
+from profiling import SlowUpdateProfiler
+from trello_webhooks import TrelloWebhookReceiver
+from attachments import AttachmentUploader
+from routing import Route, Router
+from metrics import REGISTRY, start_metrics_server
+from logging_setup import setup_logging, dropped_records
+
+
+# клиент Trello с настройками из Config (base_url можно подменить для тестового сервера)
+def create_trello_manager(base_url: str = Config.BASE_URL) -> AsyncTrelloManager:
+    return AsyncTrelloManager(
+        Config.TRELLO_API_KEY, Config.TRELLO_TOKEN, base_url,
+        timeout=Config.TRELLO_TIMEOUT,
+        connect_timeout=Config.TRELLO_CONNECT_TIMEOUT,
+        pool_size=Config.TRELLO_POOL_SIZE,
+        keepalive_timeout=Config.TRELLO_KEEPALIVE_TIMEOUT,
+        metadata_ttl=Config.TRELLO_METADATA_TTL,
+        metadata_snapshot=Config.TRELLO_METADATA_SNAPSHOT or None,
+        max_cached_boards=Config.TRELLO_MAX_CACHED_BOARDS,
+        field_concurrency=Config.TRELLO_FIELD_CONCURRENCY,
+        bulk_custom_fields=Config.TRELLO_BULK_CUSTOM_FIELDS,
+        rate_limiter=TokenBucket(
+            Config.TRELLO_RATE_LIMIT, Config.TRELLO_RATE_PERIOD, Config.TRELLO_RATE_BURST),
+        max_retries=Config.TRELLO_MAX_RETRIES,
+        retry_backoff=Config.TRELLO_RETRY_BACKOFF,
+        retry_max_delay=Config.TRELLO_RETRY_MAX_DELAY,
+        breaker=create_circuit_breaker(),
+        hedge_delay=Config.TRELLO_HEDGE_DELAY)
+
+
+# защита от долгих сбоев Trello (None - выключена)
+def create_circuit_breaker() -> Optional[CircuitBreaker]:
+    if not Config.TRELLO_BREAKER_ENABLED:
+        return None
+    return CircuitBreaker(
+        failure_rate=Config.TRELLO_BREAKER_FAILURE_RATE,
+        slow_call_rate=Config.TRELLO_BREAKER_SLOW_RATE,
+        slow_call_seconds=Config.TRELLO_BREAKER_SLOW_CALL,
+        window=Config.TRELLO_BREAKER_WINDOW,
+        min_calls=Config.TRELLO_BREAKER_MIN_CALLS,
+        open_seconds=Config.TRELLO_BREAKER_OPEN)
+
+
+# защита от повторно отправленных заказов (None - выключена)
+def create_dedup() -> Optional[DedupCache]:
+    if not Config.DEDUP_ENABLED:
+        return None
+    return DedupCache(Config.DEDUP_TTL, Config.DEDUP_MAX_SIZE, Config.DEDUP_DB_FILE or None)
+
+
+# локальный поиск по карточкам заказов (None - выключен)
+def create_card_index() -> Optional[CardIndex]:
+    if not Config.CARD_INDEX_ENABLED:
+        return None
+    return CardIndex(Config.CARD_INDEX_DB_FILE)
+
+
+# статистика заказов для /stats (None - выключена)
+def create_order_stats() -> Optional[OrderStats]:
+    if not Config.STATS_ENABLED:
+        return None
+    return OrderStats(Config.STATS_DB_FILE)
+
+
+# напоминания о крайнем сроке заказов (None - выключены)
+def create_reminders() -> Optional[ReminderScheduler]:
+    if not Config.REMINDERS_ENABLED:
+        return None
+    return ReminderScheduler(
+        Config.REMINDERS_DB_FILE,
+        days_before=Config.REMINDER_DAYS_BEFORE,
+        hour=Config.REMINDER_HOUR,
+        max_delay=Config.REMINDER_MAX_DELAY)
+
+
+# правила выбора доски и списка для заказа (без файла правил - одна доска из настроек)
+def create_router() -> Router:
+    return Router.from_file(Config.ROUTING_FILE, Route(Config.TRELLO_BOARD_ID, Config.TRELLO_LIST))
+
+
+# передача фото и файлов заказов из Telegram в Trello
+def create_attachment_uploader(trello_manager: AsyncTrelloManager) -> AttachmentUploader:
+    return AttachmentUploader(
+        trello_manager,
+        Config.ATTACHMENT_MEMORY_BUDGET,
+        chunk_size=Config.ATTACHMENT_CHUNK_SIZE,
+        timeout=Config.ATTACHMENT_TIMEOUT,
+        max_file_size=Config.ATTACHMENT_MAX_FILE_SIZE)
+
+
+# профилировщик медленных апдейтов (None - профилирование выключено)
+def create_profiler() -> Optional[SlowUpdateProfiler]:
+    if not Config.PROFILING_ENABLED:
+        return None
+    return SlowUpdateProfiler(
+        Config.PROFILING_DIR,
+        threshold=Config.PROFILING_THRESHOLD,
+        sample_rate=Config.PROFILING_SAMPLE_RATE,
+        max_files=Config.PROFILING_MAX_FILES)
+
+
+# воркеры очереди заказов
+# breaker - пока цепь Trello разомкнута, воркеры не берут новые задачи
+def create_workers(bot: Bot, outbox: Outbox,
+                   profiler: Optional[SlowUpdateProfiler] = None,
+                   breaker: Optional[CircuitBreaker] = None) -> OutboxWorkerPool:
+    handler = partial(process_order_job, bot)
+    if profiler is not None:
+        handler = profiler.wrap_job(handler)
+    return OutboxWorkerPool(
+        outbox,
+        handler,
+        on_failure=partial(report_failed_job, bot),
+        workers=Config.OUTBOX_WORKERS,
+        lease=Config.OUTBOX_LEASE,
+        max_attempts=Config.OUTBOX_MAX_ATTEMPTS,
+        pause=breaker.retry_after if breaker is not None else None)
+
+
+# обработчики и middleware диспетчера; возвращает ограничитель апдейтов (для drain)
+def setup_dispatcher(dp: Dispatcher, trello_manager: AsyncTrelloManager, outbox: Optional[Outbox],
+                     profiler: Optional[SlowUpdateProfiler] = None,
+                     dedup: Optional[DedupCache] = None,
+                     router: Optional[Router] = None,
+                     card_index: Optional[CardIndex] = None,
+                     stats: Optional[OrderStats] = None,
+                     reminders: Optional[ReminderScheduler] = None) -> ConcurrencyLimitMiddleware:
+    setup_handlers(dp, trello_manager, outbox, dedup, create_attachment_uploader(trello_manager), router,
+                   card_index, stats, reminders)
+    concurrency = ConcurrencyLimitMiddleware(Config.MAX_CONCURRENT_UPDATES)
+    dp.update.outer_middleware(concurrency)
+    if profiler is not None:
+        dp.update.outer_middleware(ProfilingMiddleware(profiler))
+    return concurrency
+
+
+# время этапов запуска бота: пишется в лог и в метрику startup_phase_seconds
+class StartupTimer:
+    def __init__(self):
+        self.phases = [('imports', time.perf_counter() - IMPORTS_STARTED)]
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self, logger):
+        total = sum(seconds for _, seconds in self.phases)
+        logger.info("Запуск за %.0f мс: %s", total * 1000,
+                    ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.phases))
+        REGISTRY.gauge_callback(
+            'startup_phase_seconds', 'Время этапов запуска бота',
+            lambda: [((name,), seconds) for name, seconds in self.phases], ('phase',))
+
+
+# метрики, которые считываются из существующих счетчиков при каждом запросе /metrics
+def register_runtime_metrics(trello_manager: AsyncTrelloManager, concurrency: ConcurrencyLimitMiddleware,
+                             outbox: Optional[Outbox], reminders: Optional[ReminderScheduler] = None):
+    cache = trello_manager.metadata
+    pool = trello_manager.pool_stats
+    limiter = trello_manager.rate_limiter
+
+    REGISTRY.gauge_callback(
+        'updates_in_flight', 'Принятые апдейты: обрабатываются или ждут очереди',
+        lambda: [((), concurrency.in_flight)])
+    REGISTRY.counter_callback(
+        'board_cache_requests_total', 'Обращения к кэшу метаданных доски',
+        lambda: [(('hit',), cache.hits), (('miss',), cache.misses)], ('result',))
+    REGISTRY.counter_callback(
+        'board_cache_refreshes_total', 'Обновления кэша метаданных доски',
+        lambda: [(('ok',), cache.refreshes - cache.refresh_errors), (('error',), cache.refresh_errors)],
+        ('result',))
+    REGISTRY.gauge_callback(
+        'board_cache_boards', 'Доски в кэше метаданных',
+        lambda: [((), len(cache))])
+    REGISTRY.counter_callback(
+        'board_cache_evictions_total', 'Доски, вытесненные из кэша метаданных',
+        lambda: [((), cache.evictions)])
+    REGISTRY.counter_callback(
+        'trello_pool_connections_total', 'Соединения пула Trello: переиспользованные и новые',
+        lambda: [(('reused',), pool.hits), (('new',), pool.new_connections)], ('kind',))
+    REGISTRY.counter_callback(
+        'log_records_dropped_total', 'Записи лога, отброшенные при переполненной очереди',
+        lambda: [((), dropped_records())])
+    REGISTRY.gauge_callback(
+        'trello_pool_waiting', 'Запросы, ожидающие свободного соединения',
+        lambda: [((), pool.waiting_now)])
+    breaker = trello_manager.breaker
+    if breaker is not None:
+        REGISTRY.gauge_callback(
+            'trello_circuit_state', 'Цепь Trello: 0 - замкнута, 1 - полуоткрыта, 2 - разомкнута',
+            lambda: [((), {'closed': 0, 'half_open': 1, 'open': 2}[breaker.state])])
+        REGISTRY.counter_callback(
+            'trello_circuit_events_total', 'Размыкания цепи Trello и отклоненные запросы',
+            lambda: [(('opened',), breaker.opened), (('rejected',), breaker.rejected)], ('event',))
+    REGISTRY.counter_callback(
+        'trello_hedged_requests_total', 'Повторно отправленные медленные GET метаданных',
+        lambda: [((), trello_manager.hedged_requests)])
+    if limiter is not None:
+        REGISTRY.gauge_callback(
+            'trello_rate_limiter_queue', 'Запросы, ожидающие токена лимитера',
+            lambda: [((), limiter.queue_size())])
+
+    if reminders is not None:
+        REGISTRY.gauge_callback(
+            'deadline_reminders_pending', 'Запланированные напоминания о крайнем сроке',
+            lambda: [((), len(reminders))])
+
+    if outbox is not None:
+        async def outbox_samples():
+            stats = await outbox.stats()
+            return [((name,), value) for name, value in stats.items()]
+        REGISTRY.gauge_callback(
+            'outbox_jobs', 'Очередь заказов: depth, in_progress, failed, lag (секунды)',
+            outbox_samples, ('stat',))
+
+
+# прием webhook Trello: изменения списков и полей доски сразу попадают в кэш
+# (None - выключено, метаданные обновляются по TTL)
+def create_trello_webhook_receiver(trello_manager: AsyncTrelloManager) -> Optional[TrelloWebhookReceiver]:
+    if not Config.TRELLO_WEBHOOKS_ENABLED:
+        return None
+    callback_url = Config.TRELLO_WEBHOOK_URL.rstrip('/') + Config.TRELLO_WEBHOOK_PATH
+    return TrelloWebhookReceiver(
+        trello_manager.metadata, Config.TRELLO_BOARD_ID, callback_url, Config.TRELLO_API_SECRET)
+
+
+# зарегистрировать webhook в Trello; пока он работает, метаданные доски
+# перечитываются только изредка, на случай пропущенных событий.
+# пока регистрация не удалась, метаданные обновляются по TTL, а попытка повторяется
+async def register_trello_webhook(trello_manager: AsyncTrelloManager, receiver: TrelloWebhookReceiver):
+    import logging
+    logger = logging.getLogger(__name__)
+
+    while True:
+        webhook_id = await trello_manager.ensure_webhook(
+            Config.TRELLO_BOARD_ID, receiver.callback_url, "Telegram-бот заказов: списки и поля доски")
+        if webhook_id is not None:
+            break
+        logger.warning("Webhook Trello не зарегистрирован, метаданные доски обновляются по TTL; "
+                       "повтор через %.0f с", Config.TRELLO_WEBHOOK_RETRY_DELAY)
+        await asyncio.sleep(Config.TRELLO_WEBHOOK_RETRY_DELAY)
+    # webhook есть только у этой доски: доски маршрутов обновляются с обычным TTL
+    trello_manager.metadata.set_ttl(Config.TRELLO_BOARD_ID, Config.TRELLO_WEBHOOK_METADATA_TTL)
+
+
+# HTTP-приложение бота: webhook Telegram и/или webhook Trello (None - сервер не нужен)
+def create_web_app(bot: Bot, dp: Dispatcher,
+                   trello_receiver: Optional[TrelloWebhookReceiver]) -> Optional[web.Application]:
+    if Config.UPDATES_MODE != 'webhook' and trello_receiver is None:
+        return None
+
+    app = web.Application()
+    if Config.UPDATES_MODE == 'webhook':
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=Config.WEBHOOK_SECRET
+        ).register(app, path=Config.WEBHOOK_PATH)
+    if trello_receiver is not None:
+        trello_receiver.register(app, Config.TRELLO_WEBHOOK_PATH)
+    return app
+
+
+# запустить HTTP-сервер бота
+async def start_web_server(app: web.Application) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, Config.WEB_SERVER_HOST, Config.WEB_SERVER_PORT)
+    await site.start()
+    return runner
+
+
+# дождаться сигнала остановки (SIGINT/SIGTERM от pm2 или Ctrl+C)
+async def wait_for_shutdown():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+# прием апдейтов через webhook: встроенный aiohttp-сервер (create_web_app) передает
+# апдейты тому же диспетчеру. Telegram получает ответ сразу, апдейт обрабатывается в фоне
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    import logging
+    logger = logging.getLogger(__name__)
+
+    await bot.set_webhook(
+        Config.WEBHOOK_URL.rstrip('/') + Config.WEBHOOK_PATH,
+        secret_token=Config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=min(100, Config.MAX_CONCURRENT_UPDATES)
+    )
+    logger.info("Webhook установлен, сервер слушает порт %s", Config.WEB_SERVER_PORT)
+
+    # webhook при остановке не удаляем: за балансировщиком его обслуживают другие процессы,
+    # а необработанные апдейты Telegram доставит после перезапуска
+    await wait_for_shutdown()
 
 
 async def main():
     try:
-        setup_logging()
+        startup = StartupTimer()
+        with startup.phase('logging'):
+            setup_logging()
 
         import logging
         logger = logging.getLogger(__name__)
 
-        validate_config()
+        with startup.phase('config'):
+            validate_config()
         logger.info("Конфигурация проверена успешно")
 
-        bot = Bot(token=Config.TELEGRAM_BOT_TOKEN)
-        dp = Dispatcher()
+        with startup.phase('init'):
+            bot = Bot(token=Config.TELEGRAM_BOT_TOKEN)
+            dp = Dispatcher()
+
+            os.makedirs(Config.DATA_DIR, exist_ok=True)
+            trello_manager = create_trello_manager()
 
-        trello_manager = TrelloManager(
-            Config.TRELLO_API_KEY, Config.TRELLO_TOKEN)
+            # Очередь заказов и воркеры, создающие карточки
+            outbox = Outbox(Config.OUTBOX_DB_FILE) if Config.OUTBOX_ENABLED else None
+            profiler = create_profiler()
+            workers = create_workers(bot, outbox, profiler, trello_manager.breaker) if outbox is not None else None
+            dedup = create_dedup()
+            router = create_router()
+            card_index = create_card_index()
+            order_stats = create_order_stats()
+            reminders = create_reminders()
 
-        # Настраиваем обработчики
-        dp = setup_handlers(dp, trello_manager)
+            # Настраиваем обработчики
+            concurrency = setup_dispatcher(dp, trello_manager, outbox, profiler, dedup, router, card_index,
+                                           order_stats, reminders)
         logger.info("Обработчики настроены")
 
         # Регистрируем команды меню
@@ -36,16 +371,89 @@ async def main():
             types.BotCommand(command="fields",
                              description="Показать доступные поля Trello")
         ]
-        await bot.set_my_commands(commands)
+        if card_index is not None:
+            commands.append(types.BotCommand(command="find",
+                                             description="Найти заказ по клиенту, названию или телефону"))
+        if order_stats is not None:
+            commands.append(types.BotCommand(command="stats", description="Статистика заказов"))
+        with startup.phase('set_my_commands'):
+            await bot.set_my_commands(commands)
         logger.info("Команды меню зарегистрированы")
 
+        metrics_runner = None
+        if Config.METRICS_ENABLED:
+            with startup.phase('metrics'):
+                register_runtime_metrics(trello_manager, concurrency, outbox, reminders)
+                metrics_runner = await start_metrics_server(
+                    Config.METRICS_HOST, Config.METRICS_PORT, Config.METRICS_PATH)
+
+        # Метаданные доски берем из снимка на диске и обновляем в фоне; без снимка
+        # первый заказ дождется того же фонового запроса к Trello
+        with startup.phase('metadata'):
+            from_snapshot = await trello_manager.warm_up(Config.TRELLO_BOARD_ID, wait=False)
+            # доски из правил маршрутизации - тоже в фоне, но без постоянного обновления
+            for board_id in router.boards()[1:]:
+                await trello_manager.metadata.warm_up(board_id, wait=False)
+        if not from_snapshot:
+            logger.info("Снимка метаданных доски нет, они загружаются в фоне")
+        if order_stats is not None:
+            order_stats.start_reconciliation(trello_manager, router.boards(), Config.STATS_RECONCILE_INTERVAL)
+
+        # HTTP-сервер для webhook Telegram и Trello
+        trello_receiver = create_trello_webhook_receiver(trello_manager)
+        web_app = create_web_app(bot, dp, trello_receiver)
+        web_runner = None
+        if web_app is not None:
+            with startup.phase('web_server'):
+                web_runner = await start_web_server(web_app)
+        trello_webhook_task = None
+        if trello_receiver is not None:
+            # в фоне: Trello сначала проверяет адрес, запуск бота этого не ждет
+            trello_webhook_task = asyncio.create_task(
+                register_trello_webhook(trello_manager, trello_receiver))
+        startup.report(logger)
+
         # Запускаем бота
         logger.info("Бот запущен")
-        await dp.start_polling(bot)
+        if workers is not None:
+            workers.start()
+        if reminders is not None:
+            reminders.start(bot)
+        try:
+            if Config.UPDATES_MODE == 'webhook':
+                await run_webhook(bot, dp)
+            else:
+                # сессию бота закрываем сами - после обработки оставшихся апдейтов
+                await dp.start_polling(bot, close_bot_session=False)
+        finally:
+            # перестаем принимать запросы, дожидаемся уже принятых апдейтов,
+            # затем останавливаем воркеров
+            if trello_webhook_task is not None:
+                trello_webhook_task.cancel()
+            if web_runner is not None:
+                await web_runner.cleanup()
+            await concurrency.drain(Config.SHUTDOWN_DRAIN_TIMEOUT)
+            if workers is not None:
+                await workers.stop()
+                outbox.close()
+            if reminders is not None:
+                await reminders.stop()
+                reminders.close()
+            if dedup is not None:
+                dedup.close()
+            if card_index is not None:
+                card_index.close()
+            if order_stats is not None:
+                await order_stats.stop()
+                order_stats.close()
+            await trello_manager.close()
+            await bot.session.close()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
 
     except Exception as e:
         import logging
-        logging.error(f"Ошибка при запуске бота: {e}")
+        logging.error("Ошибка при запуске бота: %s", e)
 
 if __name__ == "__main__":
     asyncio.run(main())
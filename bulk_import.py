@@ -0,0 +1,180 @@
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import re
+from datetime import date, datetime
+from typing import Any, Awaitable, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils import parse_message, normalize_fields
+
+try:
+    import openpyxl
+except ImportError:  # XLSX поддерживается только при установленном openpyxl
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+# строка-разделитель заказов в одном сообщении: три и более дефиса
+ORDER_DELIMITER = re.compile(r'^\s*-{3,}\s*$', re.MULTILINE)
+
+# поддерживаемые форматы файлов
+TABLE_EXTENSIONS = ('.csv', '.xlsx')
+
+# сколько строк файла читать за один переход в поток
+ROWS_BATCH = 50
+
+
+# есть ли в сообщении несколько заказов
+def is_bulk_message(text: str) -> bool:
+    return ORDER_DELIMITER.search(text) is not None
+
+
+# разбить сообщение на заказы: [(метка, данные)]
+def split_orders(text: str) -> List[Tuple[str, Dict[str, str]]]:
+    blocks = [block for block in ORDER_DELIMITER.split(text) if block.strip()]
+    return [(f"Заказ {number}", parse_message(block)) for number, block in enumerate(blocks, start=1)]
+
+
+def is_table_file(file_name: Optional[str]) -> bool:
+    return bool(file_name) and file_name.lower().endswith(TABLE_EXTENSIONS)
+
+
+# прочитать строки CSV/XLSX по одной: [(метка, данные)].
+# первая строка - названия полей, как в сообщении ("имя карточки", "клиент", ...)
+def iter_table_orders(file: BinaryIO, file_name: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+    if file_name.lower().endswith('.xlsx'):
+        rows = _iter_xlsx_rows(file)
+    else:
+        rows = _iter_csv_rows(file)
+
+    header = None
+    for line_number, row in enumerate(rows, start=1):
+        if header is None:
+            header = row
+            continue
+        if not any(value.strip() for value in row):
+            continue
+        yield f"Строка {line_number}", normalize_fields(dict(zip(header, row)))
+
+
+def _iter_csv_rows(file: BinaryIO) -> Iterator[List[str]]:
+    sample = file.read(4096)
+    file.seek(0)
+
+    # Excel в русской локали сохраняет CSV в cp1251 и с разделителем ";".
+    # образец может оборваться посреди многобайтного символа: неполный символ
+    # в конце образца не считается ошибкой (final=False)
+    try:
+        sample_text = codecs.getincrementaldecoder('utf-8-sig')().decode(sample, final=False)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        sample_text = sample.decode('cp1251', errors='replace')
+        encoding = 'cp1251'
+
+    try:
+        dialect = csv.Sniffer().sniff(sample_text, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    text = io.TextIOWrapper(file, encoding=encoding, newline='')
+    try:
+        yield from csv.reader(text, dialect)
+    finally:
+        text.detach()
+
+
+def _iter_xlsx_rows(file: BinaryIO) -> Iterator[List[str]]:
+    if openpyxl is None:
+        raise RuntimeError("Для импорта XLSX установите пакет openpyxl")
+
+    # read_only - строки читаются из архива по мере обхода, а не целиком
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield [_cell_to_str(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def _cell_to_str(value: Any) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%d.%m.%Y')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# выполнить импорт: заказы читаются из orders (файл читается в отдельном потоке
+# пачками), create_order(метка, данные) вызывается не больше concurrency раз одновременно.
+# результат: [(метка, успех, текст)] в порядке следования заказов
+async def run_bulk_import(orders: Iterator[Tuple[str, Dict[str, str]]],
+                          create_order: Callable[[str, Dict[str, str]], Awaitable[Tuple[bool, str]]],
+                          concurrency: int = 4) -> List[Tuple[str, bool, str]]:
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: Dict[int, Tuple[str, bool, str]] = {}
+
+    async def produce():
+        index = 0
+        while True:
+            batch = await asyncio.to_thread(_take_batch, orders, ROWS_BATCH)
+            for label, data in batch:
+                await queue.put((index, label, data))
+                index += 1
+            if len(batch) < ROWS_BATCH:
+                break
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                index, label, data = item
+                try:
+                    ok, text = await create_order(label, data)
+                except Exception as e:
+                    logger.error("Ошибка импорта (%s): %s", label, e, exc_info=True)
+                    ok, text = False, "внутренняя ошибка"
+                results[index] = (label, ok, text)
+            finally:
+                queue.task_done()
+
+    consumers = [asyncio.create_task(consume()) for _ in range(max(1, concurrency))]
+    try:
+        await produce()
+    finally:
+        for _ in consumers:
+            await queue.put(None)
+        await asyncio.gather(*consumers)
+
+    return [results[index] for index in sorted(results)]
+
+
+def _take_batch(orders: Iterator, size: int) -> List:
+    batch = []
+    for item in orders:
+        batch.append(item)
+        if len(batch) == size:
+            break
+    return batch
+
+
+# итоговый отчет по импорту, разбитый на сообщения не длиннее limit символов
+def format_import_summary(results: List[Tuple[str, bool, str]], limit: int = 4000) -> List[str]:
+    created = sum(1 for _, ok, _ in results if ok)
+    header = f"📦 <b>Импорт заказов:</b> создано {created} из {len(results)}\n"
+
+    messages = []
+    current = header
+    for label, ok, text in results:
+        line = f"{'✅' if ok else '❌'} {label}: {text}\n"
+        if len(current) + len(line) > limit:
+            messages.append(current)
+            current = ""
+        current += line
+    messages.append(current)
+    return messages
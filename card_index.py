@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from field_schema import DATE_FORMATS, ORDER_SCHEMA, parse_date
+
+logger = logging.getLogger(__name__)
+
+WORD = re.compile(r'\w+')
+DIGIT_RUN = re.compile(r'\d[\d\s()+-]*\d')
+LETTER = re.compile(r'[^\W\d_]')
+# телефон ищется и по окончанию номера: хранятся все окончания от MIN_DIGITS цифр
+MIN_DIGITS = 5
+# в длинном номере ищутся последние PHONE_DIGITS цифр: +7 912... и 8 912... - один номер
+PHONE_DIGITS = 10
+
+
+# ё и е в поиске не различаются
+def fold(text: str) -> str:
+    return text.replace('ё', 'е').replace('Ё', 'Е')
+
+
+# окончания номеров телефонов и других длинных чисел в тексте: "+7 912 345-67-89"
+# дает 79123456789, 9123456789, ... 56789, поэтому номер находится в любой записи
+def digit_terms(text: str) -> List[str]:
+    terms = []
+    for run in DIGIT_RUN.findall(text):
+        digits = re.sub(r'\D', '', run)
+        for start in range(len(digits) - MIN_DIGITS + 1):
+            if digits[start:] not in terms:
+                terms.append(digits[start:])
+    return terms
+
+
+# запрос FTS5 из текста пользователя: слова ищутся по началу, все слова обязательны.
+# текст без букв с MIN_DIGITS и больше цифр считается номером телефона
+def fts_query(text: str) -> Optional[str]:
+    digits = re.sub(r'\D', '', text)
+    if len(digits) >= MIN_DIGITS and not LETTER.search(text):
+        return f'digits : "{digits[-PHONE_DIGITS:]}"*'
+    words = WORD.findall(fold(text.lower()))
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# дата создания карточки из ее ID (первые 4 байта ObjectId - время в секундах)
+def card_created_at(card_id: str) -> float:
+    try:
+        return float(int(card_id[:8], 16))
+    except ValueError:
+        return time.time()
+
+
+# поля заказа из кастомных полей карточки Trello: {поле сообщения: значение}
+def trello_card_fields(card: Dict[str, Any], custom_fields: Dict[str, Dict], board_id: str) -> Dict[str, str]:
+    by_id = {info['id']: (field_name, info) for field_name, (_, info)
+             in ORDER_SCHEMA.compiled_for(board_id, custom_fields).items()}
+    fields = {}
+    for item in card.get('customFieldItems') or []:
+        found = by_id.get(item.get('idCustomField'))
+        if found is None:
+            continue
+        field_name, info = found
+        value = item.get('value') or {}
+        if info['type'] == 'list':
+            options = {option_id: text for text, option_id in info.get('options', {}).items()}
+            text = options.get(item.get('idValue'))
+        elif 'date' in value:
+            parsed = parse_date(value['date'][:10])
+            text = parsed.strftime(DATE_FORMATS[0]) if parsed is not None else value['date']
+        elif 'checked' in value:
+            text = 'да' if value['checked'] == 'true' else 'нет'
+        else:
+            text = value.get('text') or value.get('number')
+        if text:
+            fields[field_name] = str(text)
+    return fields
+
+
+# локальный полнотекстовый индекс карточек заказов (SQLite FTS5).
+# карточка попадает в индекс сразу после создания ботом, поэтому /find отвечает
+# без запросов к Trello. sync дочитывает изменения, сделанные в самом Trello:
+# переписываются только карточки с новой датой последней активности
+class CardIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cards (
+                card_id TEXT PRIMARY KEY,
+                board_id TEXT NOT NULL,
+                url TEXT NOT NULL,
+                name TEXT NOT NULL,
+                fields TEXT NOT NULL DEFAULT '{}',
+                creator TEXT,
+                created_at REAL NOT NULL,
+                activity TEXT
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cards_board ON cards (board_id)")
+        # строки индекса связаны со строками cards через rowid
+        self._conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5(
+                name, body, creator, digits, tokenize = 'unicode61 remove_diacritics 2'
+            )""")
+
+    async def _run(self, func: Callable, *args) -> Any:
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    # выполнить func в одной транзакции (вызывается под self._lock)
+    def _transaction(self, func: Callable) -> Any:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func()
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return result
+
+    # записать карточку и ее строку поиска (вызывается под self._lock)
+    def _upsert(self, card_id: str, board_id: str, url: str, name: str, fields: Dict[str, str],
+                description: str, created_at: float, activity: Optional[str]):
+        creator = fields.get('telegram пользователь')
+        rowid = self._conn.execute("""
+            INSERT INTO cards (card_id, board_id, url, name, fields, creator, created_at, activity)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (card_id) DO UPDATE SET
+                board_id = excluded.board_id, url = excluded.url, name = excluded.name,
+                fields = excluded.fields, creator = excluded.creator, activity = excluded.activity
+            RETURNING rowid""",
+            (card_id, board_id, url, name, json.dumps(fields, ensure_ascii=False), creator,
+             created_at, activity)).fetchone()[0]
+        values = [value for field_name, value in fields.items() if field_name != 'telegram пользователь']
+        body = '\n'.join(values + [description])
+        self._conn.execute("DELETE FROM cards_fts WHERE rowid = ?", (rowid,))
+        self._conn.execute(
+            "INSERT INTO cards_fts (rowid, name, body, creator, digits) VALUES (?, ?, ?, ?, ?)",
+            (rowid, fold(name), fold(body), fold(creator or ''), ' '.join(digit_terms(body))))
+
+    # карточка создана ботом: card - {'id', 'shortUrl'}, data - поля из сообщения
+    async def add(self, card: Dict[str, Any], data: Dict[str, str], board_id: str):
+        fields = {field_name: value for field_name, value in data.items() if field_name != 'имя карточки'}
+
+        def save():
+            self._upsert(card['id'], board_id, card.get('shortUrl', ''), data['имя карточки'],
+                         fields, '', time.time(), None)
+        await self._run(self._transaction, save)
+
+    # найти карточки: лучшие совпадения (название важнее полей), при равенстве - новые выше
+    async def search(self, text: str, limit: int = 10) -> List[Dict[str, Any]]:
+        query = fts_query(text)
+        if query is None:
+            return []
+
+        def select():
+            rows = self._conn.execute("""
+                SELECT cards.card_id, cards.url, cards.name, cards.fields, cards.created_at
+                FROM cards_fts JOIN cards ON cards.rowid = cards_fts.rowid
+                WHERE cards_fts MATCH ?
+                ORDER BY bm25(cards_fts, 10.0, 1.0, 2.0, 5.0), cards.created_at DESC
+                LIMIT ?""", (query, limit)).fetchall()
+            return [{'id': card_id, 'shortUrl': url, 'name': name, 'fields': json.loads(fields),
+                     'created_at': created_at}
+                    for card_id, url, name, fields, created_at in rows]
+        return await self._run(select)
+
+    # дочитать изменения карточек доски. fetch_cards возвращает все карточки доски из Trello
+    # (name, desc, shortUrl, dateLastActivity, customFieldItems) или None при ошибке,
+    # custom_fields - поля доски. карточки, которых больше нет на доске, удаляются из индекса
+    # (кроме созданных ботом, пока шел запрос). возвращает (обновлено, удалено) или None
+    async def sync(self, board_id: str, fetch_cards: Callable[[], Awaitable[Optional[List[Dict[str, Any]]]]],
+                   custom_fields: Dict[str, Dict]) -> Optional[Tuple[int, int]]:
+        started = time.time()
+        cards = await fetch_cards()
+        if cards is None:
+            return None
+
+        def apply():
+            known = {card_id: (activity, json.loads(fields)) for card_id, activity, fields in self._conn.execute(
+                "SELECT card_id, activity, fields FROM cards WHERE board_id = ? AND created_at < ?",
+                (board_id, started))}
+            updated = 0
+            for card in cards:
+                activity = card.get('dateLastActivity')
+                old = known.pop(card['id'], None)
+                if old is not None and activity is not None and old[0] == activity:
+                    continue
+                # поля только из описания (и автор) остаются от сообщения, кастомные - из Trello
+                fields = old[1] if old is not None else {}
+                fields.update(trello_card_fields(card, custom_fields, board_id))
+                self._upsert(card['id'], board_id, card.get('shortUrl', ''), card.get('name', ''),
+                             fields, card.get('desc', ''), card_created_at(card['id']), activity)
+                updated += 1
+            for card_id in known:
+                self._conn.execute(
+                    "DELETE FROM cards_fts WHERE rowid = (SELECT rowid FROM cards WHERE card_id = ?)",
+                    (card_id,))
+                self._conn.execute("DELETE FROM cards WHERE card_id = ?", (card_id,))
+            return updated, len(known)
+
+        updated, removed = await self._run(self._transaction, apply)
+        logger.info("Индекс карточек доски %s: обновлено %s, удалено %s", board_id, updated, removed)
+        return updated, removed
+
+    async def count(self) -> int:
+        return await self._run(lambda: self._conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0])
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
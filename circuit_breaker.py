@@ -0,0 +1,149 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+# Trello считается недоступным: запрос не отправлялся
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Trello недоступен, повтор через {retry_after:.0f} с")
+        self.retry_after = retry_after
+
+
+# защита от долгих сбоев Trello.
+# за последние window секунд считаются ошибки (5xx, таймауты, обрывы соединения)
+# и медленные ответы (дольше slow_call_seconds). если вызовов не меньше min_calls
+# и доля ошибок достигла failure_rate или доля медленных - slow_call_rate,
+# цепь размыкается: open_seconds запросы сразу получают CircuitOpenError, не занимая
+# соединения и воркеров. затем пропускается probes пробных запросов (half-open):
+# успех замыкает цепь, ошибка снова размыкает ее
+class CircuitBreaker:
+    def __init__(self, failure_rate: float = 0.5, slow_call_rate: float = 0.8,
+                 slow_call_seconds: float = 5.0, window: float = 30.0, min_calls: int = 10,
+                 open_seconds: float = 30.0, probes: int = 1):
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.window = window
+        self.min_calls = max(1, min_calls)
+        self.open_seconds = open_seconds
+        self.probes = max(1, probes)
+
+        self.state = CLOSED
+        # (время, ошибка, медленный) в порядке завершения
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._failures = 0
+        self._slow = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+        self.opened = 0
+        self.rejected = 0
+
+    # сколько секунд цепь еще будет разомкнута (0 - запросы пропускаются)
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    # разрешение на запрос; True - это пробный запрос в состоянии half-open
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            wait = self.retry_after()
+            if wait > 0:
+                self.rejected += 1
+                raise CircuitOpenError(wait)
+            self.state = HALF_OPEN
+            logger.info("Цепь Trello полуоткрыта: пробный запрос")
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.probes:
+                self.rejected += 1
+                raise CircuitOpenError(1.0)
+            self._probes_in_flight += 1
+            return True
+        return False
+
+    # результат запроса, получившего разрешение.
+    # count_slow=False - запрос долгий сам по себе (загрузка файла, все карточки доски),
+    # его длительность не говорит о перегрузке Trello
+    def record(self, failed: bool, duration: float, probe: bool = False, count_slow: bool = True):
+        slow = count_slow and duration >= self.slow_call_seconds
+        if probe:
+            self._probes_in_flight -= 1
+            if failed or slow:
+                self._open("пробный запрос неудачен")
+            else:
+                self._close()
+            return
+        if self.state != CLOSED:
+            # ответ на запрос, отправленный до размыкания цепи
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed, slow))
+        self._failures += failed
+        self._slow += slow
+        while self._calls and now - self._calls[0][0] > self.window:
+            _, old_failed, old_slow = self._calls.popleft()
+            self._failures -= old_failed
+            self._slow -= old_slow
+
+        total = len(self._calls)
+        if total >= self.min_calls and (self._failures / total >= self.failure_rate
+                                        or self._slow / total >= self.slow_call_rate):
+            self._open(f"ошибок {self._failures}, медленных {self._slow} из {total}")
+
+    # запрос отменен до ответа (например, проиграл дублирующему запросу)
+    def release(self, probe: bool = False):
+        if probe:
+            self._probes_in_flight -= 1
+
+    def _open(self, reason: str):
+        self.opened += 1
+        logger.warning("Цепь Trello разомкнута на %.0f с: %s", self.open_seconds, reason)
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+
+    def _close(self):
+        logger.info("Цепь Trello замкнута: Trello снова отвечает")
+        self.state = CLOSED
+        self._calls.clear()
+        self._failures = 0
+        self._slow = 0
+
+
+# бюджет времени на обработку одного заказа: крайний срок для всех запросов к Trello
+# в текущем контексте (создание карточки и заполнение полей делят один бюджет)
+_deadline: ContextVar[Optional[float]] = ContextVar('trello_deadline', default=None)
+
+
+@contextmanager
+def latency_budget(seconds: Optional[float]):
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+# сколько секунд бюджета осталось (None - бюджет не задан)
+def remaining_budget() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
@@ -9,10 +9,148 @@ class Config:
     TRELLO_TOKEN = os.getenv('TRELLO_TOKEN')
     TRELLO_BOARD_ID = os.getenv('TRELLO_BOARD_ID')
     TRELLO_LIST = os.getenv('TRELLO_LIST')
-    BASE_URL = "https://api.trello.com/1"
+    BASE_URL = os.getenv('TRELLO_BASE_URL', "https://api.trello.com/1")
 
     TELEGRAM_BOT_TOKEN = os.getenv('TG_FALKOV_PROBA_BOT_TOKEN')
 
+    # пул keep-alive соединений к Trello (общий на весь процесс бота)
+    TRELLO_POOL_SIZE = int(os.getenv('TRELLO_POOL_SIZE', '20'))
+    TRELLO_KEEPALIVE_TIMEOUT = float(os.getenv('TRELLO_KEEPALIVE_TIMEOUT', '60'))
+    TRELLO_CONNECT_TIMEOUT = float(os.getenv('TRELLO_CONNECT_TIMEOUT', '5'))
+    TRELLO_TIMEOUT = float(os.getenv('TRELLO_TIMEOUT', '10'))
+
+    # каталог для баз SQLite, снимка метаданных и профилей (пути ниже можно задать отдельно)
+    DATA_DIR = os.getenv('DATA_DIR', 'data')
+
+    # время жизни кэша метаданных доски (списки и кастомные поля), секунд
+    TRELLO_METADATA_TTL = float(os.getenv('TRELLO_METADATA_TTL', '300'))
+    # снимок списков и кастомных полей на диске: после перезапуска бот не ждет Trello
+    # (пустое значение - не сохранять)
+    TRELLO_METADATA_SNAPSHOT = os.getenv('TRELLO_METADATA_SNAPSHOT', os.path.join(DATA_DIR, 'board_metadata.json'))
+    # сколько досок держать в кэше метаданных (при маршрутизации заказов на несколько досок)
+    TRELLO_MAX_CACHED_BOARDS = int(os.getenv('TRELLO_MAX_CACHED_BOARDS', '50'))
+    # правила выбора доски и списка по чату, пользователю или полю заказа (см. routing.py);
+    # если файла нет, все заказы идут в TRELLO_BOARD_ID / TRELLO_LIST
+    ROUTING_FILE = os.getenv('ROUTING_FILE', 'routing.json')
+
+    # сколько кастомных полей одной карточки заполнять одновременно
+    TRELLO_FIELD_CONCURRENCY = int(os.getenv('TRELLO_FIELD_CONCURRENCY', '5'))
+
+    # заполнять все кастомные поля одним запросом (при отказе Trello - по одному)
+    TRELLO_BULK_CUSTOM_FIELDS = os.getenv('TRELLO_BULK_CUSTOM_FIELDS', 'true').lower() == 'true'
+
+    # лимит запросов к Trello (~100 за 10 с на токен, оставляем запас) и повторы при 429/5xx
+    TRELLO_RATE_LIMIT = int(os.getenv('TRELLO_RATE_LIMIT', '90'))
+    TRELLO_RATE_PERIOD = float(os.getenv('TRELLO_RATE_PERIOD', '10'))
+    TRELLO_RATE_BURST = int(os.getenv('TRELLO_RATE_BURST', '10'))
+    TRELLO_MAX_RETRIES = int(os.getenv('TRELLO_MAX_RETRIES', '4'))
+    TRELLO_RETRY_BACKOFF = float(os.getenv('TRELLO_RETRY_BACKOFF', '0.5'))
+    TRELLO_RETRY_MAX_DELAY = float(os.getenv('TRELLO_RETRY_MAX_DELAY', '30'))
+
+    # circuit breaker: если за TRELLO_BREAKER_WINDOW секунд не меньше TRELLO_BREAKER_MIN_CALLS
+    # запросов и среди них доля ошибок >= TRELLO_BREAKER_FAILURE_RATE или доля ответов дольше
+    # TRELLO_BREAKER_SLOW_CALL секунд >= TRELLO_BREAKER_SLOW_RATE, запросы к Trello
+    # TRELLO_BREAKER_OPEN секунд не отправляются, заказы в очереди откладываются
+    TRELLO_BREAKER_ENABLED = os.getenv('TRELLO_BREAKER_ENABLED', 'true').lower() == 'true'
+    TRELLO_BREAKER_FAILURE_RATE = float(os.getenv('TRELLO_BREAKER_FAILURE_RATE', '0.5'))
+    TRELLO_BREAKER_SLOW_RATE = float(os.getenv('TRELLO_BREAKER_SLOW_RATE', '0.8'))
+    TRELLO_BREAKER_SLOW_CALL = float(os.getenv('TRELLO_BREAKER_SLOW_CALL', '5'))
+    TRELLO_BREAKER_WINDOW = float(os.getenv('TRELLO_BREAKER_WINDOW', '30'))
+    TRELLO_BREAKER_MIN_CALLS = int(os.getenv('TRELLO_BREAKER_MIN_CALLS', '10'))
+    TRELLO_BREAKER_OPEN = float(os.getenv('TRELLO_BREAKER_OPEN', '30'))
+    # бюджет времени на запросы к Trello для одного заказа (карточка и поля), секунд; 0 - без бюджета
+    ORDER_LATENCY_BUDGET = float(os.getenv('ORDER_LATENCY_BUDGET', '20'))
+    # повторить GET метаданных доски, если Trello не ответил за столько секунд (0 - не повторять)
+    TRELLO_HEDGE_DELAY = float(os.getenv('TRELLO_HEDGE_DELAY', '2'))
+
+    # очередь заказов в SQLite: сообщение сразу получает ответ "принят",
+    # карточку создают воркеры (false - создавать карточку прямо в обработчике)
+    OUTBOX_ENABLED = os.getenv('OUTBOX_ENABLED', 'true').lower() == 'true'
+    OUTBOX_DB_FILE = os.getenv('OUTBOX_DB_FILE', os.path.join(DATA_DIR, 'outbox.db'))
+    OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+    OUTBOX_LEASE = float(os.getenv('OUTBOX_LEASE', '300'))
+
+    # массовый импорт заказов (несколько заказов в сообщении, файлы CSV/XLSX)
+    BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '4'))
+    BULK_MAX_FILE_SIZE = 20 * 1024 * 1024  # больше Bot API скачать не даст
+    BULK_SPOOL_SIZE = 1024 * 1024          # до этого размера файл держим в памяти
+
+    # фото и файлы к заказу: передаются из Telegram в Trello потоком, без сохранения целиком.
+    # ATTACHMENT_MEMORY_BUDGET - сколько байт буферов могут занимать одновременные загрузки
+    ATTACHMENT_MEMORY_BUDGET = int(os.getenv('ATTACHMENT_MEMORY_BUDGET', str(4 * 1024 * 1024)))
+    ATTACHMENT_CHUNK_SIZE = int(os.getenv('ATTACHMENT_CHUNK_SIZE', str(64 * 1024)))
+    ATTACHMENT_TIMEOUT = float(os.getenv('ATTACHMENT_TIMEOUT', '120'))
+    ATTACHMENT_MAX_FILE_SIZE = 20 * 1024 * 1024  # больше Bot API скачать не даст
+    MEDIA_GROUP_DELAY = float(os.getenv('MEDIA_GROUP_DELAY', '1.0'))  # ожидание остальных фото альбома, с
+
+    # прием апдейтов: polling | webhook
+    UPDATES_MODE = os.getenv('UPDATES_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес бота, например https://bot.example.com
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    WEB_SERVER_HOST = os.getenv('WEB_SERVER_HOST', '0.0.0.0')
+    WEB_SERVER_PORT = int(os.getenv('WEB_SERVER_PORT', '8080'))
+
+    # webhook Trello: изменения списков и кастомных полей доски приходят сразу, без опроса.
+    # TRELLO_WEBHOOK_URL - публичный адрес бота (по умолчанию WEBHOOK_URL), TRELLO_API_SECRET -
+    # секрет приложения Trello для проверки подписи. пока webhook работает, доска
+    # перечитывается раз в TRELLO_WEBHOOK_METADATA_TTL секунд на случай пропущенных событий.
+    # неудачная регистрация повторяется через TRELLO_WEBHOOK_RETRY_DELAY секунд
+    TRELLO_WEBHOOKS_ENABLED = os.getenv('TRELLO_WEBHOOKS_ENABLED', 'false').lower() == 'true'
+    TRELLO_WEBHOOK_URL = os.getenv('TRELLO_WEBHOOK_URL', WEBHOOK_URL or '')
+    TRELLO_WEBHOOK_PATH = os.getenv('TRELLO_WEBHOOK_PATH', '/trello/webhook')
+    TRELLO_API_SECRET = os.getenv('TRELLO_API_SECRET')
+    TRELLO_WEBHOOK_METADATA_TTL = float(os.getenv('TRELLO_WEBHOOK_METADATA_TTL', '21600'))
+    TRELLO_WEBHOOK_RETRY_DELAY = float(os.getenv('TRELLO_WEBHOOK_RETRY_DELAY', '300'))
+
+    # сколько апдейтов обрабатывать одновременно и сколько ждать их при остановке
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '50'))
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '30'))
+
+    # Метрики Prometheus (отдельный порт, наружу его открывать не нужно)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+    METRICS_PATH = os.getenv('METRICS_PATH', '/metrics')
+
+    # защита от дублей: тот же заказ от того же пользователя в том же чате в течение
+    # DEDUP_TTL секунд не создает новую карточку. DEDUP_DB_FILE - хранить между перезапусками
+    # (пустое значение - только в памяти)
+    DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', 'true').lower() == 'true'
+    DEDUP_TTL = float(os.getenv('DEDUP_TTL', '900'))
+    DEDUP_MAX_SIZE = int(os.getenv('DEDUP_MAX_SIZE', '10000'))
+    DEDUP_DB_FILE = os.getenv('DEDUP_DB_FILE', os.path.join(DATA_DIR, 'dedup.db'))
+
+    # локальный поиск по карточкам заказов (/find) без запросов к Trello;
+    # /reindex дочитывает в индекс карточки, измененные в самом Trello (по умолчанию выключен)
+    CARD_INDEX_ENABLED = os.getenv('CARD_INDEX_ENABLED', 'false').lower() == 'true'
+    CARD_INDEX_DB_FILE = os.getenv('CARD_INDEX_DB_FILE', os.path.join(DATA_DIR, 'cards.db'))
+    CARD_INDEX_SEARCH_LIMIT = int(os.getenv('CARD_INDEX_SEARCH_LIMIT', '10'))
+
+    # статистика заказов (/stats): счетчики обновляются при создании карточки,
+    # раз в STATS_RECONCILE_INTERVAL секунд сверяются с досками (0 - не сверять). по умолчанию выключена
+    STATS_ENABLED = os.getenv('STATS_ENABLED', 'false').lower() == 'true'
+    STATS_DB_FILE = os.getenv('STATS_DB_FILE', os.path.join(DATA_DIR, 'stats.db'))
+    STATS_RECONCILE_INTERVAL = float(os.getenv('STATS_RECONCILE_INTERVAL', str(6 * 3600)))
+
+    # напоминания о крайнем сроке в чат, где создан заказ: за REMINDER_DAYS_BEFORE дней
+    # (через запятую, 0 - в день срока) в REMINDER_HOUR часов. напоминание, опоздавшее
+    # больше чем на REMINDER_MAX_DELAY секунд (бот был выключен), не отправляется. по умолчанию выключены
+    REMINDERS_ENABLED = os.getenv('REMINDERS_ENABLED', 'false').lower() == 'true'
+    REMINDERS_DB_FILE = os.getenv('REMINDERS_DB_FILE', os.path.join(DATA_DIR, 'reminders.db'))
+    REMINDER_DAYS_BEFORE = [int(days) for days in os.getenv('REMINDER_DAYS_BEFORE', '1,0').split(',') if days.strip()]
+    REMINDER_HOUR = int(os.getenv('REMINDER_HOUR', '10'))
+    REMINDER_MAX_DELAY = float(os.getenv('REMINDER_MAX_DELAY', str(12 * 3600)))
+
+    # профилирование медленных апдейтов: отчеты о тех, что дольше порога,
+    # и профиль cProfile для доли апдейтов PROFILING_SAMPLE_RATE
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(DATA_DIR, 'profiles'))
+    PROFILING_THRESHOLD = float(os.getenv('PROFILING_THRESHOLD', '2'))
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0.05'))
+    PROFILING_MAX_FILES = int(os.getenv('PROFILING_MAX_FILES', '200'))
+
     # Обязательные поля (только имя карточки)
     REQUIRED_FIELDS = ["имя карточки"]
 
@@ -32,6 +170,14 @@ class Config:
         raise ValueError(
             "DEV_OR_PROD в файле 'config.py' должно быть только DEV или PROD")
 
+    # ротация logs.log: size - по размеру, time - по времени (LOG_ROTATE_WHEN, например midnight)
+    LOG_ROTATION = os.getenv('LOG_ROTATION', 'size')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', 'midnight')
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+    # сколько записей может ждать записи на диск; при переполнении новые записи отбрасываются
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
 
 # проверка обязательных переменных окружения
 def validate_config():
@@ -43,6 +189,17 @@ def validate_config():
         'TELEGRAM_BOT_TOKEN': Config.TELEGRAM_BOT_TOKEN
     }
 
+    if Config.UPDATES_MODE not in ('polling', 'webhook'):
+        raise ValueError("UPDATES_MODE должно быть только polling или webhook")
+
+    if Config.UPDATES_MODE == 'webhook':
+        required_vars['WEBHOOK_URL'] = Config.WEBHOOK_URL
+        required_vars['WEBHOOK_SECRET'] = Config.WEBHOOK_SECRET
+
+    if Config.TRELLO_WEBHOOKS_ENABLED:
+        required_vars['TRELLO_WEBHOOK_URL'] = Config.TRELLO_WEBHOOK_URL
+        required_vars['TRELLO_API_SECRET'] = Config.TRELLO_API_SECRET
+
     missing_vars = [var for var, value in required_vars.items() if not value]
 
     if missing_vars:
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# поля, которые не относятся к содержимому заказа
+IGNORED_FIELDS = {'telegram пользователь'}
+
+WHITESPACE = re.compile(r'\s+')
+
+
+# отпечаток заказа: чат, пользователь и поля заказа без различий в регистре,
+# пробелах и порядке строк (те же данные, набранные заново, дают тот же отпечаток)
+def order_fingerprint(chat_id: int, user_id: Optional[int], data: Dict[str, str]) -> str:
+    fields = sorted(
+        (name, WHITESPACE.sub(' ', value).strip().lower())
+        for name, value in data.items() if name not in IGNORED_FIELDS
+    )
+    content = json.dumps([chat_id, user_id, fields], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+# запись о заказе: card - созданная карточка ({'id', 'shortUrl'}), None - карточка еще создается
+class DedupEntry:
+    def __init__(self, card: Optional[Dict[str, Any]] = None, created_at: Optional[float] = None):
+        self.card = card
+        self.created_at = time.time() if created_at is None else created_at
+
+
+# кэш недавних заказов для защиты от дублей.
+# ограничен по размеру (max_size) и по времени (ttl): записи хранятся в порядке
+# добавления, поэтому самые старые (и первыми устаревшие) всегда в начале.
+# если задан path, созданные карточки сохраняются в SQLite и переживают перезапуск
+class DedupCache:
+    def __init__(self, ttl: float = 900, max_size: int = 10000, path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self._entries: 'OrderedDict[str, DedupEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.duplicates = 0
+
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS dedup (
+                    fingerprint TEXT PRIMARY KEY,
+                    card TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS dedup_created ON dedup (created_at)")
+            self._load()
+
+    # загрузить непросроченные записи при старте
+    def _load(self):
+        cutoff = time.time() - self.ttl
+        self._conn.execute("DELETE FROM dedup WHERE created_at < ?", (cutoff,))
+        rows = self._conn.execute(
+            "SELECT fingerprint, card, created_at FROM dedup ORDER BY created_at DESC LIMIT ?",
+            (self.max_size,)).fetchall()
+        for fingerprint, card, created_at in reversed(rows):
+            self._entries[fingerprint] = DedupEntry(json.loads(card), created_at)
+        if rows:
+            logger.info("Загружено записей защиты от дублей: %s", len(rows))
+
+    async def _run(self, func: Callable, *args) -> Any:
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    def _evict(self):
+        cutoff = time.time() - self.ttl
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if entry.created_at >= cutoff and len(self._entries) <= self.max_size:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, fingerprint: str) -> Optional[DedupEntry]:
+        entry = self._entries.get(fingerprint)
+        if entry is not None and time.time() - entry.created_at > self.ttl:
+            del self._entries[fingerprint]
+            return None
+        return entry
+
+    # занять отпечаток до создания карточки.
+    # возвращает существующую запись, если такой заказ уже создан или создается, иначе None
+    def reserve(self, fingerprint: str) -> Optional[DedupEntry]:
+        entry = self.get(fingerprint)
+        if entry is not None:
+            self.duplicates += 1
+            return entry
+        self._entries[fingerprint] = DedupEntry()
+        self._evict()
+        return None
+
+    # карточка создана: следующие дубли получат ссылку на нее
+    async def complete(self, fingerprint: str, card: Dict[str, Any]):
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            entry = self._entries[fingerprint] = DedupEntry()
+            self._evict()
+        entry.card = card
+
+        if self._conn is not None:
+            def save():
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO dedup (fingerprint, card, created_at) VALUES (?, ?, ?)",
+                    (fingerprint, json.dumps(card, ensure_ascii=False), entry.created_at))
+                # заодно удаляем устаревшие записи, чтобы база не росла
+                self._conn.execute("DELETE FROM dedup WHERE created_at < ?", (time.time() - self.ttl,))
+            await self._run(save)
+
+    # карточку создать не удалось: такой же заказ можно отправить снова
+    def release(self, fingerprint: str):
+        entry = self._entries.get(fingerprint)
+        if entry is not None and entry.card is None:
+            del self._entries[fingerprint]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
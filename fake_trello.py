@@ -0,0 +1,351 @@
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from trello_webhooks import trello_signature
+
+# локальная замена Trello API для нагрузочных тестов.
+# реализует только запросы, которые делает AsyncTrelloManager, и умеет
+# добавлять задержку, пачки 429 и ошибки 5xx.
+#   python fake_trello.py --port 8081 --latency 0.2 --error-rate 0.05
+# и в .env бота: TRELLO_BASE_URL=http://127.0.0.1:8081/1
+# зарегистрированным webhook отправляет события об изменении списков и полей
+# (rename_list, create_custom_field, ...). отдельное событие в работающий бот:
+#   python fake_trello.py --post-sample updateList --callback https://bot.example.com/trello/webhook --secret ...
+
+DEFAULT_LISTS = ['Заказы', 'В работе', 'Готово']
+
+DEFAULT_CUSTOM_FIELDS = [
+    ('дата заказа', 'date'),
+    ('крайний срок', 'date'),
+    ('клиент', 'text'),
+    ('цвет', 'text'),
+    ('имя', 'text'),
+    ('телефон', 'text'),
+    ('telegram пользователь', 'text'),
+]
+
+
+class FakeTrello:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, error_rate: float = 0.0,
+                 burst_every: float = 0.0, burst_duration: float = 1.0, retry_after: float = 1.0,
+                 rate_limit: int = 100, rate_period: float = 10.0,
+                 lists: Optional[List[str]] = None, custom_fields: Optional[List[tuple]] = None,
+                 webhook_secret: str = 'fake-secret'):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_duration = burst_duration
+        self.retry_after = retry_after
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+
+        self.webhook_secret = webhook_secret
+        self._ids = itertools.count(1)
+        self.board = {'id': self._new_id(), 'name': 'Заказы'}
+        self.webhooks: List[Dict[str, str]] = []
+        self.lists = [{'id': self._new_id(), 'name': name} for name in (lists or DEFAULT_LISTS)]
+        self.custom_fields = [
+            {'id': self._new_id(), 'name': name, 'type': field_type, 'options': []}
+            for name, field_type in (custom_fields or DEFAULT_CUSTOM_FIELDS)
+        ]
+        self.cards: Dict[str, Dict[str, Any]] = {}
+
+        self.calls = Counter()       # {(эндпоинт, статус): количество}
+        self.card_calls = Counter()  # {ID карточки: количество запросов}
+        self._started = time.monotonic()
+        self._recent = deque()       # время запросов для лимита Trello
+
+        self.app = web.Application(middlewares=[self._faults])
+        self.app.add_routes([
+            web.get('/1/boards/{board_id}/lists', self.get_lists),
+            web.get('/1/lists/{list_id}/cards', self.get_list_cards),
+            web.get('/1/boards/{board_id}/customFields', self.get_custom_fields),
+            web.post('/1/cards', self.post_card),
+            web.put('/1/cards/{card_id}/customFields', self.put_custom_fields),
+            web.post('/1/cards/{card_id}/attachments', self.post_attachment),
+            web.put('/1/card/{card_id}/customField/{field_id}/item', self.put_custom_field_item),
+            web.get('/1/boards/{board_id}', self.get_board),
+            web.get('/1/boards/{board_id}/cards/{filter}', self.get_board_cards),
+            web.get('/1/tokens/{token}/webhooks', self.get_webhooks),
+            web.post('/1/webhooks', self.post_webhook),
+        ])
+
+    # как ObjectId в Trello: первые 4 байта - время создания в секундах
+    def _new_id(self) -> str:
+        return f"{int(time.time()):08x}{next(self._ids):016x}"
+
+    # задержка, лимит запросов, пачки 429 и случайные 5xx для всех эндпоинтов
+    @web.middleware
+    async def _faults(self, request: web.Request, handler):
+        endpoint = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        card_id = request.match_info.get('card_id')
+        if card_id:
+            self.card_calls[card_id] += 1
+
+        if self.latency:
+            await asyncio.sleep(random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > self.rate_period:
+            self._recent.popleft()
+        in_burst = self.burst_every and (now - self._started) % self.burst_every < self.burst_duration
+
+        if in_burst or len(self._recent) >= self.rate_limit:
+            response = web.json_response(
+                {'message': 'API_TOKEN_LIMIT_EXCEEDED'}, status=429,
+                headers={'Retry-After': str(self.retry_after)})
+        elif random.random() < self.error_rate:
+            response = web.Response(status=random.choice([500, 502, 503]), text='Internal Server Error')
+        else:
+            self._recent.append(now)
+            response = await handler(request)
+
+        self.calls[(f"{request.method} {endpoint}", response.status)] += 1
+        return response
+
+    async def get_lists(self, request: web.Request) -> web.Response:
+        return web.json_response(self.lists)
+
+    async def get_custom_fields(self, request: web.Request) -> web.Response:
+        return web.json_response(self.custom_fields)
+
+    # открытые карточки списка, новые первыми
+    async def get_list_cards(self, request: web.Request) -> web.Response:
+        cards = sorted((card for card in self.cards.values() if card['idList'] == request.match_info['list_id']),
+                       key=lambda card: card['id'], reverse=True)
+        return web.json_response([{'id': card['id'], 'name': card['name'], 'desc': card['desc'],
+                                   'shortUrl': card['shortUrl']} for card in cards])
+
+    async def post_card(self, request: web.Request) -> web.Response:
+        card_id = self._new_id()
+        self.card_calls[card_id] += 1
+        self.cards[card_id] = {
+            'id': card_id,
+            'idList': request.query.get('idList'),
+            'name': request.query.get('name', ''),
+            'desc': request.query.get('desc', ''),
+            'customFields': {},
+            'attachments': [],
+            'shortUrl': f"https://trello.local/c/{card_id[-8:]}",
+        }
+        self._touch(self.cards[card_id])
+        short_url = self.cards[card_id]['shortUrl']
+        return web.json_response({
+            'id': card_id, 'name': self.cards[card_id]['name'],
+            'shortUrl': short_url, 'url': short_url,
+        })
+
+    # дата последней активности карточки меняется при любом изменении, как в Trello
+    def _touch(self, card: Dict[str, Any]):
+        card['dateLastActivity'] = datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+    async def put_custom_fields(self, request: web.Request) -> web.Response:
+        card = self.cards.get(request.match_info['card_id'])
+        if card is None:
+            return web.Response(status=404, text='card not found')
+        body = await request.json()
+        for item in body.get('customFieldItems', []):
+            card['customFields'][item['idCustomField']] = item.get('value') or item.get('idValue')
+        self._touch(card)
+        return web.json_response({})
+
+    # файл читается потоком, как у Trello; сохраняются только имя, тип и размер
+    async def post_attachment(self, request: web.Request) -> web.Response:
+        card = self.cards.get(request.match_info['card_id'])
+        if card is None:
+            return web.Response(status=404, text='card not found')
+        reader = await request.multipart()
+        part = await reader.next()
+        size = 0
+        while True:
+            chunk = await part.read_chunk()
+            if not chunk:
+                break
+            size += len(chunk)
+        attachment = {'id': self._new_id(), 'name': request.query.get('name', part.filename),
+                      'mimeType': request.query.get('mimeType'), 'bytes': size}
+        card['attachments'].append(attachment)
+        return web.json_response(attachment)
+
+    async def put_custom_field_item(self, request: web.Request) -> web.Response:
+        card = self.cards.get(request.match_info['card_id'])
+        if card is None:
+            return web.Response(status=404, text='card not found')
+        body = await request.json()
+        card['customFields'][request.match_info['field_id']] = body.get('value') or body.get('idValue')
+        self._touch(card)
+        return web.json_response({})
+
+    # любой ID доски отвечает одной и той же доской; вложенные списки и поля - как у Trello
+    async def get_board(self, request: web.Request) -> web.Response:
+        board = dict(self.board)
+        if request.query.get('lists') == 'open':
+            board['lists'] = self.lists
+        if request.query.get('customFields') == 'true':
+            board['customFields'] = self.custom_fields
+        return web.json_response(board)
+
+    # карточки доски страницами по limit, следующая страница - карточки старше before
+    async def get_board_cards(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get('limit', '1000'))
+        before = request.query.get('before')
+        cards = sorted(self.cards.values(), key=lambda card: card['id'], reverse=True)
+        if before:
+            cards = [card for card in cards if card['id'] < before]
+        return web.json_response([{
+            'id': card['id'], 'name': card['name'], 'desc': card['desc'], 'shortUrl': card['shortUrl'],
+            'dateLastActivity': card['dateLastActivity'],
+            'customFieldItems': [
+                {'idCustomField': field_id, 'value': value} if isinstance(value, dict)
+                else {'idCustomField': field_id, 'idValue': value}
+                for field_id, value in card['customFields'].items()],
+        } for card in cards[:limit]])
+
+    # изменить карточку "в Trello": name, desc или {название поля: текст}
+    def edit_card(self, card_id: str, fields: Optional[Dict[str, str]] = None, **changes):
+        card = self.cards[card_id]
+        card.update(changes)
+        by_name = {field['name'].lower(): field['id'] for field in self.custom_fields}
+        for name, text in (fields or {}).items():
+            card['customFields'][by_name[name.lower()]] = {'text': text}
+        self._touch(card)
+
+    async def get_webhooks(self, request: web.Request) -> web.Response:
+        return web.json_response(self.webhooks)
+
+    # как и Trello, проверяет адрес запросом HEAD перед созданием webhook
+    async def post_webhook(self, request: web.Request) -> web.Response:
+        callback_url = request.query.get('callbackURL', '')
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.head(callback_url) as response:
+                    if response.status != 200:
+                        return web.Response(status=400, text='URL (callbackURL) did not return 200 status code')
+        except aiohttp.ClientError:
+            return web.Response(status=400, text='URL (callbackURL) is unreachable')
+
+        webhook = {'id': self._new_id(), 'idModel': request.query.get('idModel'),
+                   'callbackURL': callback_url, 'description': request.query.get('description', ''),
+                   'active': True}
+        self.webhooks.append(webhook)
+        return web.json_response(webhook)
+
+    # отправить событие во все webhook, подписанное как в Trello
+    async def emit(self, action_type: str, data: Dict[str, Any]):
+        data = {**data, 'board': self.board}
+        for webhook in self.webhooks:
+            await post_action(webhook['callbackURL'], self.webhook_secret, action_type, data, self.board)
+
+    async def rename_list(self, old_name: str, new_name: str):
+        trello_list = next(item for item in self.lists if item['name'] == old_name)
+        trello_list['name'] = new_name
+        await self.emit('updateList', {'list': dict(trello_list), 'old': {'name': old_name}})
+
+    async def archive_list(self, name: str):
+        trello_list = next(item for item in self.lists if item['name'] == name)
+        self.lists.remove(trello_list)
+        await self.emit('updateList', {'list': {**trello_list, 'closed': True}, 'old': {'closed': False}})
+
+    async def create_custom_field(self, name: str, field_type: str = 'text'):
+        field = {'id': self._new_id(), 'name': name, 'type': field_type, 'options': []}
+        self.custom_fields.append(field)
+        await self.emit('createCustomField', {'customField': {'id': field['id'], 'name': name, 'type': field_type}})
+
+    async def rename_custom_field(self, old_name: str, new_name: str):
+        field = next(item for item in self.custom_fields if item['name'] == old_name)
+        field['name'] = new_name
+        await self.emit('updateCustomField', {'customField': {'id': field['id'], 'name': new_name},
+                                              'old': {'name': old_name}})
+
+    async def delete_custom_field(self, name: str):
+        field = next(item for item in self.custom_fields if item['name'] == name)
+        self.custom_fields.remove(field)
+        await self.emit('deleteCustomField', {'customField': {'id': field['id'], 'name': name}})
+
+    # сколько кастомных полей заполнено у каждой карточки: {название: количество}
+    def filled_fields_by_name(self) -> Dict[str, int]:
+        return {card['name']: len(card['customFields']) for card in self.cards.values()}
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def calls_by_endpoint(self) -> Dict[str, Dict[int, int]]:
+        result = defaultdict(dict)
+        for (endpoint, status), count in sorted(self.calls.items()):
+            result[endpoint][status] = count
+        return dict(result)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> web.AppRunner:
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+# отправить событие webhook в формате Trello (action + model) с подписью X-Trello-Webhook
+async def post_action(callback_url: str, secret: str, action_type: str, data: Dict[str, Any],
+                      board: Dict[str, str]) -> int:
+    body = json.dumps({
+        'action': {'id': f"{random.getrandbits(96):024x}", 'type': action_type, 'data': data,
+                   'date': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())},
+        'model': board,
+    }, ensure_ascii=False).encode('utf-8')
+    headers = {'Content-Type': 'application/json',
+               'X-Trello-Webhook': trello_signature(secret, body, callback_url)}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(callback_url, data=body, headers=headers) as response:
+            return response.status
+
+
+# примеры событий для --post-sample
+SAMPLE_ACTIONS = {
+    'updateList': {'list': {'id': '5f0000000000000000000001', 'name': 'Новые заказы'},
+                   'old': {'name': 'Заказы'}},
+    'createList': {'list': {'id': '5f0000000000000000000002', 'name': 'Срочные'}},
+    'createCustomField': {'customField': {'id': '5f0000000000000000000003', 'name': 'адрес', 'type': 'text'}},
+    'updateCustomField': {'customField': {'id': '5f0000000000000000000003', 'name': 'адрес доставки'},
+                          'old': {'name': 'адрес'}},
+    'deleteCustomField': {'customField': {'id': '5f0000000000000000000003', 'name': 'адрес доставки'}},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Trello API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.05, help="средняя задержка ответа, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 5xx")
+    parser.add_argument('--burst-every', type=float, default=0.0, help="период пачек 429, с (0 - без пачек)")
+    parser.add_argument('--burst-duration', type=float, default=1.0)
+    parser.add_argument('--post-sample', choices=sorted(SAMPLE_ACTIONS),
+                        help="не запускать сервер, а отправить пример события webhook в --callback")
+    parser.add_argument('--callback', help="адрес webhook бота (TRELLO_WEBHOOK_URL + TRELLO_WEBHOOK_PATH)")
+    parser.add_argument('--secret', default='fake-secret', help="TRELLO_API_SECRET бота")
+    parser.add_argument('--board-id', default='5f00000000000000000000aa')
+    args = parser.parse_args()
+
+    if args.post_sample:
+        board = {'id': args.board_id, 'name': 'Заказы'}
+        data = {**SAMPLE_ACTIONS[args.post_sample], 'board': board}
+        status = asyncio.run(post_action(args.callback, args.secret, args.post_sample, data, board))
+        print(f"{args.post_sample}: {status}")
+        return
+
+    fake = FakeTrello(latency=args.latency, error_rate=args.error_rate,
+                      burst_every=args.burst_every, burst_duration=args.burst_duration)
+    web.run_app(fake.app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
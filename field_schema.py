@@ -0,0 +1,165 @@
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# форматы дат в сообщениях; первым идет тот, к которому приводятся все даты
+DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y')
+
+FIELD_TYPES = ('text', 'date', 'number', 'list')
+
+
+# дата из значения поля: кавычки и время отбрасываются
+def parse_date(value: str) -> Optional[datetime]:
+    parts = value.replace('"', '').replace("'", "").split()
+    if not parts:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(parts[0], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+# число из значения поля: пробелы убираются, запятая допускается как разделитель
+def parse_number(value: str) -> Optional[str]:
+    number = value.replace(' ', '').replace(',', '.')
+    try:
+        float(number)
+    except ValueError:
+        return None
+    return number
+
+
+# описание одного поля заказа.
+# trello_field - название кастомного поля Trello (по умолчанию совпадает с name),
+# bound=False - поле никогда не пишется в кастомные поля (например, название карточки).
+# validator получает нормализованное значение и возвращает текст ошибки или None
+class FieldSpec:
+    def __init__(self, name: str, field_type: str = 'text', label: Optional[str] = None,
+                 aliases: Sequence[str] = (), trello_field: Optional[str] = None, bound: bool = True,
+                 choices: Sequence[str] = (), validator: Optional[Callable[[str], Optional[str]]] = None):
+        if field_type not in FIELD_TYPES:
+            raise ValueError(f"Неизвестный тип поля {name}: {field_type}")
+        self.name = name.lower()
+        self.type = field_type
+        self.label = label
+        self.aliases = tuple(alias.lower() for alias in aliases)
+        self.trello_field = (trello_field or name).lower() if bound else None
+        self.choices = {choice.lower(): choice for choice in choices}
+        self.validator = validator
+
+    # привести значение к единому виду при разборе сообщения.
+    # значение, которое не подходит по типу, остается как есть - его отклонит check
+    def normalize(self, value: str) -> str:
+        if self.type == 'date':
+            parsed = parse_date(value)
+            if parsed is not None:
+                return parsed.strftime(DATE_FORMATS[0])
+            # как раньше: без кавычек и времени
+            parts = value.replace('"', '').replace("'", "").split()
+            return parts[0] if parts else ''
+        if self.type == 'number':
+            return parse_number(value) or value
+        if self.type == 'list':
+            return self.choices.get(value.lower(), value)
+        return value
+
+    # текст ошибки для нормализованного значения или None
+    def check(self, value: str) -> Optional[str]:
+        if self.type == 'date' and parse_date(value) is None:
+            return f"{self.name}: «{value}» - не дата (нужно ДД.ММ.ГГГГ)"
+        if self.type == 'number' and parse_number(value) is None:
+            return f"{self.name}: «{value}» - не число"
+        if self.type == 'list' and self.choices and value.lower() not in self.choices:
+            return f"{self.name}: «{value}» - допустимо {', '.join(self.choices.values())}"
+        if self.validator is not None:
+            return self.validator(value)
+        return None
+
+
+# схема полей заказа: все таблицы поиска строятся один раз при создании схемы,
+# а привязка к кастомным полям доски - один раз на версию метаданных доски
+class FieldSchema:
+    def __init__(self, specs: Sequence[FieldSpec]):
+        self.specs: Dict[str, FieldSpec] = {spec.name: spec for spec in specs}
+        # {название или синоним: название поля}
+        self.aliases: Dict[str, str] = {}
+        for spec in specs:
+            self.aliases[spec.name] = spec.name
+            for alias in spec.aliases:
+                self.aliases.setdefault(alias, spec.name)
+        # {поле: нормализация} - только для полей, значение которых меняется
+        self.normalizers: Dict[str, Callable[[str], str]] = {
+            spec.name: spec.normalize for spec in specs if spec.type != 'text' or spec.choices}
+        self.checked: Dict[str, FieldSpec] = {
+            spec.name: spec for spec in specs if spec.type != 'text' or spec.choices or spec.validator}
+        # подписи стандартных полей для описания карточки, в порядке схемы
+        self.labels: List[Tuple[str, str]] = [(spec.name, spec.label) for spec in specs if spec.label]
+        # {ID доски: (словарь полей, таблица)} - заказы разных досок не вытесняют друг друга
+        self._compiled: Dict[str, Tuple[Dict[str, Dict], Dict[str, Tuple[str, Dict]]]] = {}
+
+    def canonical(self, field_name: str) -> str:
+        return self.aliases.get(field_name, field_name)
+
+    # название кастомного поля Trello для поля сообщения (None - только в описание)
+    def trello_name(self, field_name: str) -> Optional[str]:
+        spec = self.specs.get(field_name)
+        return spec.trello_field if spec is not None else field_name
+
+    # ошибки в значениях полей (пустой список - все в порядке)
+    def validate(self, data: Dict[str, str]) -> List[str]:
+        errors = []
+        for field_name, spec in self.checked.items():
+            value = data.get(field_name)
+            if value:
+                error = spec.check(value)
+                if error:
+                    errors.append(error)
+        return errors
+
+    # таблица {поле сообщения: (название поля Trello, описание поля)} для кастомных полей доски.
+    # поля вне схемы привязываются по совпадению названия
+    def compile(self, custom_fields: Dict[str, Dict]) -> Dict[str, Tuple[str, Dict]]:
+        table = {name: (name, info) for name, info in custom_fields.items()}
+        for spec in self.specs.values():
+            table.pop(spec.name, None)
+            if spec.trello_field is None:
+                continue
+            info = custom_fields.get(spec.trello_field)
+            if info is None:
+                continue
+            table[spec.name] = (spec.trello_field, info)
+            if spec.type != 'text' and info['type'] not in (spec.type, 'text'):
+                logger.warning("Поле '%s' в схеме имеет тип %s, а в Trello - %s",
+                               spec.name, spec.type, info['type'])
+        return table
+
+    # скомпилированная таблица для текущих метаданных доски board_id.
+    # кэш метаданных заменяет словарь полей целиком при любом изменении,
+    # поэтому достаточно сравнить его с тем, для которого таблица доски уже построена
+    def compiled_for(self, board_id: str, custom_fields: Dict[str, Dict]) -> Dict[str, Tuple[str, Dict]]:
+        compiled = self._compiled.get(board_id)
+        if compiled is None or compiled[0] is not custom_fields:
+            compiled = (custom_fields, self.compile(custom_fields))
+            self._compiled[board_id] = compiled
+        return compiled[1]
+
+
+# поля заказа. чтобы добавить поле или синоним, достаточно дописать его сюда
+ORDER_SCHEMA = FieldSchema([
+    FieldSpec('имя карточки', label="📝 **Название карточки:**",
+              aliases=('название', 'название карточки'), bound=False),
+    FieldSpec('дата заказа', 'date', label="📅 **Дата заказа:**", aliases=('дата',)),
+    FieldSpec('крайний срок', 'date', label="⏰ **Крайний срок:**", aliases=('срок', 'дедлайн')),
+    FieldSpec('клиент', label="👥 **Клиент:**", aliases=('заказчик',)),
+    FieldSpec('цвет', label="🎨 **Цвет:**"),
+    FieldSpec('имя', label="👤 **Имя:**"),
+    FieldSpec('телефон', label="📞 **Телефон:**", aliases=('тел', 'тел.')),
+    FieldSpec('дополнительно', label="📝 **Дополнительно:**", aliases=('комментарий', 'примечание')),
+    FieldSpec('telegram пользователь', label="👤 **Создал:**", trello_field=Config.TELEGRAM_USER_FIELD),
+])
@@ -1,27 +1,87 @@
+import asyncio
+import html
 import logging
-from aiogram import types
-from aiogram.filters import Command
+import sqlite3
+import time
+from functools import partial
+from tempfile import SpooledTemporaryFile
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from aiogram import Bot, F, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 
-from trello_api import TrelloManager
-from utils import parse_message, format_card_description, validate_required_fields
+from attachments import AttachmentUploader, MediaGroupCollector, message_attachments
+from circuit_breaker import CircuitOpenError, latency_budget
+from metrics import ORDERS, STAGE_SECONDS
+from card_index import CardIndex, card_created_at
+from order_stats import OrderStats
+from reminders import ReminderScheduler
+from bulk_import import (is_bulk_message, split_orders, is_table_file, iter_table_orders,
+                         run_bulk_import, format_import_summary)
+from dedup import DedupCache, DedupEntry, order_fingerprint
+from field_schema import ORDER_SCHEMA
+from outbox import JobDeferred, Outbox
+from routing import Route, Router
+from trello_api import AsyncTrelloManager
+from utils import parse_message, format_card_description, validate_required_fields, validate_field_values
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# сколько секунд поставленный заказ ждет записи ID ответа "заказ принят", прежде чем
+# воркеры возьмут его без него (если бот упал между очередью и ответом)
+REPLY_HOLD = 30
+
 # Инициализация менеджера Trello будет в основном файле
-trello_manager = None
+trello_manager: AsyncTrelloManager = None
+# очередь заказов (None - карточки создаются прямо в обработчике)
+outbox: Optional[Outbox] = None
+# защита от повторно отправленных заказов (None - выключена)
+dedup: Optional[DedupCache] = None
+# передача фото и файлов заказа в Trello (None - файлы не прикрепляются)
+uploader: Optional[AttachmentUploader] = None
+# фото альбома приходят отдельными сообщениями - собираем их в один заказ
+media_groups = MediaGroupCollector(Config.MEDIA_GROUP_DELAY)
+# выбор доски и списка для заказа (без правил - TRELLO_BOARD_ID и TRELLO_LIST)
+router: Optional[Router] = None
+# локальный поиск по созданным карточкам (None - /find выключен)
+card_index: Optional[CardIndex] = None
+# статистика заказов для /stats (None - выключена)
+order_stats: Optional[OrderStats] = None
+# напоминания о крайнем сроке (None - выключены)
+reminders: Optional[ReminderScheduler] = None
+# одна синхронизация индекса с Trello за раз
+reindex_lock = asyncio.Lock()
 
 
 # настройка обработчиков для диспетчера
-def setup_handlers(dp, manager):
-    global trello_manager
+def setup_handlers(dp, manager, order_outbox: Optional[Outbox] = None,
+                   order_dedup: Optional[DedupCache] = None,
+                   attachment_uploader: Optional[AttachmentUploader] = None,
+                   order_router: Optional[Router] = None,
+                   order_index: Optional[CardIndex] = None,
+                   stats: Optional[OrderStats] = None,
+                   reminder_scheduler: Optional[ReminderScheduler] = None):
+    global trello_manager, outbox, dedup, uploader, router, card_index, order_stats, reminders
     trello_manager = manager
+    outbox = order_outbox
+    dedup = order_dedup
+    uploader = attachment_uploader
+    router = order_router or Router(Route(Config.TRELLO_BOARD_ID, Config.TRELLO_LIST))
+    card_index = order_index
+    order_stats = stats
+    reminders = reminder_scheduler
 
     # регистрация обработчиков команд
     dp.message.register(cmd_start, Command("start"))
     dp.message.register(cmd_help, Command("help"))
     dp.message.register(cmd_fields, Command("fields"))
+    dp.message.register(cmd_find, Command("find"))
+    dp.message.register(cmd_reindex, Command("reindex"))
+    dp.message.register(cmd_stats, Command("stats"))
+    dp.message.register(handle_document, F.document)
+    dp.message.register(handle_attachment_message, F.photo)
     dp.message.register(handle_message)
 
     return dp
@@ -83,9 +143,18 @@ async def cmd_help(message: Message):
 
 <b>Обязательное поле:</b> имя карточки
 <b>Автоматически добавляется</b> ваше имя пользователя Telegram
-<b>Даты можно указывать</b> без кавычек.
+<b>Даты можно указывать</b> без кавычек. Даты проверяются сразу: ДД.ММ.ГГГГ, ГГГГ-ММ-ДД или ДД/ММ/ГГГГ.
+<b>Короткие названия полей:</b> название, дата, срок, заказчик, тел, комментарий.
+
+<b>Фото и файлы:</b> отправьте их с данными заказа в подписи - они будут прикреплены к карточке.
+
+<b>Напоминания:</b> если указан крайний срок, бот напомнит о нем в этот чат.
+
+<b>Несколько заказов сразу:</b> разделите их строкой <code>---</code> или пришлите файл CSV/XLSX, где первая строка - названия полей.
 
-<b>Используйте</b> /fields <b>чтобы посмотреть доступные кастомные поля.</b>"""
+<b>Используйте</b> /fields <b>чтобы посмотреть доступные кастомные поля.</b>
+<b>Поиск заказов:</b> /find <i>клиент, название или телефон</i>. /reindex - подтянуть изменения из Trello.
+<b>Статистика:</b> /stats - заказы по дням, авторам, клиентам и крайним срокам."""
     await message.answer(help_text, parse_mode="HTML")
 
 
@@ -93,8 +162,8 @@ async def cmd_help(message: Message):
 async def cmd_fields(message: Message):
     """Показать доступные кастомные поля"""
     try:
-        custom_fields = trello_manager.get_custom_fields(
-            Config.TRELLO_BOARD_ID)
+        custom_fields = await trello_manager.get_custom_fields(
+            order_route(message, {}).board_id)
 
         if custom_fields:
             fields_list = "\n".join(
@@ -115,18 +184,294 @@ async def cmd_fields(message: Message):
         await message.answer(f"❌ <b>Ошибка при получении кастомных полей:</b> {e}", parse_mode="HTML")
 
 
+# обработка команды find ----------------------------------
+# поиск по локальному индексу карточек, Trello не запрашивается
+async def cmd_find(message: Message, command: CommandObject):
+    if card_index is None:
+        await message.answer("ℹ️ <b>Поиск по карточкам выключен</b>", parse_mode="HTML")
+        return
+    query = (command.args or '').strip()
+    if not query:
+        await message.answer(
+            "🔎 <b>Что найти?</b> Например: <code>/find Иванов</code> или <code>/find 912 345 67 89</code>",
+            parse_mode="HTML")
+        return
+
+    with STAGE_SECONDS.time('find'):
+        cards = await card_index.search(query, Config.CARD_INDEX_SEARCH_LIMIT)
+    if not cards:
+        await message.answer(
+            f"🔎 <b>Ничего не найдено:</b> {html.escape(query)}\n\n"
+            "Карточки, измененные прямо в Trello, находятся после /reindex", parse_mode="HTML")
+        return
+
+    lines = [f"🔎 <b>Найдено по запросу «{html.escape(query)}»:</b>", ""]
+    for number, card in enumerate(cards, 1):
+        fields = card['fields']
+        details = [time.strftime('%d.%m.%Y', time.localtime(card['created_at']))]
+        details += [fields[field] for field in ('клиент', 'телефон', 'крайний срок') if fields.get(field)]
+        lines.append(f"{number}. <b>{html.escape(card['name'])}</b> — {card['shortUrl']}\n"
+                     f"    {html.escape(' · '.join(details))}")
+    await message.answer("\n".join(lines), parse_mode="HTML", disable_web_page_preview=True)
+
+
+# обработка команды stats ---------------------------------
+# ответ из счетчиков в памяти, Trello и база не запрашиваются
+async def cmd_stats(message: Message):
+    if order_stats is None:
+        await message.answer("ℹ️ <b>Статистика заказов выключена</b>", parse_mode="HTML")
+        return
+
+    today = time.strftime('%Y-%m-%d')
+    lines = [
+        "📊 <b>Статистика заказов</b>",
+        "",
+        f"<b>Сегодня:</b> {order_stats.orders_on(today)}",
+        f"<b>За 7 дней:</b> {order_stats.orders_last(7)}",
+        f"<b>За 30 дней:</b> {order_stats.orders_last(30)}",
+        f"<b>Всего:</b> {order_stats.total}",
+        "",
+        "⏰ <b>Крайний срок:</b> "
+        f"сегодня {order_stats.deadlines_in(0)}, завтра {order_stats.deadlines_in(1)}, "
+        f"в ближайшие 7 дней {sum(order_stats.deadlines_in(offset) for offset in range(7))}",
+    ]
+    for kind, title in (('creator', "👤 <b>Чаще всего создают:</b>"), ('client', "👥 <b>Частые клиенты:</b>")):
+        top = order_stats.top(kind)
+        if top:
+            lines += ["", title] + [f"• {html.escape(label)} — {count}" for label, count in top]
+    if order_stats.reconciled_at is not None:
+        lines += ["", "<i>Сверено с Trello: "
+                  f"{time.strftime('%d.%m.%Y %H:%M', time.localtime(order_stats.reconciled_at))}</i>"]
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+# обработка команды reindex -------------------------------
+# дочитать в индекс карточки, измененные в Trello (переписываются только измененные)
+async def cmd_reindex(message: Message):
+    if card_index is None:
+        await message.answer("ℹ️ <b>Поиск по карточкам выключен</b>", parse_mode="HTML")
+        return
+    if reindex_lock.locked():
+        await message.answer("⏳ <b>Индекс уже обновляется</b>", parse_mode="HTML")
+        return
+
+    async with reindex_lock:
+        lines = []
+        for board_id in router.boards():
+            try:
+                custom_fields = await trello_manager.get_custom_fields(board_id)
+                result = await card_index.sync(
+                    board_id, partial(trello_manager.get_board_cards, board_id), custom_fields)
+            except CircuitOpenError as e:
+                result = None
+                logger.warning("Индекс доски %s не обновлен: %s", board_id, e)
+            if result is None:
+                lines.append(f"❌ {board_id}: не удалось получить карточки из Trello")
+            else:
+                updated, removed = result
+                lines.append(f"✅ {board_id}: обновлено {updated}, удалено {removed}")
+        total = await card_index.count()
+    await message.answer(
+        "🔄 <b>Индекс карточек обновлен</b>\n\n" + "\n".join(lines) + f"\n\n<b>Всего в индексе:</b> {total}",
+        parse_mode="HTML")
+
+
+# доска и список для заказа из этого чата/от этого пользователя
+def order_route(message: Message, data: Dict[str, str]) -> Route:
+    user_id = message.from_user.id if message.from_user else None
+    return router.route(message.chat.id, user_id, data)
+
+
+# имя пользователя Telegram для карточки
+def get_user_info(user: types.User) -> str:
+    return f"@{user.username}" if user.username else f"{user.first_name} {user.last_name or ''}".strip()
+
+
+# подготовить данные для кастомных полей Trello из полей сообщения.
+# привязка полей к доске берется из схемы, скомпилированной для текущих метаданных:
+# на каждое поле - один поиск в словаре
+def build_custom_fields_data(data: Dict[str, str], custom_fields: Dict[str, Dict],
+                             board_id: str) -> Dict[str, Dict]:
+    custom_fields_data = {}
+    bindings = ORDER_SCHEMA.compiled_for(board_id, custom_fields)
+    log_fields = logger.isEnabledFor(logging.INFO)
+
+    # Проходим по всем полям из сообщения (включая добавленного пользователя)
+    for message_field, field_value in data.items():
+        binding = bindings.get(message_field)
+        if binding is None:
+            if log_fields:
+                logger.info("Поле '%s' отсутствует в Trello, будет добавлено только в описание", message_field)
+            continue
+
+        trello_field, field_info = binding
+        custom_fields_data[trello_field] = {
+            'id': field_info['id'],
+            'type': field_info['type'],
+            'options': field_info.get('options'),
+            'value': field_value
+        }
+        if log_fields:
+            logger.info("Подготовлено поле для Trello: %s = %s", trello_field, field_value)
+
+    return custom_fields_data
+
+
+# создать карточку заказа в Trello.
+# state - прогресс задачи из очереди: если карточка уже создана (card_id), повторно ее не создаем.
+# on_card_created вызывается сразу после создания карточки, до заполнения полей.
+# route - доска и список (по умолчанию - из настроек), chat_id - чат, куда придут
+# напоминания о крайнем сроке.
+# возвращает (успех, данные карточки или текст ошибки, результаты по полям)
+async def create_order_card(data: Dict[str, str], state: Optional[Dict[str, Any]] = None,
+                            on_card_created: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                            route: Optional[Route] = None,
+                            chat_id: Optional[int] = None,
+                            posted_since: Optional[float] = None) -> Tuple[bool, Any, Dict[str, bool]]:
+    state = state or {}
+    route = route or router.default
+
+    # Получаем ID списка в Trello
+    with STAGE_SECONDS.time('list_lookup'):
+        list_id = await trello_manager.get_list_id(route.board_id, route.list_name)
+    if not list_id:
+        return False, "Не удалось найти указанный список в Trello. Проверьте настройки.", {}
+
+    # Получаем кастомные поля доски
+    with STAGE_SECONDS.time('fields_lookup'):
+        custom_fields = await trello_manager.get_custom_fields(route.board_id)
+        custom_fields_data = build_custom_fields_data(data, custom_fields, route.board_id)
+    logger.info("Данные для кастомных полей: %s", custom_fields_data)
+
+    card = state.get('card')
+    if card is None and posted_since is not None:
+        card = await find_posted_card(list_id, data, posted_since)
+        if card is not None and on_card_created is not None:
+            await on_card_created(card)
+    if card is None:
+        # Создаем карточку в Trello
+        with STAGE_SECONDS.time('card_post'):
+            success, result = await trello_manager.post_card(
+                list_id, data['имя карточки'], format_card_description(data))
+        if not success:
+            return False, result, {}
+        card = {
+            'id': result['id'],
+            'shortUrl': result.get('shortUrl', result.get('url', ''))
+        }
+        if on_card_created is not None:
+            await on_card_created(card)
+
+    with STAGE_SECONDS.time('custom_fields'):
+        try:
+            field_results = await trello_manager.set_custom_fields(card['id'], custom_fields_data)
+        except CircuitOpenError as e:
+            # карточка уже есть: отвечаем ссылкой, а не "Trello недоступен" - иначе
+            # заказ пришлют еще раз и появится вторая карточка
+            logger.warning("Кастомные поля карточки %s не заполнены: %s", card['id'], e)
+            field_results = {field_name: False for field_name in custom_fields_data}
+    logger.info("Карточка создана с кастомными полями: %s", data['имя карточки'])
+    await record_card(card, data, route.board_id, chat_id)
+    return True, card, field_results
+
+
+# карточка заказа, созданная прошлой попыткой задачи, если ответ Trello до бота не дошел
+# (5xx или таймаут на POST /cards, остановка бота до сохранения state).
+# если проверить не удалось, создавать карточку нельзя - задача повторится
+async def find_posted_card(list_id: str, data: Dict[str, str], since: float) -> Optional[Dict[str, Any]]:
+    cards = await trello_manager.get_list_cards(list_id)
+    if cards is None:
+        raise RuntimeError("Не удалось проверить, создана ли карточка прошлой попыткой")
+    desc = format_card_description(data)
+    for card in cards:
+        # часы Trello и бота могут расходиться
+        if (card.get('name') == data['имя карточки'] and card.get('desc') == desc
+                and card_created_at(card['id']) >= since - 60):
+            logger.info("Карточка заказа уже создана прошлой попыткой: %s", card['id'])
+            return {'id': card['id'], 'shortUrl': card.get('shortUrl', '')}
+    return None
+
+
+# добавить карточку в локальный поиск, статистику и напоминания; ошибка базы не мешает заказу
+async def record_card(card: Dict[str, Any], data: Dict[str, str], board_id: str,
+                      chat_id: Optional[int] = None):
+    if card_index is not None:
+        try:
+            await card_index.add(card, data, board_id)
+        except sqlite3.Error as e:
+            logger.warning("Не удалось добавить карточку %s в индекс поиска: %s", card['id'], e)
+    if order_stats is not None:
+        try:
+            await order_stats.record(card['id'], data, board_id)
+        except sqlite3.Error as e:
+            logger.warning("Не удалось учесть карточку %s в статистике: %s", card['id'], e)
+    if reminders is not None and chat_id is not None:
+        try:
+            await reminders.schedule(card, data, chat_id)
+        except sqlite3.Error as e:
+            logger.warning("Не удалось запланировать напоминание для карточки %s: %s", card['id'], e)
+
+
+# текст ответа о созданной карточке
+def format_card_reply(data: Dict[str, str], card: Dict[str, Any], field_results: Dict[str, bool],
+                      attachment_results: Optional[Dict[str, bool]] = None) -> str:
+    card_url = card.get('shortUrl', card.get('url', ''))
+    filled_fields = [field for field, ok in field_results.items() if ok]
+    failed_fields = [field for field, ok in field_results.items() if not ok]
+
+    response_text = f"✅ <b>Карточка успешно создана в Trello!</b>\n\n<b>📋 Название:</b> {data['имя карточки']}\n<b>🔗 Ссылка:</b> {card_url}"
+
+    if filled_fields:
+        response_text += f"\n<b>📊 Заполнены кастомные поля:</b> {', '.join(filled_fields)}"
+    if failed_fields:
+        response_text += f"\n<b>⚠️ Не удалось заполнить поля:</b> {', '.join(failed_fields)}"
+
+    # Показываем поля, которые попали только в описание
+    description_only_fields = [field for field in data.keys()
+                               if field != "имя карточки" and ORDER_SCHEMA.trello_name(field) not in field_results]
+    if description_only_fields:
+        response_text += f"\n<b>📝 Только в описании:</b> {', '.join(description_only_fields)}"
+
+    if attachment_results:
+        attached = [name for name, ok in attachment_results.items() if ok]
+        not_attached = [html.escape(name) for name, ok in attachment_results.items() if not ok]
+        if attached:
+            response_text += f"\n<b>📎 Прикреплено файлов:</b> {len(attached)}"
+        if not_attached:
+            response_text += f"\n<b>⚠️ Не удалось прикрепить:</b> {', '.join(not_attached)}"
+
+    response_text += f"\n<b>👤 Создал:</b> {data['telegram пользователь']}"
+    return response_text
+
+
 # Обработчик всех сообщений -------------------------------
 async def handle_message(message: Message):
+    # Несколько заказов в одном сообщении
+    if message.text and is_bulk_message(message.text):
+        await handle_bulk_text(message)
+        return
+
+    with STAGE_SECONDS.time('total'):
+        await handle_order_message(message)
+
+
+# text - текст заказа (для фото и файлов - подпись), attachments - вложения для карточки
+async def handle_order_message(message: Message, text: Optional[str] = None,
+                               attachments: Optional[List[Dict[str, Any]]] = None):
     try:
         # Парсим сообщение
-        data = parse_message(message.text)
-        logger.info(f"Распарсенные данные: {data}")
+        with STAGE_SECONDS.time('parse'):
+            data = parse_message(message.text if text is None else text)
+        logger.info("Распарсенные данные: %s", data)
 
         # Проверяем обязательные поля (только имя карточки)
-        is_valid, missing_fields = validate_required_fields(
-            data, Config.REQUIRED_FIELDS)
+        with STAGE_SECONDS.time('validate'):
+            is_valid, missing_fields = validate_required_fields(
+                data, Config.REQUIRED_FIELDS)
+            field_errors = validate_field_values(data) if is_valid else []
 
         if not is_valid:
+            ORDERS.inc('invalid')
             await message.answer(
                 f"❌ <b>Отсутствует обязательное поле:</b> {', '.join(missing_fields)}\n\n"
                 "<b>Используйте</b> /help <b>для просмотра формата.</b>",
@@ -134,100 +479,415 @@ async def handle_message(message: Message):
             )
             return
 
-        # Получаем ID списка в Trello
-        list_id = trello_manager.get_list_id(
-            Config.TRELLO_BOARD_ID, Config.TRELLO_LIST)
-        if not list_id:
-            await message.answer("❌ <b>Не удалось найти указанный список в Trello. Проверьте настройки.</b>", parse_mode="HTML")
+        # Неверные даты, числа и т.п. - до обращения к Trello
+        if field_errors:
+            ORDERS.inc('invalid')
+            await message.answer(
+                "❌ <b>Неверные значения полей:</b>\n" + "\n".join(f"• {html.escape(error)}" for error in field_errors),
+                parse_mode="HTML"
+            )
             return
 
         # Добавляем информацию о пользователе Telegram
-        user_info = f"@{message.from_user.username}" if message.from_user.username else f"{message.from_user.first_name} {message.from_user.last_name or ''}".strip()
+        user_info = get_user_info(message.from_user)
         data['telegram пользователь'] = user_info
-        logger.info(f"Добавлен пользователь Telegram: {user_info}")
-
-        # форматируем данные для карточки
-        card_name = data['имя карточки']
-        card_description = format_card_description(data)
-
-        # Получаем кастомные поля доски
-        custom_fields = trello_manager.get_custom_fields(
-            Config.TRELLO_BOARD_ID)
-        logger.info(
-            f"Доступные кастомные поля в Trello: {list(custom_fields.keys())}")
-
-        # Подготавливаем данные для кастомных полей
-        custom_fields_data = {}
-
-        # Маппинг полей сообщения на кастомные поля Trello
-        field_mapping = {
-            "дата заказа": "дата заказа",
-            "крайний срок": "крайний срок",
-            "клиент": "клиент",
-            "цвет": "цвет",
-            "имя": "имя",
-            "телефон": "телефон",
-            "telegram пользователь": Config.TELEGRAM_USER_FIELD.lower()
-        }
+        logger.info("Добавлен пользователь Telegram: %s", user_info)
 
-        # Проходим по всем полям из сообщения (включая добавленного пользователя)
-        for message_field, field_value in data.items():
-            # Пропускаем обязательное поле "имя карточки"
-            if message_field == "имя карточки":
-                continue
-
-            # Проверяем, есть ли такое поле в Trello (прямое совпадение или через маппинг)
-            trello_field = field_mapping.get(message_field, message_field)
-
-            if trello_field in custom_fields:
-                # Добавляем информацию о поле для Trello API
-                custom_fields_data[trello_field] = {
-                    'id': custom_fields[trello_field]['id'],
-                    'type': custom_fields[trello_field]['type'],
-                    'value': field_value
-                }
-                logger.info(
-                    f"Подготовлено поле для Trello: {trello_field} = {field_value}")
-            else:
-                logger.info(
-                    f"Поле '{message_field}' отсутствует в Trello, будет добавлено только в описание")
-
-        logger.info(f"Данные для кастомных полей: {custom_fields_data}")
-
-        # Создаем карточку в Trello с кастомными полей
-        success, result = trello_manager.create_card_with_custom_fields(
-            list_id,
-            card_name,
-            card_description,
-            custom_fields_data,
-            Config.TRELLO_BOARD_ID
-        )
+        route = order_route(message, data)
 
-        if success:
-            card_url = result.get('shortUrl', result.get('url', ''))
-            filled_fields = list(custom_fields_data.keys())
+        if outbox is not None:
+            with STAGE_SECONDS.time('enqueue'):
+                await enqueue_order(message, data, attachments, route)
+            return
 
-            response_text = f"✅ <b>Карточка успешно создана в Trello!</b>\n\n<b>📋 Название:</b> {card_name}\n<b>🔗 Ссылка:</b> {card_url}"
+        # Такой же заказ уже создан или создается
+        fingerprint = await reserve_order(message, data, attachments)
+        if fingerprint is False:
+            return
 
-            if filled_fields:
-                response_text += f"\n<b>📊 Заполнены кастомные поля:</b> {', '.join(filled_fields)}"
+        # Создаем карточку в Trello с кастомными полями
+        try:
+            with latency_budget(Config.ORDER_LATENCY_BUDGET):
+                success, result, field_results = await create_order_card(
+                    data, route=route, chat_id=message.chat.id)
+        except Exception:
+            if fingerprint:
+                dedup.release(fingerprint)
+            raise
+        ORDERS.inc('created' if success else 'failed')
+        if fingerprint:
+            if success:
+                await dedup.complete(fingerprint, result)
+            else:
+                dedup.release(fingerprint)
 
-            # Показываем поля, которые попали только в описание
-            description_only_fields = [field for field in data.keys()
-                                       if field != "имя карточки" and field not in field_mapping and field_mapping.get(field) not in custom_fields_data]
-            if description_only_fields:
-                response_text += f"\n<b>📝 Только в описании:</b> {', '.join(description_only_fields)}"
+        attachment_results = {}
+        if success and attachments:
+            attachment_results = await upload_attachments(message.bot, result, attachments)
 
-            response_text += f"\n<b>👤 Создал:</b> {user_info}"
+        with STAGE_SECONDS.time('reply'):
+            if success:
+                await message.answer(format_card_reply(data, result, field_results, attachment_results),
+                                     parse_mode="HTML")
+            else:
+                await message.answer(f"❌ <b>Ошибка при создании карточки:</b> {result}", parse_mode="HTML")
 
-            await message.answer(response_text, parse_mode="HTML")
-        else:
-            await message.answer(f"❌ <b>Ошибка при создании карточки:</b> {result}", parse_mode="HTML")
+    except CircuitOpenError as e:
+        # Trello недоступен: отвечаем сразу, а не ждем таймаутов
+        ORDERS.inc('unavailable')
+        await message.answer(
+            f"⏳ <b>Trello сейчас недоступен.</b> Отправьте заказ еще раз через {e.retry_after:.0f} с.",
+            parse_mode="HTML"
+        )
 
     except Exception as e:
-        logger.error(f"Ошибка при обработке сообщения: {e}", exc_info=True)
+        ORDERS.inc('error')
+        logger.error("Ошибка при обработке сообщения: %s", e, exc_info=True)
         await message.answer(
             "❌ <b>Произошла ошибка при обработке сообщения.</b> Проверьте формат и попробуйте еще раз.\n\n"
             "<b>Используйте</b> /help <b>для просмотра формата.</b>",
             parse_mode="HTML"
         )
+
+
+# поставить заказ в очередь и сразу ответить, что он принят.
+# ссылка на карточку появится в этом же ответе, когда воркер создаст карточку.
+# ответ отправляется только после записи в очередь: "принят" значит сохранен
+async def enqueue_order(message: Message, data: Dict[str, str],
+                        attachments: Optional[List[Dict[str, Any]]] = None,
+                        route: Optional[Route] = None):
+    # ключ идемпотентности: повторная доставка того же сообщения не создает новую задачу
+    key = f"{message.chat.id}:{message.message_id}"
+    if await outbox.contains(key):
+        logger.info("Заказ %s уже в очереди, повтор пропущен", key)
+        return
+
+    fingerprint = await reserve_order(message, data, attachments)
+    if fingerprint is False:
+        return
+
+    try:
+        # пока ID ответа не записан в задачу, воркеры ее не берут
+        added = await outbox.enqueue(key, {
+            'chat_id': message.chat.id,
+            'data': data,
+            'attachments': attachments or [],
+            'route': (route or router.default).as_dict(),
+            'fingerprint': fingerprint
+        }, hold=REPLY_HOLD)
+    except sqlite3.Error as e:
+        logger.error("Не удалось поставить заказ %s в очередь: %s", key, e)
+        if fingerprint:
+            dedup.release(fingerprint)
+        ORDERS.inc('failed')
+        await message.answer(
+            f"❌ <b>Заказ не принят:</b> {data['имя карточки']}\n"
+            "Не удалось сохранить заказ. Попробуйте отправить его еще раз.",
+            parse_mode="HTML"
+        )
+        return
+    if not added:
+        logger.info("Заказ %s уже в очереди, повтор пропущен", key)
+        if fingerprint:
+            dedup.release(fingerprint)
+        return
+    ORDERS.inc('queued')
+
+    reply = None
+    try:
+        reply = await message.answer(
+            f"📥 <b>Заказ принят:</b> {data['имя карточки']}\n"
+            "Карточка создается, ссылка появится в этом сообщении.",
+            parse_mode="HTML"
+        )
+    finally:
+        # задача отпускается и без ответа - тогда ссылка придет новым сообщением
+        await outbox.release(key, {'reply_message_id': reply.message_id} if reply is not None else None)
+
+
+# проверить, не присылали ли этот заказ недавно.
+# False - это дубль (пользователь уже получил ответ), иначе отпечаток заказа
+# (None, если защита от дублей выключена), который нужно завершить или освободить
+async def reserve_order(message: Message, data: Dict[str, str],
+                        attachments: Optional[List[Dict[str, Any]]] = None):
+    if dedup is None:
+        return None
+
+    # тот же текст с другими файлами - другой заказ
+    if attachments:
+        data = {**data, 'вложения': ' '.join(item['file_unique_id'] for item in attachments)}
+    fingerprint = order_fingerprint(message.chat.id, message.from_user.id, data)
+    existing = dedup.reserve(fingerprint)
+    if existing is None:
+        return fingerprint
+
+    ORDERS.inc('duplicate')
+    logger.info("Повторный заказ пропущен: %s", data['имя карточки'])
+    await message.answer(format_duplicate_reply(data, existing), parse_mode="HTML")
+    return False
+
+
+# ответ на повторно отправленный заказ
+def format_duplicate_reply(data: Dict[str, str], entry: DedupEntry) -> str:
+    name = html.escape(data['имя карточки'])
+    if entry.card is None:
+        return (f"⏳ <b>Такой заказ уже принят и создается:</b> {name}\n"
+                "Ссылка появится в ответе на первое сообщение.")
+    return (f"♻️ <b>Такой заказ уже создан:</b> {name}\n"
+            f"<b>🔗 Ссылка:</b> {entry.card.get('shortUrl', '')}\n"
+            "Если нужна еще одна карточка, измените текст заказа.")
+
+
+# обработать заказ из очереди (вызывается воркером).
+# исключение - сигнал воркеру повторить задачу позже
+async def process_order_job(bot: Bot, job: Dict[str, Any]):
+    payload = job['payload']
+    state = job['state']
+    data = payload['data']
+    attachments = payload.get('attachments')
+
+    # загруженные вложения запоминаем, чтобы при повторе задачи не прикрепить их дважды
+    async def save_attachment(index: int):
+        state.setdefault('attached', []).append(index)
+        await outbox.save_state(job['id'], state)
+
+    with STAGE_SECONDS.time('job'):
+        result, field_results = await create_job_card(job)
+
+        attachment_results = {}
+        if attachments:
+            attachment_results = await upload_attachments(
+                bot, result, attachments, state.get('attached'), save_attachment)
+
+        with STAGE_SECONDS.time('reply'):
+            await send_job_reply(bot, job, format_card_reply(data, result, field_results, attachment_results))
+    ORDERS.inc('created')
+
+
+# создать карточку задачи из очереди и завершить ее отпечаток в защите от дублей.
+# возвращает (карточка, результаты по полям); исключение - задачу нужно повторить
+async def create_job_card(job: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, bool]]:
+    payload = job['payload']
+    state = job['state']
+    # задачи, поставленные до появления маршрутизации, идут на доску по умолчанию
+    route = Route(**payload['route']) if payload.get('route') else None
+
+    async def save_card(card: Dict[str, Any]):
+        state['card'] = card
+        await outbox.save_state(job['id'], state)
+
+    try:
+        with latency_budget(Config.ORDER_LATENCY_BUDGET):
+            # повтор задачи: карточка могла быть создана, а ответ Trello потерян
+            posted_since = job['created_at'] if job['attempts'] > 1 else None
+            success, result, field_results = await create_order_card(
+                payload['data'], state, save_card, route, payload['chat_id'], posted_since)
+    except CircuitOpenError as e:
+        # заказ подождет в очереди, попытка не тратится
+        raise JobDeferred(e.retry_after, str(e)) from e
+    if not success:
+        raise RuntimeError(str(result))
+    if dedup is not None and payload.get('fingerprint'):
+        await dedup.complete(payload['fingerprint'], result)
+    return result, field_results
+
+
+# прикрепить файлы заказа к созданной карточке: {название файла: прикреплен ли}
+async def upload_attachments(bot: Bot, card: Dict[str, Any], attachments: List[Dict[str, Any]],
+                             done: Optional[List[int]] = None,
+                             on_uploaded: Optional[Callable[[int], Awaitable[None]]] = None) -> Dict[str, bool]:
+    if uploader is None:
+        return {attachment['file_name']: False for attachment in attachments}
+    with STAGE_SECONDS.time('attachments'):
+        return await uploader.upload_all(bot, card['id'], attachments, done, on_uploaded)
+
+
+# сообщить пользователю, что заказ не удалось создать после всех попыток
+async def report_failed_job(bot: Bot, job: Dict[str, Any], error: str):
+    ORDERS.inc('failed')
+    if dedup is not None and job['payload'].get('fingerprint'):
+        dedup.release(job['payload']['fingerprint'])
+    # у строк импорта нет ответа "принят" - называем заказ
+    label = job['payload'].get('label')
+    if label:
+        error = f"{html.escape(label)} ({html.escape(job['payload']['data']['имя карточки'])}): {error}"
+    await send_job_reply(bot, job, f"❌ <b>Ошибка при создании карточки:</b> {error}")
+
+
+# обновить ответ "заказ принят"; если не получилось - отправить новое сообщение.
+# ID ответа - в state задачи (в payload - у задач, поставленных до этого)
+async def send_job_reply(bot: Bot, job: Dict[str, Any], text: str):
+    payload = job['payload']
+    reply_message_id = job['state'].get('reply_message_id') or payload.get('reply_message_id')
+    if reply_message_id is not None:
+        try:
+            await bot.edit_message_text(
+                text, chat_id=payload['chat_id'], message_id=reply_message_id, parse_mode="HTML")
+            return
+        except TelegramBadRequest as e:
+            logger.warning("Не удалось обновить ответ о заказе: %s", e)
+    await bot.send_message(payload['chat_id'], text, parse_mode="HTML")
+
+
+# Массовый импорт заказов -----------------------------------
+# создать один заказ из импорта, вернуть (успех, строка для отчета).
+# key - ключ идемпотентности строки (чат + файл или сообщение + номер заказа):
+# повторно отправленный файл не создает карточки второй раз. заказ защищен от дублей,
+# как одиночный, а при включенной очереди сначала записывается в нее
+async def create_import_order(message: Message, user_info: str, key: str, label: str,
+                              data: Dict[str, str], route: Optional[Route] = None) -> Tuple[bool, str]:
+    is_valid, missing_fields = validate_required_fields(
+        data, Config.REQUIRED_FIELDS)
+    if not is_valid:
+        return False, f"нет обязательного поля: {', '.join(missing_fields)}"
+    field_errors = validate_field_values(data)
+    if field_errors:
+        return False, html.escape('; '.join(field_errors))
+
+    data['telegram пользователь'] = user_info
+    if outbox is not None and await outbox.contains(key):
+        return False, "уже импортирован раньше"
+
+    fingerprint = None
+    if dedup is not None:
+        fingerprint = order_fingerprint(message.chat.id, message.from_user.id, data)
+        existing = dedup.reserve(fingerprint)
+        if existing is not None:
+            ORDERS.inc('duplicate')
+            if existing.card is None:
+                return False, "такой заказ уже принят и создается"
+            return False, f"такой заказ уже создан — {existing.card.get('shortUrl', '')}"
+
+    if outbox is not None:
+        return await enqueue_import_order(key, label, data, route, message.chat.id, fingerprint)
+
+    try:
+        with latency_budget(Config.ORDER_LATENCY_BUDGET):
+            success, result, field_results = await create_order_card(data, route=route, chat_id=message.chat.id)
+    except CircuitOpenError as e:
+        success, result = False, str(e)
+    if not success:
+        if fingerprint:
+            dedup.release(fingerprint)
+        return False, html.escape(str(result))
+    if fingerprint:
+        await dedup.complete(fingerprint, result)
+    return True, format_import_line(data, result, field_results)
+
+
+# строка импорта через очередь: задача записывается с hold (воркеры ее не берут)
+# и выполняется сразу здесь, чтобы ссылка попала в отчет. если создать карточку
+# не удалось или бот остановился, задачу доделают воркеры и пришлют ссылку отдельно
+async def enqueue_import_order(key: str, label: str, data: Dict[str, str], route: Optional[Route],
+                               chat_id: int, fingerprint: Optional[str]) -> Tuple[bool, str]:
+    try:
+        added = await outbox.enqueue(key, {
+            'chat_id': chat_id,
+            'data': data,
+            'attachments': [],
+            'route': (route or router.default).as_dict(),
+            'fingerprint': fingerprint,
+            'label': label
+        }, hold=Config.OUTBOX_LEASE)
+    except sqlite3.Error as e:
+        logger.error("Не удалось поставить заказ импорта %s в очередь: %s", key, e)
+        added = None
+    if not added:
+        if fingerprint:
+            dedup.release(fingerprint)
+        return False, "уже импортирован раньше" if added is False else "не удалось сохранить заказ"
+    ORDERS.inc('queued')
+
+    job = await outbox.claim_key(key, Config.OUTBOX_LEASE)
+    if job is None:
+        return True, "поставлен в очередь, ссылка придет отдельным сообщением"
+    try:
+        card, field_results = await create_job_card(job)
+    except JobDeferred as e:
+        await outbox.defer(job['id'], e.delay, str(e))
+        return False, f"{html.escape(str(e))}; заказ в очереди, ссылка придет отдельным сообщением"
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+        await outbox.retry(job['id'], 0, error)
+        return False, f"{html.escape(error)}; заказ в очереди, ссылка придет отдельным сообщением"
+    await outbox.complete(job['id'])
+    ORDERS.inc('created')
+    return True, format_import_line(data, card, field_results)
+
+
+# строка отчета об импорте для созданной карточки
+def format_import_line(data: Dict[str, str], card: Dict[str, Any], field_results: Dict[str, bool]) -> str:
+    text = f"{html.escape(data['имя карточки'])} — {card['shortUrl']}"
+    failed_fields = [field for field, ok in field_results.items() if not ok]
+    if failed_fields:
+        text += f" (не заполнены: {', '.join(failed_fields)})"
+    return text
+
+
+# ответить отчетом по импорту (одно сообщение, при большой длине - несколько)
+async def answer_import_summary(message: Message, results):
+    if not results:
+        await message.answer("❌ <b>В импорте не найдено ни одного заказа</b>", parse_mode="HTML")
+        return
+    for text in format_import_summary(results):
+        await message.answer(text, parse_mode="HTML")
+
+
+# несколько заказов в одном сообщении, разделенных строкой "---"
+async def handle_bulk_text(message: Message):
+    orders = split_orders(message.text)
+    user_info = get_user_info(message.from_user)
+    results = await run_bulk_import(
+        iter(orders),
+        lambda label, data: create_import_order(
+            message, user_info, f"{message.chat.id}:{message.message_id}:{label}", label, data,
+            order_route(message, data)),
+        Config.BULK_CONCURRENCY)
+    await answer_import_summary(message, results)
+
+
+# Обработчик фото и файлов к заказу ------------------------
+# поля заказа берутся из подписи, файлы прикрепляются к карточке
+async def handle_attachment_message(message: Message):
+    messages = await media_groups.collect(message)
+    if messages is None:
+        # сообщение попало в альбом, который обработает его первое сообщение
+        return
+
+    caption = next((item.caption for item in messages if item.caption), '')
+    attachments = [attachment for item in messages for attachment in message_attachments(item)]
+    with STAGE_SECONDS.time('total'):
+        await handle_order_message(messages[0], caption, attachments)
+
+
+# Обработчик файлов: CSV/XLSX - импорт, остальные - вложения заказа
+async def handle_document(message: Message):
+    document = message.document
+    if not is_table_file(document.file_name):
+        await handle_attachment_message(message)
+        return
+
+    if document.file_size and document.file_size > Config.BULK_MAX_FILE_SIZE:
+        await message.answer("❌ <b>Файл слишком большой для импорта</b>", parse_mode="HTML")
+        return
+
+    try:
+        user_info = get_user_info(message.from_user)
+
+        # файл скачивается потоком: небольшой остается в памяти, большой уходит на диск
+        with SpooledTemporaryFile(max_size=Config.BULK_SPOOL_SIZE) as file:
+            await message.bot.download(document, destination=file)
+            file.seek(0)
+
+            results = await run_bulk_import(
+                iter_table_orders(file, document.file_name),
+                lambda label, data: create_import_order(
+                    message, user_info, f"{message.chat.id}:{document.file_unique_id}:{label}", label, data,
+                    order_route(message, data)),
+                Config.BULK_CONCURRENCY)
+
+        await answer_import_summary(message, results)
+
+    except Exception as e:
+        logger.error("Ошибка при импорте файла: %s", e, exc_info=True)
+        await message.answer(f"❌ <b>Ошибка при импорте файла:</b> {html.escape(str(e))}", parse_mode="HTML")
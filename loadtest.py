@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import hashlib
+import itertools
+import logging
+import math
+import os
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import EditMessageText, GetFile, SendMessage
+from aiogram.types import Chat, File, Message, Update
+
+from bot import create_trello_manager, create_workers, setup_dispatcher
+from card_index import CardIndex
+from order_stats import OrderStats
+from config import Config
+from fake_trello import FakeTrello
+from outbox import Outbox
+
+# нагрузочный тест: синтетические апдейты Telegram идут в настоящий Dispatcher
+# с обработчиками из setup_handlers, а Trello заменен локальным FakeTrello.
+#   python loadtest.py --orders 500 --rate 20 --latency 0.15 --error-rate 0.02 --burst-every 30
+# --photos N - заказ приходит альбомом из N фото с подписью, фото передаются в FakeTrello
+
+ORDER_TEMPLATE = '''имя карточки: Нагрузочный заказ {number}
+дата заказа: 10.09.2025
+крайний срок: 25.10.2025 18:00
+клиент: Клиент {number}
+цвет: белый
+телефон: +7 900 000 {number:04d}
+дополнительно: заказ для нагрузочного теста'''
+
+# поля заказа, которые могут попасть в кастомные поля доски
+ORDER_FIELDS = ['дата заказа', 'крайний срок', 'клиент', 'цвет', 'телефон', 'дополнительно']
+
+
+# сессия Telegram без сети: запоминает ответы бота на каждый заказ и отдает
+# содержимое фото заказов (детерминированные байты размера из file_sizes)
+class FakeTelegramSession(BaseSession):
+    def __init__(self, tracker: 'ReplyTracker'):
+        super().__init__()
+        self.tracker = tracker
+        self._message_ids = itertools.count(1_000_000)
+        self.file_sizes: Dict[str, int] = {}
+
+    async def make_request(self, bot: Bot, method, timeout: Optional[int] = None):
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self.tracker.on_reply(method.chat_id, method.text)
+            message_id = getattr(method, 'message_id', None) or next(self._message_ids)
+            return Message(message_id=message_id, date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type='private'), text=method.text)
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id,
+                        file_size=self.file_sizes.get(method.file_id), file_path=f"photos/{method.file_id}.jpg")
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[Dict] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True):
+        file_id = url.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+        size = self.file_sizes.get(file_id)
+        if size is None:
+            raise FileNotFoundError(f"файл {file_id} не отправлялся в нагрузочном тесте")
+        # одно и то же содержимое для файла при каждой попытке загрузки
+        pattern = hashlib.sha256(file_id.encode()).digest()
+        chunk = (pattern * (chunk_size // len(pattern) + 1))[:chunk_size]
+        for offset in range(0, size, chunk_size):
+            yield chunk[:min(chunk_size, size - offset)]
+
+    async def close(self):
+        pass
+
+
+# время отправки заказа, первого ответа ("принят") и итогового ответа со ссылкой
+class ReplyTracker:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent_at: Dict[int, float] = {}
+        self.first_reply_at: Dict[int, float] = {}
+        self.final_at: Dict[int, float] = {}
+        self.final_ok: Dict[int, bool] = {}
+        self._done = asyncio.Event()
+
+    def on_reply(self, chat_id: int, text: str):
+        now = time.monotonic()
+        self.first_reply_at.setdefault(chat_id, now)
+        if text.startswith(('✅', '❌')) and chat_id not in self.final_at:
+            self.final_at[chat_id] = now
+            self.final_ok[chat_id] = text.startswith('✅')
+            if len(self.final_at) >= self.expected:
+                self._done.set()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def latencies(self, replies: Dict[int, float]) -> List[float]:
+        return sorted(replies[chat] - self.sent_at[chat] for chat in replies if chat in self.sent_at)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    rank = math.ceil(p / 100 * len(values))
+    return values[min(len(values), max(rank, 1)) - 1]
+
+
+# апдейты одного заказа: текст или альбом из photos фото с подписью (размеры фото
+# запоминаются в сессии, чтобы отдать их содержимое при скачивании)
+def make_updates(bot: Bot, number: int, chat_id: int, photos: int = 0, photo_size: int = 0) -> List[Update]:
+    sender = {'id': chat_id, 'is_bot': False, 'first_name': 'Нагрузка', 'username': f"load{number}"}
+    text = ORDER_TEMPLATE.format(number=number)
+    if not photos:
+        return [Update.model_validate({
+            'update_id': number,
+            'message': {
+                'message_id': number,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': sender,
+                'text': text,
+            }
+        }, context={'bot': bot})]
+
+    updates = []
+    for index in range(photos):
+        message_id = number * photos + index
+        file_id = f"photo{number}_{index}"
+        bot.session.file_sizes[file_id] = photo_size
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': sender,
+            'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960,
+                       'file_size': photo_size}],
+        }
+        if index == 0:
+            message['caption'] = text
+        if photos > 1:
+            message['media_group_id'] = f"album{number}"
+        updates.append(Update.model_validate({'update_id': message_id, 'message': message}, context={'bot': bot}))
+    return updates
+
+
+async def run(args) -> bool:
+    fake = FakeTrello(latency=args.latency, error_rate=args.error_rate,
+                      burst_every=args.burst_every, burst_duration=args.burst_duration,
+                      rate_limit=args.trello_rate_limit)
+    trello_runner = await fake.start(port=args.trello_port)
+
+    # бот работает с фиктивной доской на FakeTrello (настоящие ключи туда не отправляем)
+    Config.TRELLO_API_KEY = 'loadtest-key'
+    Config.TRELLO_TOKEN = 'loadtest-token'
+    Config.TRELLO_BOARD_ID = 'loadtest-board'
+    Config.TRELLO_LIST = fake.lists[0]['name']
+    Config.OUTBOX_WORKERS = args.workers
+    # снимок метаданных фиктивной доски не нужен и не должен оказаться в рабочем каталоге
+    Config.TRELLO_METADATA_SNAPSHOT = ''
+
+    tracker = ReplyTracker(args.orders)
+    bot = Bot('123456:loadtest', session=FakeTelegramSession(tracker))
+    dp = Dispatcher()
+    trello_manager = create_trello_manager(f"http://127.0.0.1:{args.trello_port}/1")
+
+    db_dir = tempfile.mkdtemp(prefix='loadtest-')
+    outbox = Outbox(os.path.join(db_dir, 'outbox.db')) if args.outbox else None
+    workers = create_workers(bot, outbox, breaker=trello_manager.breaker) if outbox is not None else None
+    card_index = CardIndex(os.path.join(db_dir, 'cards.db'))
+    order_stats = OrderStats(os.path.join(db_dir, 'stats.db'))
+    concurrency = setup_dispatcher(dp, trello_manager, outbox, card_index=card_index, stats=order_stats)
+
+    await trello_manager.warm_up(Config.TRELLO_BOARD_ID)
+    if workers is not None:
+        workers.start()
+
+    # апдейты подаются с заданной частотой, не дожидаясь обработки предыдущих
+    started = time.monotonic()
+    tasks = []
+    for number in range(args.orders):
+        delay = started + number / args.rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        chat_id = 100_000 + number
+        tracker.sent_at[chat_id] = time.monotonic()
+        for update in make_updates(bot, number, chat_id, args.photos, args.photo_size):
+            tasks.append(asyncio.create_task(dp.feed_update(bot, update)))
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    completed = await tracker.wait(args.timeout)
+    finished = max(tracker.final_at.values(), default=time.monotonic())
+
+    await concurrency.drain(5)
+    if workers is not None:
+        await workers.stop()
+        outbox.close()
+    card_index.close()
+    await order_stats.stop()
+    order_stats.close()
+    await trello_manager.close()
+    await trello_runner.cleanup()
+
+    report(args, fake, tracker, started, finished, completed)
+    return completed
+
+
+def report(args, fake: FakeTrello, tracker: ReplyTracker, started: float, finished: float, completed: bool):
+    board_fields = {field['name'] for field in fake.custom_fields}
+    expected_fields = len(board_fields & set(ORDER_FIELDS + [Config.TELEGRAM_USER_FIELD.lower()]))
+    filled = fake.filled_fields_by_name()
+    cards = len(filled)
+    complete_cards = sum(1 for count in filled.values() if count >= expected_fields)
+    created = sum(1 for ok in tracker.final_ok.values() if ok)
+    duration = max(finished - started, 1e-9)
+
+    print(f"\nЗаказов отправлено: {args.orders} ({args.rate}/с), режим: {'outbox' if args.outbox else 'inline'}")
+    if not completed:
+        print(f"ВНИМАНИЕ: за {args.timeout} с ответ получен только на {len(tracker.final_at)} заказов")
+    print(f"Карточек создано: {created}, ошибок: {len(tracker.final_ok) - created}")
+    print(f"Пропускная способность: {created / duration:.2f} заказов/с ({created / duration * 60:.0f} в минуту)")
+
+    for title, replies in (("первый ответ", tracker.first_reply_at), ("ответ со ссылкой", tracker.final_at)):
+        values = tracker.latencies(replies)
+        print(f"Время до ответа ({title}): p50 {percentile(values, 50):.3f} с, "
+              f"p95 {percentile(values, 95):.3f} с, p99 {percentile(values, 99):.3f} с")
+
+    print(f"Запросов к Trello: {fake.total_calls()}, на карточку: {fake.total_calls() / max(cards, 1):.2f}")
+    for endpoint, statuses in fake.calls_by_endpoint().items():
+        print(f"  {endpoint}: " + ", ".join(f"{status}: {count}" for status, count in statuses.items()))
+    print(f"Карточек со всеми кастомными полями ({expected_fields}): {complete_cards} из {cards}")
+    if args.photos:
+        attachments = [attachment for card in fake.cards.values() for attachment in card['attachments']]
+        complete = sum(1 for attachment in attachments if attachment['bytes'] == args.photo_size)
+        print(f"Фото прикреплено: {len(attachments)} из {cards * args.photos}, полного размера: {complete}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальной заменой Trello")
+    parser.add_argument('--orders', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=10.0, help="заказов в секунду")
+    parser.add_argument('--latency', type=float, default=0.1, help="средняя задержка Trello, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 5xx")
+    parser.add_argument('--burst-every', type=float, default=0.0, help="период пачек 429, с (0 - без пачек)")
+    parser.add_argument('--burst-duration', type=float, default=1.0)
+    parser.add_argument('--photos', type=int, default=0, help="фото в заказе (альбомом, если больше одного)")
+    parser.add_argument('--photo-size', type=int, default=256 * 1024, help="размер каждого фото, байт")
+    parser.add_argument('--trello-rate-limit', type=int, default=100, help="лимит FakeTrello за 10 с")
+    parser.add_argument('--trello-port', type=int, default=8081)
+    parser.add_argument('--workers', type=int, default=Config.OUTBOX_WORKERS)
+    parser.add_argument('--no-outbox', dest='outbox', action='store_false',
+                        help="создавать карточки прямо в обработчике")
+    parser.add_argument('--timeout', type=float, default=300.0, help="сколько ждать ответов после отправки")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    completed = asyncio.run(run(args))
+    raise SystemExit(0 if completed else 1)
+
+
+if __name__ == '__main__':
+    main()
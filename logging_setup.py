@@ -1,9 +1,78 @@
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Optional
+
 from config import Config
 
+# фоновый поток, который пишет логи в файл или консоль
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional['NonBlockingQueueHandler'] = None
+
+
+# обработчик на стороне event loop: только кладет запись в очередь.
+# если писатель не успевает и очередь заполнена, запись отбрасывается, а не блокирует бота
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self._exception_formatter = logging.Formatter()
+        self.dropped = 0
+
+    # подставить аргументы в сообщение сразу (они могут измениться до записи),
+    # остальное форматирование - в потоке записи
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# файл логов с ротацией по размеру (LOG_ROTATION=size) или по времени (LOG_ROTATION=time)
+def create_file_handler() -> logging.Handler:
+    if Config.LOG_ROTATION == 'time':
+        return TimedRotatingFileHandler(
+            Config.LOG_FILE,
+            when=Config.LOG_ROTATE_WHEN,
+            backupCount=Config.LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+    return RotatingFileHandler(
+        Config.LOG_FILE,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+
+
+# остановить фоновую запись, дописав все записи из очереди
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+# сколько записей отброшено из-за переполненной очереди
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
 
-# настройка логирования: в файл или в консоль
+
+# настройка логирования: в файл или в консоль.
+# запись на диск идет в отдельном потоке через очередь, поэтому не блокирует event loop
 def setup_logging():
+    global _listener, _queue_handler
     log_level = getattr(logging, Config.LOG_LEVEL, logging.INFO)
 
     formatter = logging.Formatter(
@@ -15,31 +84,31 @@ def setup_logging():
     root_logger.setLevel(log_level)
 
     # очистить существующие handlers
+    stop_logging()
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
     if Config.DEV_OR_PROD == 'PROD':
         # логирование в файл
-        file_handler = logging.FileHandler(
-            Config.LOG_FILE,
-            encoding='utf-8'
-        )
-        file_handler.setLevel(log_level)
-        file_handler.setFormatter(formatter)
-        root_logger.addHandler(file_handler)
+        output_handler = create_file_handler()
         print(f"Логи записываются в файл: {Config.LOG_FILE}")
     else:
         # логирование в консоль
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(log_level)
-        console_handler.setFormatter(formatter)
-        root_logger.addHandler(console_handler)
+        output_handler = logging.StreamHandler()
         print("Логи выводятся в консоль")
+    output_handler.setLevel(log_level)
+    output_handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    root_logger.addHandler(_queue_handler)
+    _listener = QueueListener(log_queue, output_handler, respect_handler_level=True)
+    _listener.start()
 
     # Уменьшаем логирование внешних библиотек
     logging.getLogger('aiogram').setLevel(logging.WARNING)
     logging.getLogger('httpx').setLevel(logging.WARNING)
 
     logger = logging.getLogger(__name__)
-    logger.info(f"Логирование настроено. Уровень: {Config.LOG_LEVEL}")
-    logger.info(f"Режим: {'Файл' if Config.LOG_TO_FILE else 'Консоль'}")
+    logger.info("Логирование настроено. Уровень: %s", Config.LOG_LEVEL)
+    logger.info("Режим: %s", 'Файл' if Config.LOG_TO_FILE else 'Консоль')
@@ -0,0 +1,192 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple, Union
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# метрики бота в текстовом формате Prometheus (без сторонних зависимостей).
+# запись метрики - это словарь и сложение, поэтому их можно держать включенными всегда
+
+# границы корзин гистограмм в секундах: от быстрого парсинга до медленных запросов к Trello
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+Samples = Iterable[Tuple[Tuple[str, ...], float]]
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+                for values, value in sorted(self._values.items())]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # {значения меток: [счетчики по корзинам (без накопления), сумма, количество]}
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._listeners: List[Callable[[float, Tuple[str, ...]], None]] = []
+
+    def observe(self, value: float, *label_values: str):
+        entry = self._values.get(label_values)
+        if entry is None:
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+        for listener in self._listeners:
+            listener(value, label_values)
+
+    # получать каждое значение (например, для трассировки медленных апдейтов)
+    def add_listener(self, listener: Callable[[float, Tuple[str, ...]], None]):
+        self._listeners.append(listener)
+
+    # замерить время блока: with STAGE_SECONDS.time('parse'): ...
+    @contextmanager
+    def time(self, *label_values: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{"+Inf" if bound == float("inf") else repr(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {count}")
+        return lines
+
+
+# метрика, значения которой считываются при каждом запросе /metrics
+# из уже существующих счетчиков (пул соединений, кэш, очередь заказов)
+class Collected:
+    def __init__(self, name: str, documentation: str, kind: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Union[Samples, Awaitable[Samples]]]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labels = labels
+        self.collect = collect
+
+    async def samples(self) -> Samples:
+        result = self.collect()
+        if hasattr(result, '__await__'):
+            result = await result
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[Counter, Histogram, Collected]] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge_callback(self, name: str, documentation: str, collect, labels: Tuple[str, ...] = ()):
+        return self.register(Collected(name, documentation, 'gauge', labels, collect))
+
+    def counter_callback(self, name: str, documentation: str, collect, labels: Tuple[str, ...] = ()):
+        return self.register(Collected(name, documentation, 'counter', labels, collect))
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Collected):
+                try:
+                    samples = list(await metric.samples())
+                except Exception as e:
+                    logger.warning("Не удалось собрать метрику %s: %s", metric.name, e)
+                    continue
+                body = [f"{metric.name}{_format_labels(metric.labels, values)} {_format_value(value)}"
+                        for values, value in samples]
+            else:
+                body = metric.render()
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(body)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# время этапов обработки заказа: parse, validate, list_lookup, fields_lookup,
+# card_post, custom_fields, attachments, enqueue, reply, total (весь обработчик), job (задача из очереди)
+# и find (поиск по индексу карточек)
+STAGE_SECONDS = REGISTRY.histogram(
+    'order_stage_duration_seconds', 'Время этапов обработки заказа', ('stage',))
+ORDERS = REGISTRY.counter(
+    'orders_total', 'Обработанные заказы по результату', ('result',))
+TRELLO_REQUESTS = REGISTRY.counter(
+    'trello_requests_total', 'Ответы Trello по эндпоинту и статусу', ('endpoint', 'status'))
+TRELLO_REQUEST_SECONDS = REGISTRY.histogram(
+    'trello_request_duration_seconds', 'Время одного HTTP-запроса к Trello', ('endpoint',))
+
+
+# отдать метрики на GET {path}
+def add_metrics_route(app: web.Application, path: str = '/metrics', registry: Registry = REGISTRY):
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=await registry.render(), content_type='text/plain', charset='utf-8')
+    app.router.add_get(path, handle)
+
+
+# отдельный HTTP-сервер метрик (в режиме polling у бота нет своего сервера)
+async def start_metrics_server(host: str, port: int, path: str = '/metrics',
+                               registry: Registry = REGISTRY) -> web.AppRunner:
+    app = web.Application()
+    add_metrics_route(app, path, registry)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на http://%s:%s%s", host, port, path)
+    return runner
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from profiling import SlowUpdateProfiler
+
+logger = logging.getLogger(__name__)
+
+
+# ограничение числа одновременно обрабатываемых апдейтов.
+# работает и при polling, и при webhook; при остановке бота позволяет
+# дождаться завершения уже принятых апдейтов (drain)
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._semaphore = asyncio.Semaphore(self.limit)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # принятые апдейты: обрабатываются или ждут своей очереди
+        self.in_flight = 0
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    # дождаться обработки всех принятых апдейтов; False - не успели за timeout
+    async def drain(self, timeout: float) -> bool:
+        if self.in_flight:
+            logger.info("Ожидаем завершения обработки апдейтов: %s", self.in_flight)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались обработки апдейтов: %s", self.in_flight)
+            return False
+
+
+# замер времени каждого апдейта и профиль медленных (см. SlowUpdateProfiler).
+# регистрируется после ConcurrencyLimitMiddleware, чтобы ожидание очереди не считалось
+class ProfilingMiddleware(BaseMiddleware):
+    def __init__(self, profiler: SlowUpdateProfiler):
+        self.profiler = profiler
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        info = {}
+        if isinstance(event, Update):
+            info['update_id'] = event.update_id
+            info['update_type'] = event.event_type
+        label = f"update-{info.get('update_id', 'unknown')}"
+        return await self.profiler.run(label, lambda: handler(event, data), info)
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from card_index import card_created_at, trello_card_fields
+from circuit_breaker import CircuitOpenError
+from field_schema import parse_date
+from trello_api import AsyncTrelloManager
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = re.compile(r'\s+')
+
+# счетчики: по дню создания, автору, клиенту и дню крайнего срока
+KINDS = ('day', 'creator', 'client', 'deadline')
+
+
+# значение без лишних пробелов (None - пусто)
+def clean_value(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    return WHITESPACE.sub(' ', value).strip() or None
+
+
+# ключ для подсчета: регистр и лишние пробелы не различаются
+def stats_key(value: Optional[str]) -> Optional[str]:
+    return value.lower() if value else None
+
+
+# крайний срок в виде ГГГГ-ММ-ДД (None - не указан или не дата)
+def deadline_day(value: Optional[str]) -> Optional[str]:
+    parsed = parse_date(value) if value else None
+    return parsed.strftime('%Y-%m-%d') if parsed is not None else None
+
+
+# статистика заказов.
+# на каждую карточку в SQLite хранится одна строка (день создания, автор, клиент, крайний срок),
+# а счетчики держатся в памяти и меняются при создании карточки, поэтому /stats
+# отвечает без запросов к Trello и без подсчета по базе. при старте счетчики
+# собираются из базы одним GROUP BY на вид. периодическая сверка с досками
+# исправляет расхождения: карточки, удаленные или измененные прямо в Trello
+class OrderStats:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS order_stats (
+                card_id TEXT PRIMARY KEY,
+                board_id TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                day TEXT NOT NULL,
+                creator_key TEXT,
+                creator TEXT,
+                client_key TEXT,
+                client TEXT,
+                deadline TEXT
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS order_stats_board ON order_stats (board_id)")
+
+        self.counters: Dict[str, Counter] = {kind: Counter() for kind in KINDS}
+        # {вид: {ключ: как написано в заказе}} - для вывода автора и клиента
+        self.labels: Dict[str, Dict[str, str]] = {'creator': {}, 'client': {}}
+        self.total = 0
+        self.reconciled_at: Optional[float] = None
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._load()
+
+    # собрать счетчики из базы (при старте и после сверки; вызывается под self._lock)
+    def _load(self):
+        counters = {kind: Counter() for kind in KINDS}
+        labels = {'creator': {}, 'client': {}}
+        for kind, column in (('day', 'day'), ('deadline', 'deadline')):
+            for key, count in self._conn.execute(
+                    f"SELECT {column}, COUNT(*) FROM order_stats WHERE {column} IS NOT NULL GROUP BY {column}"):
+                counters[kind][key] = count
+        for kind in ('creator', 'client'):
+            for key, label, count in self._conn.execute(
+                    f"SELECT {kind}_key, MAX({kind}), COUNT(*) FROM order_stats "
+                    f"WHERE {kind}_key IS NOT NULL GROUP BY {kind}_key"):
+                counters[kind][key] = count
+                labels[kind][key] = label
+        self.counters = counters
+        self.labels = labels
+        self.total = sum(counters['day'].values())
+
+    async def _run(self, func: Callable, *args) -> Any:
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    # строка статистики для карточки: (ID, доска, время создания, день, автор, клиент, крайний срок)
+    @staticmethod
+    def _row(card_id: str, board_id: str, created_at: float, data: Dict[str, str]) -> Tuple:
+        creator = clean_value(data.get('telegram пользователь'))
+        client = clean_value(data.get('клиент'))
+        return (card_id, board_id, created_at, time.strftime('%Y-%m-%d', time.localtime(created_at)),
+                stats_key(creator), creator, stats_key(client), client, deadline_day(data.get('крайний срок')))
+
+    def _count(self, row: Tuple):
+        _, _, _, day, creator_key, creator, client_key, client, deadline = row
+        self.counters['day'][day] += 1
+        self.total += 1
+        if creator_key:
+            self.counters['creator'][creator_key] += 1
+            self.labels['creator'][creator_key] = creator
+        if client_key:
+            self.counters['client'][client_key] += 1
+            self.labels['client'][client_key] = client
+        if deadline:
+            self.counters['deadline'][deadline] += 1
+
+    # карточка создана ботом. повторный вызов для той же карточки (повтор задачи
+    # из очереди) счетчики не меняет
+    async def record(self, card_id: str, data: Dict[str, str], board_id: str):
+        row = self._row(card_id, board_id, time.time(), data)
+
+        # счетчики меняются под той же блокировкой, что и база: сверка, пересобирающая
+        # счетчики, не может вклиниться между записью строки и ее подсчетом
+        def save():
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO order_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            if cursor.rowcount > 0:
+                self._count(row)
+
+        await self._run(save)
+
+    # заказы за день (ГГГГ-ММ-ДД)
+    def orders_on(self, day: str) -> int:
+        return self.counters['day'][day]
+
+    # заказы за последние days дней, включая сегодня
+    def orders_last(self, days: int) -> int:
+        now = time.time()
+        return sum(self.counters['day'][time.strftime('%Y-%m-%d', time.localtime(now - offset * 86400))]
+                   for offset in range(days))
+
+    # заказы с крайним сроком через offset дней от сегодня (0 - сегодня)
+    def deadlines_in(self, offset: int) -> int:
+        day = time.strftime('%Y-%m-%d', time.localtime(time.time() + offset * 86400))
+        return self.counters['deadline'][day]
+
+    # самые частые авторы или клиенты: [(как написано, заказов)]
+    def top(self, kind: str, limit: int = 5) -> List[Tuple[str, int]]:
+        return [(self.labels[kind].get(key, key), count)
+                for key, count in self.counters[kind].most_common(limit)]
+
+    # сверить статистику доски с Trello. fetch_cards возвращает все карточки доски
+    # (как для индекса карточек) или None при ошибке. учитываются только заказы бота:
+    # карточки из статистики и карточки с полем "telegram пользователь", а карточки,
+    # заведенные в Trello вручную, пропускаются. автор, клиент и крайний срок,
+    # которых нет в кастомных полях, остаются из заказа. возвращает (изменено, удалено) или None
+    async def reconcile(self, board_id: str,
+                        fetch_cards: Callable[[], Awaitable[Optional[List[Dict[str, Any]]]]],
+                        custom_fields: Dict[str, Dict]) -> Optional[Tuple[int, int]]:
+        started = time.time()
+        cards = await fetch_cards()
+        if cards is None:
+            return None
+
+        def apply() -> Tuple[int, int]:
+            known = {row[0]: row for row in self._conn.execute(
+                "SELECT * FROM order_stats WHERE board_id = ?", (board_id,))}
+            changed = 0
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for card in cards:
+                    old = known.pop(card['id'], None)
+                    data = trello_card_fields(card, custom_fields, board_id)
+                    if old is None and not clean_value(data.get('telegram пользователь')):
+                        continue
+                    if old is not None:
+                        data.setdefault('telegram пользователь', old[5])
+                        data.setdefault('клиент', old[7])
+                        data.setdefault('крайний срок', old[8])
+                    created_at = old[2] if old is not None else card_created_at(card['id'])
+                    row = self._row(card['id'], board_id, created_at, data)
+                    if row != old:
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO order_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+                        changed += 1
+                # карточки, созданные ботом, пока шел запрос, в ответ Trello попасть не могли
+                removed = [card_id for card_id, row in known.items() if row[2] < started]
+                self._conn.executemany("DELETE FROM order_stats WHERE card_id = ?", ((card_id,) for card_id in removed))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._load()
+            return changed, len(removed)
+
+        changed, removed = await self._run(apply)
+        self.reconciled_at = time.time()
+        logger.info("Статистика доски %s сверена с Trello: изменено %s, удалено %s", board_id, changed, removed)
+        return changed, removed
+
+    # сверять статистику досок с Trello каждые interval секунд (первая сверка - через interval)
+    def start_reconciliation(self, trello: AsyncTrelloManager, boards: List[str], interval: float):
+        if self._reconcile_task is None and interval > 0:
+            self._reconcile_task = asyncio.create_task(self._reconcile_loop(trello, boards, interval))
+
+    async def _reconcile_loop(self, trello: AsyncTrelloManager, boards: List[str], interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            for board_id in boards:
+                try:
+                    custom_fields = await trello.get_custom_fields(board_id)
+                    if await self.reconcile(board_id, partial(trello.get_board_cards, board_id),
+                                            custom_fields) is None:
+                        logger.warning("Статистика доски %s не сверена: нет карточек из Trello", board_id)
+                except CircuitOpenError as e:
+                    logger.warning("Статистика доски %s не сверена: %s", board_id, e)
+                except sqlite3.Error as e:
+                    logger.error("Ошибка базы статистики при сверке доски %s: %s", board_id, e)
+
+    # остановить сверку: дожидаемся задачи, чтобы база не закрылась посреди сверки
+    async def stop(self):
+        if self._reconcile_task is not None:
+            self._reconcile_task.cancel()
+            try:
+                await self._reconcile_task
+            except asyncio.CancelledError:
+                pass
+            self._reconcile_task = None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
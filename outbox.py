@@ -0,0 +1,319 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# задачу нужно отложить на delay секунд, не расходуя попытку
+# (например, Trello недоступен и обращаться к нему бессмысленно)
+class JobDeferred(Exception):
+    def __init__(self, delay: float, reason: str = ''):
+        super().__init__(reason or f"задача отложена на {delay:.0f} с")
+        self.delay = delay
+
+
+# постоянная очередь заказов в SQLite (outbox).
+# задача получает idempotency key (чат + сообщение), поэтому повторная доставка
+# апдейта после перезапуска не создает вторую задачу. прогресс задачи (ID уже созданной
+# карточки) сохраняется в state, чтобы повтор после сбоя не создавал вторую карточку
+class Outbox:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT '{}',
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                available_at REAL NOT NULL,
+                locked_until REAL NOT NULL DEFAULT 0,
+                finished_at REAL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, available_at)")
+        self._new_jobs = asyncio.Event()
+
+    # выполнить запрос к базе в отдельном потоке, чтобы не блокировать event loop
+    async def _run(self, func: Callable, *args) -> Any:
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    async def contains(self, key: str) -> bool:
+        def query():
+            row = self._conn.execute(
+                "SELECT 1 FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+            return row is not None
+        return await self._run(query)
+
+    # поставить задачу в очередь; False - задача с таким ключом уже есть.
+    # hold - сколько секунд воркеры не берут задачу, пока к ней не привяжут ответ
+    # пользователю (см. release). если бот упадет раньше, задача выполнится после hold
+    async def enqueue(self, key: str, payload: Dict[str, Any], hold: float = 0) -> bool:
+        def insert():
+            now = time.time()
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, payload, created_at, available_at, locked_until) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(payload, ensure_ascii=False), now, now, now + hold if hold > 0 else 0))
+            return cursor.rowcount == 1
+
+        added = await self._run(insert)
+        if added and hold <= 0:
+            self._new_jobs.set()
+        return added
+
+    # отпустить задачу, поставленную с hold, дописав state (например, ID ответа пользователю).
+    # если hold уже истек и задачу взял воркер, его блокировка не снимается
+    async def release(self, key: str, state: Optional[Dict[str, Any]] = None):
+        await self._run(lambda: self._conn.execute(
+            "UPDATE outbox SET state = json_patch(state, ?), "
+            "locked_until = CASE WHEN attempts = 0 THEN 0 ELSE locked_until END "
+            "WHERE idempotency_key = ? AND status = 'pending'",
+            (json.dumps(state or {}, ensure_ascii=False), key)))
+        self._new_jobs.set()
+
+    # взять следующую готовую задачу и заблокировать ее на lease секунд.
+    # если воркер упадет или бот перезапустится, задача снова станет доступна после lease
+    async def claim(self, lease: float) -> Optional[Dict[str, Any]]:
+        def take():
+            now = time.time()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM outbox WHERE status = 'pending' AND available_at <= ? AND locked_until <= ? "
+                    "ORDER BY available_at LIMIT 1", (now, now)).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE outbox SET locked_until = ?, attempts = attempts + 1 WHERE id = ?",
+                        (now + lease, row['id']))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            if row is None:
+                return None
+            return self._job(row, row['attempts'] + 1)
+        return await self._run(take)
+
+    # взять задачу, только что поставленную с hold, чтобы выполнить ее самому
+    # (None - задачу уже брал воркер или ее нет). блокировка - как у claim
+    async def claim_key(self, key: str, lease: float) -> Optional[Dict[str, Any]]:
+        def take():
+            row = self._conn.execute(
+                "UPDATE outbox SET locked_until = ?, attempts = attempts + 1 "
+                "WHERE idempotency_key = ? AND status = 'pending' AND attempts = 0 RETURNING *",
+                (time.time() + lease, key)).fetchone()
+            return self._job(row, row['attempts']) if row is not None else None
+        return await self._run(take)
+
+    @staticmethod
+    def _job(row: sqlite3.Row, attempts: int) -> Dict[str, Any]:
+        return {
+            'id': row['id'],
+            'key': row['idempotency_key'],
+            'payload': json.loads(row['payload']),
+            'state': json.loads(row['state']),
+            'attempts': attempts,
+            'created_at': row['created_at'],
+        }
+
+    # сохранить прогресс задачи (например, ID созданной карточки).
+    # ключи дописываются к сохраненным: ID ответа, записанный release, не теряется
+    async def save_state(self, job_id: int, state: Dict[str, Any]):
+        await self._run(lambda: self._conn.execute(
+            "UPDATE outbox SET state = json_patch(state, ?) WHERE id = ?",
+            (json.dumps(state, ensure_ascii=False), job_id)))
+
+    async def complete(self, job_id: int):
+        await self._run(lambda: self._conn.execute(
+            "UPDATE outbox SET status = 'done', finished_at = ?, locked_until = 0 WHERE id = ?",
+            (time.time(), job_id)))
+
+    # вернуть задачу в очередь с задержкой
+    async def retry(self, job_id: int, delay: float, error: str):
+        await self._run(lambda: self._conn.execute(
+            "UPDATE outbox SET available_at = ?, locked_until = 0, last_error = ? WHERE id = ?",
+            (time.time() + delay, error, job_id)))
+
+    # отложить задачу: как retry, но попытка не засчитывается
+    async def defer(self, job_id: int, delay: float, reason: str):
+        await self._run(lambda: self._conn.execute(
+            "UPDATE outbox SET available_at = ?, locked_until = 0, last_error = ?, "
+            "attempts = MAX(attempts - 1, 0) WHERE id = ?",
+            (time.time() + delay, reason, job_id)))
+
+    async def fail(self, job_id: int, error: str):
+        await self._run(lambda: self._conn.execute(
+            "UPDATE outbox SET status = 'failed', finished_at = ?, locked_until = 0, last_error = ? WHERE id = ?",
+            (time.time(), error, job_id)))
+
+    # удалить завершенные задачи старше max_age секунд (ключи нужны только для защиты от повторов)
+    async def purge(self, max_age: float) -> int:
+        def delete():
+            cursor = self._conn.execute(
+                "DELETE FROM outbox WHERE status != 'pending' AND finished_at < ?",
+                (time.time() - max_age,))
+            return cursor.rowcount
+        return await self._run(delete)
+
+    # метрики очереди: глубина, задачи в работе, задержка самой старой задачи
+    async def stats(self) -> Dict[str, float]:
+        def query():
+            now = time.time()
+            row = self._conn.execute(
+                "SELECT "
+                "SUM(status = 'pending') AS depth, "
+                "SUM(status = 'pending' AND locked_until > ?) AS in_progress, "
+                "SUM(status = 'failed') AS failed, "
+                "MIN(CASE WHEN status = 'pending' THEN created_at END) AS oldest "
+                "FROM outbox", (now,)).fetchone()
+            return {
+                'depth': row['depth'] or 0,
+                'in_progress': row['in_progress'] or 0,
+                'failed': row['failed'] or 0,
+                'lag': now - row['oldest'] if row['oldest'] is not None else 0.0,
+            }
+        return await self._run(query)
+
+    # дождаться новой задачи (или таймаута - для задач, отложенных на повтор)
+    async def wait_for_jobs(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._new_jobs.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._new_jobs.clear()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# пул асинхронных воркеров, разбирающих очередь заказов.
+# handler обрабатывает задачу; исключение означает "повторить позже",
+# JobDeferred - "отложить, не считая попытку",
+# после max_attempts неудачных попыток вызывается on_failure.
+# pause возвращает, сколько секунд не брать новые задачи (например, пока Trello недоступен)
+class OutboxWorkerPool:
+    def __init__(self, outbox: Outbox,
+                 handler: Callable[[Dict[str, Any]], Awaitable[None]],
+                 on_failure: Optional[Callable[[Dict[str, Any], str], Awaitable[None]]] = None,
+                 workers: int = 4, lease: float = 300, max_attempts: int = 8,
+                 retry_delay: float = 5, retry_max_delay: float = 600,
+                 retention: float = 7 * 24 * 3600, stats_interval: float = 60,
+                 pause: Optional[Callable[[], float]] = None):
+        self.outbox = outbox
+        self.handler = handler
+        self.on_failure = on_failure
+        self.pause = pause
+        self.workers = max(1, workers)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.retention = retention
+        self.stats_interval = stats_interval
+        self._tasks: List[asyncio.Task] = []
+
+        self.processed = 0
+        self.retried = 0
+        self.deferred = 0
+        self.failed = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._housekeeping()))
+        logger.info("Запущено воркеров очереди заказов: %s", self.workers)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self, number: int):
+        while True:
+            paused = self.pause() if self.pause is not None else 0
+            if paused > 0:
+                await asyncio.sleep(paused)
+                continue
+
+            try:
+                job = await self.outbox.claim(self.lease)
+            except Exception as e:
+                logger.error("Воркер %s: ошибка чтения очереди: %s", number, e)
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            if job is None:
+                await self.outbox.wait_for_jobs(timeout=1.0)
+                continue
+
+            await self._process(job)
+
+    async def _process(self, job: Dict[str, Any]):
+        try:
+            await self.handler(job)
+        except asyncio.CancelledError:
+            # бот останавливается: снимаем блокировку, чтобы после перезапуска
+            # задача была взята сразу (прогресс уже сохранен в state)
+            await asyncio.shield(self.outbox.retry(job['id'], 0, "остановка бота"))
+            raise
+        except JobDeferred as e:
+            self.deferred += 1
+            logger.info("Заказ %s отложен на %.0f с: %s", job['key'], e.delay, e)
+            await self.outbox.defer(job['id'], e.delay, str(e))
+            return
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            if job['attempts'] >= self.max_attempts:
+                self.failed += 1
+                logger.error("Заказ %s не обработан за %s попыток: %s", job['key'], job['attempts'], error)
+                await self.outbox.fail(job['id'], error)
+                if self.on_failure is not None:
+                    await self.on_failure(job, error)
+                return
+
+            self.retried += 1
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_delay * 2 ** (job['attempts'] - 1)))
+            logger.warning("Заказ %s: попытка %s неудачна (%s), повтор через %.0f с",
+                           job['key'], job['attempts'], error, delay)
+            await self.outbox.retry(job['id'], delay, error)
+            return
+
+        self.processed += 1
+        await self.outbox.complete(job['id'])
+
+    # периодически логируем метрики очереди и чистим старые задачи
+    async def _housekeeping(self):
+        while True:
+            try:
+                purged = await self.outbox.purge(self.retention)
+                if purged:
+                    logger.info("Удалено завершенных задач из очереди: %s", purged)
+                stats = await self.outbox.stats()
+                logger.info(
+                    "Очередь заказов: в очереди %s, в работе %s, задержка %.1f с, "
+                    "обработано %s, повторов %s, отложено %s, ошибок %s",
+                    stats['depth'], stats['in_progress'], stats['lag'], self.processed, self.retried,
+                    self.deferred, self.failed)
+            except Exception as e:
+                logger.error("Ошибка обслуживания очереди заказов: %s", e)
+            await asyncio.sleep(self.stats_interval)
@@ -0,0 +1,135 @@
+import asyncio
+import cProfile
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+# что происходило во время одного апдейта (или задачи из очереди):
+# этапы обработки и запросы к Trello в порядке выполнения
+class Trace:
+    def __init__(self, label: str, info: Optional[Dict[str, Any]] = None):
+        self.label = label
+        self.info = info or {}
+        self.started_at = time.time()
+        self.stages: List[Tuple[str, float]] = []
+        self.trello_calls: List[Tuple[str, str, float]] = []
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('profiling_trace', default=None)
+
+
+def note_stage(stage: str, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages.append((stage, seconds))
+
+
+def note_trello_call(endpoint: str, status: str, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.trello_calls.append((endpoint, status, seconds))
+
+
+# профилирование медленных апдейтов.
+# каждый апдейт получает Trace (дешево); sample_rate апдейтов дополнительно выполняются
+# под cProfile. если апдейт длился дольше threshold, в directory пишутся
+# {label}.json (время, этапы, запросы к Trello) и {label}.prof (pstats, если был профиль).
+# cProfile видит весь поток event loop, поэтому профиль включает и апдейты,
+# которые обрабатывались в это же время; одновременно снимается только один профиль
+class SlowUpdateProfiler:
+    def __init__(self, directory: str, threshold: float = 2.0, sample_rate: float = 0.05,
+                 max_files: int = 200):
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self._profiling = False
+
+        self.traced = 0
+        self.profiled = 0
+        self.dumped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        STAGE_SECONDS.add_listener(lambda seconds, labels: note_stage(labels[0], seconds))
+
+    async def run(self, label: str, call: Callable[[], Awaitable[Any]],
+                  info: Optional[Dict[str, Any]] = None) -> Any:
+        trace = Trace(label, info)
+        token = _current_trace.set(trace)
+        self.traced += 1
+
+        profiler = None
+        if not self._profiling and self.sample_rate > 0 and random.random() < self.sample_rate:
+            profiler = cProfile.Profile()
+            self._profiling = True
+            self.profiled += 1
+            profiler.enable()
+
+        started = time.perf_counter()
+        try:
+            return await call()
+        finally:
+            duration = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            _current_trace.reset(token)
+
+            if duration >= self.threshold:
+                self.dumped += 1
+                logger.warning("Медленная обработка %s: %.2f с", label, duration)
+                try:
+                    await asyncio.to_thread(self._dump, trace, duration, profiler)
+                except Exception as e:
+                    logger.error("Не удалось сохранить профиль %s: %s", label, e)
+
+    # обертка для обработчика задач из очереди заказов
+    def wrap_job(self, handler: Callable[[Dict[str, Any]], Awaitable[None]]) -> Callable[[Dict[str, Any]], Awaitable[None]]:
+        async def profiled_handler(job: Dict[str, Any]):
+            await self.run(f"job-{job['id']}", lambda: handler(job),
+                           {'order': job['key'], 'attempt': job['attempts']})
+        return profiled_handler
+
+    def _dump(self, trace: Trace, duration: float, profiler: Optional[cProfile.Profile]):
+        name = f"{datetime.fromtimestamp(trace.started_at):%Y%m%d-%H%M%S}-{trace.label}"
+        base = os.path.join(self.directory, name)
+
+        profile_file = None
+        if profiler is not None:
+            profile_file = base + '.prof'
+            profiler.dump_stats(profile_file)
+
+        report = {
+            'label': trace.label,
+            **trace.info,
+            'started_at': datetime.fromtimestamp(trace.started_at).isoformat(timespec='milliseconds'),
+            'duration': round(duration, 4),
+            'threshold': self.threshold,
+            'stages': [{'stage': stage, 'seconds': round(seconds, 4)} for stage, seconds in trace.stages],
+            'trello_calls': [{'endpoint': endpoint, 'status': status, 'seconds': round(seconds, 4)}
+                             for endpoint, status, seconds in trace.trello_calls],
+            'profile': os.path.basename(profile_file) if profile_file else None,
+        }
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        self._prune()
+
+    # хранить только последние max_files отчетов
+    def _prune(self):
+        reports = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in reports[:max(0, len(reports) - self.max_files)]:
+            base = os.path.join(self.directory, name[:-len('.json')])
+            for path in (base + '.json', base + '.prof'):
+                if os.path.exists(path):
+                    os.remove(path)
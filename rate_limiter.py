@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# приоритеты запросов к Trello: чем меньше число, тем раньше запрос получит токен
+PRIORITY_CARD = 0       # создание карточки - то, чего ждет пользователь
+PRIORITY_FIELDS = 1     # заполнение кастомных полей
+PRIORITY_METADATA = 2   # фоновое обновление списков и полей доски
+
+
+# общий token bucket для всех запросов к Trello.
+# Trello ограничивает ~100 запросов за 10 секунд на токен. чтобы в любом окне period
+# было не больше limit запросов, корзина вмещает burst токенов и пополняется
+# на limit - burst за period. если токенов нет, запросы ждут в очереди по приоритету
+class TokenBucket:
+    def __init__(self, limit: int, period: float, burst: Optional[int] = None):
+        self.capacity = float(burst if burst else max(1, limit // 10))
+        self.rate = max(limit - self.capacity, 1) / period
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        self.acquired = 0
+        self.waited = 0
+        self.pauses = 0
+
+    # дождаться разрешения на один запрос
+    async def acquire(self, priority: int = PRIORITY_FIELDS):
+        if not self._waiters and self._try_take():
+            self.acquired += 1
+            return
+
+        self.waited += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._schedule()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # токен уже выдан, а запрос отменен - возвращаем токен в корзину
+            if future.done() and not future.cancelled():
+                self._tokens = min(self.capacity, self._tokens + 1)
+                self._schedule()
+            raise
+        self.acquired += 1
+
+    # остановить выдачу токенов (Trello ответил 429 и попросил подождать)
+    def pause(self, seconds: float):
+        blocked_until = time.monotonic() + seconds
+        if blocked_until <= self._blocked_until:
+            return
+
+        self.pauses += 1
+        self._blocked_until = blocked_until
+        self._tokens = 0.0
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        self._schedule()
+
+    def queue_size(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self) -> bool:
+        if time.monotonic() < self._blocked_until:
+            return False
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    # раздать токены ожидающим в порядке приоритета
+    def _release_waiters(self):
+        self._wakeup = None
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._try_take():
+                break
+            heapq.heappop(self._waiters)
+            future.set_result(None)
+        self._schedule()
+
+    # запланировать пробуждение к моменту, когда появится следующий токен
+    def _schedule(self):
+        if self._wakeup is not None or not self._waiters:
+            return
+
+        now = time.monotonic()
+        self._refill()
+        delay = max(self._blocked_until - now, 0.0)
+        if self._tokens < 1:
+            delay = max(delay, (1 - self._tokens) / self.rate)
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._release_waiters)
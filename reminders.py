@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import html
+import logging
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+
+from field_schema import parse_date
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+REMINDERS = REGISTRY.counter(
+    'deadline_reminders_total', 'Напоминания о крайнем сроке по результату', ('result',))
+
+# сколько напоминаний читать из базы за один запрос при отправке
+DELIVERY_BATCH = 500
+# через сколько секунд повторить напоминание, если Telegram недоступен
+RETRY_DELAY = 60
+
+
+# время напоминаний о крайнем сроке: за days_before дней до него в hour часов
+# (местное время). напоминания, время которых уже прошло, не планируются
+def reminder_times(deadline: str, days_before: Sequence[int], hour: int,
+                   now: Optional[float] = None) -> List[Tuple[int, float]]:
+    parsed = parse_date(deadline)
+    if parsed is None:
+        return []
+    now = time.time() if now is None else now
+    times = []
+    for days in days_before:
+        remind_at = (parsed - timedelta(days=days)).replace(hour=hour).timestamp()
+        if remind_at > now:
+            times.append((days, remind_at))
+    return times
+
+
+# текст напоминания
+def format_reminder(name: str, url: str, deadline: str, days: int) -> str:
+    when = {0: "сегодня", 1: "завтра"}.get(days, f"через {days} дн.")
+    return (f"⏰ <b>Крайний срок {when}</b> ({html.escape(deadline)})\n\n"
+            f"<b>📋 Заказ:</b> {html.escape(name)}\n<b>🔗 Ссылка:</b> {url}")
+
+
+# напоминания о крайнем сроке заказов в чат, где заказ был создан.
+# напоминания хранятся в SQLite, а в памяти - куча (время, ID) всех ожидающих.
+# одна задача спит до ближайшего напоминания: ни опроса Trello, ни просмотра всех
+# напоминаний по таймеру. добавление - O(log n), пробуждение - только когда пора отправлять
+class ReminderScheduler:
+    def __init__(self, path: str, days_before: Sequence[int] = (1, 0), hour: int = 10,
+                 max_delay: float = 12 * 3600):
+        self.path = path
+        self.days_before = tuple(days_before)
+        self.hour = hour
+        # напоминание, опоздавшее больше чем на max_delay (бот был выключен), не отправляется
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reminders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                card_id TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                deadline TEXT NOT NULL,
+                days INTEGER NOT NULL,
+                remind_at REAL NOT NULL,
+                UNIQUE (card_id, days)
+            )""")
+        self._heap: List[Tuple[float, int]] = [
+            (remind_at, reminder_id) for reminder_id, remind_at in
+            self._conn.execute("SELECT id, remind_at FROM reminders")]
+        heapq.heapify(self._heap)
+        if self._heap:
+            logger.info("Загружено напоминаний о крайнем сроке: %s", len(self._heap))
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self, func: Callable, *args) -> Any:
+        def locked():
+            with self._lock:
+                return func(*args)
+        return await asyncio.to_thread(locked)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    # запланировать напоминания для созданной карточки (card - {'id', 'shortUrl'}).
+    # повторный вызов для той же карточки (повтор задачи из очереди) ничего не добавляет
+    async def schedule(self, card: Dict[str, Any], data: Dict[str, str], chat_id: int):
+        deadline = data.get('крайний срок')
+        times = reminder_times(deadline, self.days_before, self.hour) if deadline else []
+        if not times:
+            return
+
+        def save() -> List[Tuple[float, int]]:
+            added = []
+            for days, remind_at in times:
+                row = self._conn.execute(
+                    "INSERT OR IGNORE INTO reminders (card_id, chat_id, name, url, deadline, days, remind_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id",
+                    (card['id'], chat_id, data['имя карточки'], card.get('shortUrl', ''), deadline,
+                     days, remind_at)).fetchone()
+                if row is not None:
+                    added.append((remind_at, row[0]))
+            return added
+
+        added = await self._run(save)
+        earliest = self._heap[0][0] if self._heap else None
+        for item in added:
+            heapq.heappush(self._heap, item)
+        # задача спит до прежнего ближайшего напоминания - будим, если новое раньше
+        if added and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def start(self, bot: Bot):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(bot))
+
+    async def _loop(self, bot: Bot):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < DELIVERY_BATCH:
+                due.append(heapq.heappop(self._heap))
+            try:
+                await self._deliver(bot, [reminder_id for _, reminder_id in due], now)
+            except sqlite3.Error as e:
+                logger.error("Ошибка базы напоминаний: %s", e)
+
+    # отправить наступившие напоминания и удалить их из базы
+    async def _deliver(self, bot: Bot, reminder_ids: List[int], now: float):
+        def load():
+            placeholders = ','.join('?' * len(reminder_ids))
+            return self._conn.execute(
+                f"SELECT id, chat_id, name, url, deadline, days, remind_at FROM reminders "
+                f"WHERE id IN ({placeholders}) ORDER BY remind_at", reminder_ids).fetchall()
+
+        done = []
+
+        def delete():
+            self._conn.executemany("DELETE FROM reminders WHERE id = ?", ((reminder_id,) for reminder_id in done))
+
+        try:
+            for reminder_id, chat_id, name, url, deadline, days, remind_at in await self._run(load):
+                if now - remind_at > self.max_delay:
+                    REMINDERS.inc('stale')
+                    done.append(reminder_id)
+                    continue
+                try:
+                    await self._send(bot, chat_id, format_reminder(name, url, deadline, days))
+                    REMINDERS.inc('sent')
+                except TelegramNetworkError as e:
+                    logger.warning("Telegram недоступен, напоминание повторится через %s с: %s", RETRY_DELAY, e)
+                    heapq.heappush(self._heap, (now + RETRY_DELAY, reminder_id))
+                    continue
+                except TelegramAPIError as e:
+                    # чат удален или бот заблокирован - повторять бесполезно
+                    logger.warning("Не удалось отправить напоминание в чат %s: %s", chat_id, e)
+                    REMINDERS.inc('failed')
+                done.append(reminder_id)
+        finally:
+            # отправленные удаляются и при остановке бота посреди пачки
+            await self._run(delete)
+
+    # отправка с учетом лимита Telegram: при RetryAfter ждем и повторяем
+    @staticmethod
+    async def _send(bot: Bot, chat_id: int, text: str):
+        while True:
+            try:
+                await bot.send_message(chat_id, text, parse_mode="HTML", disable_web_page_preview=True)
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from field_schema import ORDER_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+
+# куда создавать карточку заказа
+class Route:
+    def __init__(self, board_id: str, list_name: str):
+        self.board_id = board_id
+        self.list_name = list_name
+
+    def as_dict(self) -> Dict[str, str]:
+        return {'board_id': self.board_id, 'list_name': self.list_name}
+
+    def __repr__(self) -> str:
+        return f"Route({self.board_id!r}, {self.list_name!r})"
+
+
+# выбор доски и списка для заказа.
+# правила из JSON-файла сводятся в словари при загрузке, поэтому выбор - не больше
+# трех поисков в словаре. приоритет: значение поля заказа, пользователь, чат, доска по умолчанию.
+# формат файла:
+#   {"rules": [
+#     {"field": "цех", "value": ["мебель", "кухни"], "board": "<ID доски>", "list": "Новые"},
+#     {"user": [123456], "board": "<ID доски>"},
+#     {"chat": [-100123456], "board": "<ID доски>", "list": "Заказы"}
+#   ]}
+# если список не указан, используется список по умолчанию (TRELLO_LIST)
+class Router:
+    def __init__(self, default: Route, rules: Optional[List[Dict]] = None):
+        self.default = default
+        self.by_field: Dict[Tuple[str, str], Route] = {}
+        self.by_user: Dict[int, Route] = {}
+        self.by_chat: Dict[int, Route] = {}
+        # поля, по которым есть правила (чтобы не перебирать все поля заказа)
+        self.fields: List[str] = []
+
+        for rule in rules or []:
+            route = Route(rule['board'], rule.get('list') or default.list_name)
+            if 'field' in rule:
+                field = ORDER_SCHEMA.canonical(rule['field'].strip().lower())
+                if field not in self.fields:
+                    self.fields.append(field)
+                for value in _as_list(rule.get('value')):
+                    self.by_field.setdefault((field, str(value).strip().lower()), route)
+            for user_id in _as_list(rule.get('user')):
+                self.by_user.setdefault(int(user_id), route)
+            for chat_id in _as_list(rule.get('chat')):
+                self.by_chat.setdefault(int(chat_id), route)
+
+    @classmethod
+    def from_file(cls, path: Optional[str], default: Route) -> 'Router':
+        if not path or not os.path.exists(path):
+            return cls(default)
+        with open(path, encoding='utf-8') as f:
+            rules = json.load(f).get('rules', [])
+        router = cls(default, rules)
+        logger.info("Загружено правил маршрутизации: %s, досок: %s", len(rules), len(router.boards()))
+        return router
+
+    def route(self, chat_id: Optional[int], user_id: Optional[int], data: Dict[str, str]) -> Route:
+        for field in self.fields:
+            value = data.get(field)
+            if value:
+                route = self.by_field.get((field, value.strip().lower()))
+                if route is not None:
+                    return route
+        route = self.by_user.get(user_id)
+        if route is not None:
+            return route
+        return self.by_chat.get(chat_id, self.default)
+
+    # все доски из правил (для прогрева кэша при старте)
+    def boards(self) -> List[str]:
+        boards = [self.default.board_id]
+        for route in (*self.by_field.values(), *self.by_user.values(), *self.by_chat.values()):
+            if route.board_id not in boards:
+                boards.append(route.board_id)
+        return boards
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
@@ -0,0 +1,136 @@
+import asyncio
+import io
+from datetime import datetime
+
+import pytest
+
+from bulk_import import (format_import_summary, is_bulk_message, is_table_file, iter_table_orders,
+                         run_bulk_import, split_orders)
+
+
+# UTF-8 CSV длиннее образца в 4096 байт, граница образца режет букву кириллицы пополам
+def test_utf8_csv_larger_than_sample():
+    header = 'имя карточки;клиент;цвет\n'
+    rows = ''.join(f'Шкаф {number};Клиент Ёлкин {number};белый\n' for number in range(1, 200))
+    for padding in range(4):
+        content = (header + 'Стол' + 'x' * padding + ';Ёлкин;серый\n' + rows).encode('utf-8')
+        # второй байт двухбайтного символа
+        if 0x80 <= content[4096] < 0xC0:
+            break
+    assert 0x80 <= content[4096] < 0xC0
+
+    orders = list(iter_table_orders(io.BytesIO(content), 'orders.csv'))
+
+    assert len(orders) == 200
+    assert orders[1] == ('Строка 3', {'имя карточки': 'Шкаф 1', 'клиент': 'Клиент Ёлкин 1', 'цвет': 'белый'})
+    assert orders[-1][1]['клиент'] == 'Клиент Ёлкин 199'
+
+
+# CSV из Excel в русской локали: cp1251
+def test_cp1251_csv():
+    content = 'имя карточки;клиент\nШкаф;Ёлкин\n'.encode('cp1251')
+    assert list(iter_table_orders(io.BytesIO(content), 'orders.csv')) == [
+        ('Строка 2', {'имя карточки': 'Шкаф', 'клиент': 'Ёлкин'})]
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('имя карточки: Шкаф\n---\nимя карточки: Стол', True),
+    ('имя карточки: Шкаф\n  -----  \nимя карточки: Стол', True),
+    ('имя карточки: Шкаф\nдополнительно: -- без скидки', False),
+    ('имя карточки: Шкаф', False),
+])
+def test_is_bulk_message(text, expected):
+    assert is_bulk_message(text) == expected
+
+
+# пустые блоки между разделителями пропускаются
+def test_split_orders():
+    text = '---\nимя карточки: Шкаф\nклиент: Иван\n---\n\n---\nИмя карточки: Стол\n---\n'
+    assert split_orders(text) == [
+        ('Заказ 1', {'имя карточки': 'Шкаф', 'клиент': 'Иван'}),
+        ('Заказ 2', {'имя карточки': 'Стол'}),
+    ]
+
+
+@pytest.mark.parametrize('file_name, expected', [
+    ('orders.csv', True), ('ORDERS.XLSX', True), ('orders.xls', False), ('orders.txt', False), (None, False)])
+def test_is_table_file(file_name, expected):
+    assert is_table_file(file_name) == expected
+
+
+# разделитель определяется по образцу, названия полей приводятся как в сообщении,
+# пустые строки пропускаются, но номера строк сохраняются
+@pytest.mark.parametrize('content', [
+    'Имя карточки,Заказчик,Цвет\nШкаф,Иван,белый\n,,\nСтол,"Петров, ИП",\n',
+    'Имя карточки;Заказчик;Цвет\r\nШкаф;Иван;белый\r\n;;\r\nСтол;"Петров, ИП";\r\n',
+    '\ufeffИмя карточки\tЗаказчик\tЦвет\nШкаф\tИван\tбелый\n\t\t\nСтол\tПетров, ИП\t\n',
+], ids=['comma', 'semicolon-crlf', 'tab-bom'])
+def test_csv_formats(content):
+    assert list(iter_table_orders(io.BytesIO(content.encode('utf-8')), 'orders.csv')) == [
+        ('Строка 2', {'имя карточки': 'Шкаф', 'клиент': 'Иван', 'цвет': 'белый'}),
+        ('Строка 4', {'имя карточки': 'Стол', 'клиент': 'Петров, ИП'}),
+    ]
+
+
+# даты и целые числа из ячеек XLSX - как их набирают в сообщении
+def test_xlsx(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['имя карточки', 'крайний срок', 'телефон', 'цвет'])
+    sheet.append(['Шкаф', datetime(2025, 10, 25), 79000000000.0, None])
+    sheet.append([None, None, None, None])
+    sheet.append(['Стол', '01.11.2025', '+7 900', 'белый'])
+    path = tmp_path / 'orders.xlsx'
+    workbook.save(path)
+
+    with open(path, 'rb') as file:
+        assert list(iter_table_orders(file, 'orders.xlsx')) == [
+            ('Строка 2', {'имя карточки': 'Шкаф', 'крайний срок': '25.10.2025', 'телефон': '79000000000'}),
+            ('Строка 4', {'имя карточки': 'Стол', 'крайний срок': '01.11.2025', 'телефон': '+7 900',
+                          'цвет': 'белый'}),
+        ]
+
+
+# результаты в порядке заказов, одновременно не больше concurrency заказов,
+# исключение в одном заказе не останавливает импорт
+def test_run_bulk_import():
+    orders = [(f"Строка {number}", {'имя карточки': f"Шкаф {number}"}) for number in range(1, 121)]
+    running = 0
+    peak = 0
+
+    async def create_order(label, data):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001 * (len(label) % 3))
+        running -= 1
+        if label == 'Строка 7':
+            raise RuntimeError('сбой')
+        return label != 'Строка 5', data['имя карточки']
+
+    results = asyncio.run(run_bulk_import(iter(orders), create_order, concurrency=3))
+
+    assert [label for label, _, _ in results] == [label for label, _ in orders]
+    assert results[0] == ('Строка 1', True, 'Шкаф 1')
+    assert results[4] == ('Строка 5', False, 'Шкаф 5')
+    assert results[6] == ('Строка 7', False, 'внутренняя ошибка')
+    assert peak == 3
+
+
+def test_format_import_summary():
+    results = [('Заказ 1', True, 'Шкаф — https://trello.com/c/a'), ('Заказ 2', False, 'нет поля')]
+    assert format_import_summary(results) == [
+        '📦 <b>Импорт заказов:</b> создано 1 из 2\n'
+        '✅ Заказ 1: Шкаф — https://trello.com/c/a\n'
+        '❌ Заказ 2: нет поля\n'
+    ]
+
+
+# длинный отчет делится на сообщения по целым строкам
+def test_format_import_summary_split():
+    results = [(f"Строка {number}", True, 'x' * 50) for number in range(1, 101)]
+    messages = format_import_summary(results, limit=1000)
+    assert len(messages) > 1
+    assert all(len(message) <= 1000 for message in messages)
+    assert ''.join(messages).count('✅') == 100
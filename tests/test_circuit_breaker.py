@@ -0,0 +1,144 @@
+import time
+
+import pytest
+
+from circuit_breaker import (CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, latency_budget,
+                             remaining_budget)
+
+
+def make_breaker(**kwargs) -> CircuitBreaker:
+    options = dict(failure_rate=0.5, slow_call_rate=0.8, slow_call_seconds=5.0, window=60.0,
+                   min_calls=4, open_seconds=60.0, probes=1)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+# count запросов подряд с одним результатом
+def record_calls(breaker: CircuitBreaker, count: int, failed: bool = False, duration: float = 0.1, **kwargs):
+    for _ in range(count):
+        assert breaker.allow() is False
+        breaker.record(failed, duration, **kwargs)
+
+
+def test_closed_allows_requests():
+    breaker = make_breaker()
+    record_calls(breaker, 10)
+    assert breaker.state == CLOSED
+    assert breaker.retry_after() == 0
+
+
+# пока вызовов меньше min_calls, цепь не размыкается даже при одних ошибках
+def test_min_calls():
+    breaker = make_breaker()
+    record_calls(breaker, 3, failed=True)
+    assert breaker.state == CLOSED
+    record_calls(breaker, 1, failed=True)
+    assert breaker.state == OPEN
+    assert breaker.opened == 1
+
+
+@pytest.mark.parametrize('failures, state', [(1, CLOSED), (2, OPEN)])
+def test_failure_rate(failures, state):
+    breaker = make_breaker()
+    record_calls(breaker, 4 - failures)
+    record_calls(breaker, failures, failed=True)
+    assert breaker.state == state
+
+
+def test_slow_calls_open():
+    breaker = make_breaker()
+    record_calls(breaker, 4, duration=6.0)
+    assert breaker.state == OPEN
+
+
+# долгие сами по себе запросы (загрузки) не считаются медленными
+def test_slow_calls_not_counted():
+    breaker = make_breaker()
+    record_calls(breaker, 4, duration=6.0, count_slow=False)
+    assert breaker.state == CLOSED
+
+
+def test_open_rejects():
+    breaker = make_breaker()
+    record_calls(breaker, 4, failed=True)
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow()
+    assert 0 < error.value.retry_after <= 60
+    assert breaker.rejected == 1
+
+
+# ответ на запрос, отправленный до размыкания, не меняет состояние
+def test_late_result_ignored():
+    breaker = make_breaker(open_seconds=0)
+    record_calls(breaker, 4, failed=True)
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+
+
+# после open_seconds пропускается один пробный запрос, остальные отклоняются
+def test_half_open_single_probe():
+    breaker = make_breaker(open_seconds=0)
+    record_calls(breaker, 4, failed=True)
+    assert breaker.allow() is True
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_probe_success_closes():
+    breaker = make_breaker(open_seconds=0)
+    record_calls(breaker, 4, failed=True)
+    assert breaker.allow() is True
+    breaker.record(False, 0.1, probe=True)
+    assert breaker.state == CLOSED
+    # окно после замыкания начинается заново
+    record_calls(breaker, 3, failed=True)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.parametrize('failed, duration', [(True, 0.1), (False, 6.0)], ids=['failed', 'slow'])
+def test_probe_failure_reopens(failed, duration):
+    breaker = make_breaker(open_seconds=0)
+    record_calls(breaker, 4, failed=True)
+    assert breaker.allow() is True
+    breaker.record(failed, duration, probe=True)
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+
+
+# отмененный пробный запрос освобождает место для следующего
+def test_probe_release():
+    breaker = make_breaker(open_seconds=0)
+    record_calls(breaker, 4, failed=True)
+    assert breaker.allow() is True
+    breaker.release(probe=True)
+    assert breaker.allow() is True
+
+
+def test_several_probes():
+    breaker = make_breaker(open_seconds=0, probes=2)
+    record_calls(breaker, 4, failed=True)
+    assert breaker.allow() is True
+    assert breaker.allow() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_latency_budget():
+    assert remaining_budget() is None
+    with latency_budget(10):
+        assert 9 < remaining_budget() <= 10
+        # вложенный бюджет не продлевает внешний
+        with latency_budget(100):
+            assert remaining_budget() <= 10
+        with latency_budget(1):
+            assert remaining_budget() <= 1
+    assert remaining_budget() is None
+
+
+def test_latency_budget_disabled():
+    with latency_budget(None):
+        assert remaining_budget() is None
+    with latency_budget(0.05):
+        time.sleep(0.06)
+        assert remaining_budget() < 0
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+import pytest
+
+from dedup import DedupCache, order_fingerprint
+
+CARD = {'id': 'c1', 'shortUrl': 'https://trello.com/c/abc'}
+DATA = {'имя карточки': 'Шкаф', 'клиент': 'Иван'}
+
+
+# те же данные, набранные заново, дают тот же отпечаток
+@pytest.mark.parametrize('data', [
+    {'клиент': 'Иван', 'имя карточки': 'Шкаф'},
+    {'имя карточки': '  ШКАФ ', 'клиент': 'иван'},
+    {'имя карточки': 'Шкаф', 'клиент': 'Иван', 'telegram пользователь': '@user'},
+], ids=['order', 'case-and-spaces', 'telegram-user'])
+def test_same_fingerprint(data):
+    assert order_fingerprint(1, 2, data) == order_fingerprint(1, 2, DATA)
+
+
+@pytest.mark.parametrize('chat_id, user_id, data', [
+    (3, 2, DATA),
+    (1, 3, DATA),
+    (1, 2, {'имя карточки': 'Шкаф', 'клиент': 'Петр'}),
+    (1, 2, {'имя карточки': 'Шкаф'}),
+], ids=['chat', 'user', 'value', 'field'])
+def test_different_fingerprint(chat_id, user_id, data):
+    assert order_fingerprint(chat_id, user_id, data) != order_fingerprint(1, 2, DATA)
+
+
+def test_reserve_complete():
+    cache = DedupCache()
+    assert cache.reserve('fp') is None
+    # карточка еще создается
+    pending = cache.reserve('fp')
+    assert pending is not None and pending.card is None
+    asyncio.run(cache.complete('fp', CARD))
+    assert cache.reserve('fp').card == CARD
+    assert cache.duplicates == 2
+
+
+# неудачный заказ можно отправить снова, а созданную карточку release не забывает
+def test_release():
+    cache = DedupCache()
+    cache.reserve('fp')
+    cache.release('fp')
+    assert cache.reserve('fp') is None
+    asyncio.run(cache.complete('fp', CARD))
+    cache.release('fp')
+    assert cache.reserve('fp').card == CARD
+
+
+def test_ttl():
+    cache = DedupCache(ttl=0.05)
+    cache.reserve('fp')
+    time.sleep(0.1)
+    assert cache.reserve('fp') is None
+
+
+def test_max_size():
+    cache = DedupCache(max_size=2)
+    for fingerprint in ('a', 'b', 'c'):
+        cache.reserve(fingerprint)
+    assert len(cache) == 2
+    # вытесняется самая старая запись
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+
+
+# созданные карточки переживают перезапуск, незавершенные резервы - нет
+def test_persistent(tmp_path):
+    path = str(tmp_path / 'dedup.db')
+    cache = DedupCache(path=path)
+    cache.reserve('created')
+    cache.reserve('pending')
+    asyncio.run(cache.complete('created', CARD))
+    cache.close()
+
+    cache = DedupCache(path=path)
+    try:
+        assert cache.get('created').card == CARD
+        assert cache.get('pending') is None
+    finally:
+        cache.close()
@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+
+from outbox import Outbox
+
+PAYLOAD = {'chat_id': 1, 'data': {'имя карточки': 'Шкаф'}}
+
+
+# выполнить сценарий с новой очередью в tmp_path
+def run_with_outbox(tmp_path, scenario):
+    async def run():
+        outbox = Outbox(str(tmp_path / 'outbox.db'))
+        try:
+            return await scenario(outbox)
+        finally:
+            outbox.close()
+    return asyncio.run(run())
+
+
+def test_enqueue_claim_complete(tmp_path):
+    async def scenario(outbox):
+        assert await outbox.enqueue('1:1', PAYLOAD)
+        job = await outbox.claim(lease=60)
+        assert job['key'] == '1:1'
+        assert job['payload'] == PAYLOAD
+        assert job['state'] == {}
+        assert job['attempts'] == 1
+        # задача заблокирована на время lease
+        assert await outbox.claim(lease=60) is None
+        await outbox.complete(job['id'])
+        assert await outbox.claim(lease=60) is None
+        return await outbox.stats()
+
+    stats = run_with_outbox(tmp_path, scenario)
+    assert stats['depth'] == 0
+    assert stats['in_progress'] == 0
+
+
+# повторная доставка того же апдейта не создает вторую задачу
+def test_idempotency_key(tmp_path):
+    async def scenario(outbox):
+        assert await outbox.enqueue('1:1', PAYLOAD)
+        assert not await outbox.enqueue('1:1', {'chat_id': 2})
+        assert await outbox.contains('1:1')
+        assert not await outbox.contains('1:2')
+        return await outbox.claim(lease=60)
+
+    assert run_with_outbox(tmp_path, scenario)['payload'] == PAYLOAD
+
+
+# истекший lease: задачу упавшего воркера берет другой
+def test_lease_expires(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD)
+        first = await outbox.claim(lease=0.05)
+        await asyncio.sleep(0.1)
+        second = await outbox.claim(lease=60)
+        return first, second
+
+    first, second = run_with_outbox(tmp_path, scenario)
+    assert second['id'] == first['id']
+    assert second['attempts'] == 2
+
+
+def test_retry_counts_attempt(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD)
+        job = await outbox.claim(lease=60)
+        await outbox.retry(job['id'], 60, 'ошибка')
+        # задача отложена на delay
+        assert await outbox.claim(lease=60) is None
+        await outbox.retry(job['id'], 0, 'ошибка')
+        return await outbox.claim(lease=60)
+
+    assert run_with_outbox(tmp_path, scenario)['attempts'] == 2
+
+
+def test_defer_keeps_attempt(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD)
+        job = await outbox.claim(lease=60)
+        await outbox.defer(job['id'], 0, 'Trello недоступен')
+        return await outbox.claim(lease=60)
+
+    assert run_with_outbox(tmp_path, scenario)['attempts'] == 1
+
+
+# задача с hold не достается воркерам, пока ее не отпустят
+def test_hold_and_release(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD, hold=60)
+        assert await outbox.claim(lease=60) is None
+        await outbox.release('1:1', {'reply_message_id': 10})
+        return await outbox.claim(lease=60)
+
+    assert run_with_outbox(tmp_path, scenario)['state'] == {'reply_message_id': 10}
+
+
+# hold истек и задачу взял воркер: release дописывает state, но не снимает блокировку
+def test_release_after_claim(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD, hold=0.05)
+        await asyncio.sleep(0.1)
+        job = await outbox.claim(lease=60)
+        await outbox.release('1:1', {'reply_message_id': 10})
+        assert await outbox.claim(lease=60) is None
+        await outbox.retry(job['id'], 0, 'ошибка')
+        return await outbox.claim(lease=60)
+
+    assert run_with_outbox(tmp_path, scenario)['state'] == {'reply_message_id': 10}
+
+
+# задачу с hold можно выполнить самому, но только один раз и до воркеров
+def test_claim_key(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD, hold=60)
+        job = await outbox.claim_key('1:1', lease=60)
+        assert await outbox.claim_key('1:1', lease=60) is None
+        assert await outbox.claim(lease=60) is None
+        assert await outbox.claim_key('1:2', lease=60) is None
+        return job
+
+    job = run_with_outbox(tmp_path, scenario)
+    assert job['attempts'] == 1
+    assert job['payload'] == PAYLOAD
+
+
+def test_save_state_merges(tmp_path):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD, hold=60)
+        await outbox.release('1:1', {'reply_message_id': 10})
+        job = await outbox.claim(lease=0)
+        await outbox.save_state(job['id'], {'card': {'id': 'c1'}})
+        return await outbox.claim(lease=60)
+
+    assert run_with_outbox(tmp_path, scenario)['state'] == {'reply_message_id': 10, 'card': {'id': 'c1'}}
+
+
+@pytest.mark.parametrize('finish', ['complete', 'fail'])
+def test_purge(tmp_path, finish):
+    async def scenario(outbox):
+        await outbox.enqueue('1:1', PAYLOAD)
+        await outbox.enqueue('1:2', PAYLOAD)
+        job = await outbox.claim(lease=60)
+        if finish == 'complete':
+            await outbox.complete(job['id'])
+        else:
+            await outbox.fail(job['id'], 'ошибка')
+        assert await outbox.purge(3600) == 0
+        await asyncio.sleep(0.01)
+        assert await outbox.purge(0) == 1
+        # после очистки ключ снова свободен, а задача в очереди остается
+        return await outbox.contains(job['key']), await outbox.stats()
+
+    contained, stats = run_with_outbox(tmp_path, scenario)
+    assert not contained
+    assert stats['depth'] == 1
+    assert stats['failed'] == 0
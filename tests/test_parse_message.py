@@ -0,0 +1,107 @@
+import pytest
+
+from utils import parse_message
+
+# ожидаемые значения получены исходной версией parse_message (до общего шаблона строки):
+# новый парсер должен разбирать все форматы из /start так же
+
+# пример "С кавычками" из /start
+QUOTED_EXAMPLE = '''"имя карточки": "Название заказа"
+"дата заказа": "10.09.2025"
+"крайний срок": "25.10.2025"
+"клиент": "Имя клиента"
+"цвет": "цвет"
+"телефон": "+7 XXX XXX XXXX"
+"дополнительно": "информация"'''
+
+# пример "Без кавычек" из /start
+UNQUOTED_EXAMPLE = '''имя карточки: Название заказа
+дата заказа: 10.09.2025
+крайний срок: 25.10.2025
+клиент: Имя клиента
+цвет: цвет
+телефон: +7 XXX XXX XXXX
+дополнительно: информация'''
+
+START_EXAMPLE_DATA = {
+    'имя карточки': 'Название заказа',
+    'дата заказа': '10.09.2025',
+    'крайний срок': '25.10.2025',
+    'клиент': 'Имя клиента',
+    'цвет': 'цвет',
+    'телефон': '+7 XXX XXX XXXX',
+    'дополнительно': 'информация',
+}
+
+
+@pytest.mark.parametrize('text', [QUOTED_EXAMPLE, UNQUOTED_EXAMPLE], ids=['quoted', 'unquoted'])
+def test_start_examples(text):
+    assert parse_message(text) == START_EXAMPLE_DATA
+
+
+# каждая строка примеров /start по отдельности
+@pytest.mark.parametrize('line', QUOTED_EXAMPLE.split('\n') + UNQUOTED_EXAMPLE.split('\n'))
+def test_start_example_lines(line):
+    data = parse_message(line)
+    assert len(data) == 1
+    field_name, field_value = next(iter(data.items()))
+    assert START_EXAMPLE_DATA[field_name] == field_value
+
+
+@pytest.mark.parametrize('text, expected', [
+    # двоеточие внутри названия поля в кавычках
+    ('"адрес: доставка": "ул. Ленина, 1"', {'адрес: доставка': 'ул. Ленина, 1'}),
+    # без кавычек у значения строка разбирается по первому двоеточию
+    ('"адрес: доставка": ул. Ленина', {'"адрес': 'доставка": ул. Ленина'}),
+    # двоеточие в значении
+    ('время: 18:00', {'время': '18:00'}),
+    ('имя карточки:: Шкаф', {'имя карточки': ': Шкаф'}),
+    # название в кавычках, значение без
+    ('"клиент": Иван', {'клиент': 'Иван'}),
+    # кавычки вокруг значения снимаются
+    ("цвет: 'белый'", {'цвет': 'белый'}),
+    ('дата заказа: "10.09.2025"', {'дата заказа': '10.09.2025'}),
+    # регистр названий и лишние пробелы
+    ('ИМЯ КАРТОЧКИ: Шкаф\n  Клиент :  Иван  ', {'имя карточки': 'Шкаф', 'клиент': 'Иван'}),
+    ('\n\n  имя карточки: Шкаф  \n\n', {'имя карточки': 'Шкаф'}),
+    ('имя карточки: Шкаф\r\nклиент: Иван', {'имя карточки': 'Шкаф', 'клиент': 'Иван'}),
+    ('телефон: +7 (912) 345-67-89', {'телефон': '+7 (912) 345-67-89'}),
+], ids=['quoted-key-colon', 'quoted-key-colon-unquoted-value', 'value-colon', 'double-colon',
+        'quoted-key-only', 'single-quoted-value', 'quoted-date', 'case-and-spaces', 'blank-lines', 'crlf',
+        'phone'])
+def test_formats(text, expected):
+    assert parse_message(text) == expected
+
+
+# пустые значения пропускаются
+@pytest.mark.parametrize('line', ['клиент:', 'клиент: ""', '"клиент": ""', "клиент: ''"])
+def test_empty_value(line):
+    assert parse_message(f"{line}\nимя карточки: Шкаф") == {'имя карточки': 'Шкаф'}
+
+
+# у дат время и все после первого пробела отбрасывается
+@pytest.mark.parametrize('text, expected', [
+    ('"крайний срок": "25.10.2025 18:00"', {'крайний срок': '25.10.2025'}),
+    ('дата заказа: 10.09.2025 12:30', {'дата заказа': '10.09.2025'}),
+    ("крайний срок: '25.10.2025 18:00'", {'крайний срок': '25.10.2025'}),
+    ('"дата заказа": "\'10.09.2025\' утром"', {'дата заказа': '10.09.2025'}),
+    ('крайний срок: завтра вечером', {'крайний срок': 'завтра'}),
+])
+def test_date_with_time(text, expected):
+    assert parse_message(text) == expected
+
+
+# строки без двоеточия и без названия поля пропускаются
+@pytest.mark.parametrize('line', ['просто текст', ':значение', '"клиент" Иван'])
+def test_line_without_field(line):
+    assert parse_message(f"{line}\nимя карточки: Шкаф") == {'имя карточки': 'Шкаф'}
+
+
+# повторное поле: остается последнее значение
+@pytest.mark.parametrize('text, expected', [
+    ('имя карточки: Шкаф\nимя карточки: Стол', {'имя карточки': 'Стол'}),
+    ('"цвет": "белый"\nцвет: черный', {'цвет': 'черный'}),
+    ('Цвет: белый\n"ЦВЕТ": "черный"', {'цвет': 'черный'}),
+], ids=['unquoted', 'quoted-then-unquoted', 'unquoted-then-quoted'])
+def test_duplicate_keys(text, expected):
+    assert parse_message(text) == expected
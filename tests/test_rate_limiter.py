@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from rate_limiter import PRIORITY_CARD, PRIORITY_FIELDS, PRIORITY_METADATA, TokenBucket
+
+
+# корзина на 1 токен, пополняется примерно раз в 50 мс
+def make_bucket() -> TokenBucket:
+    return TokenBucket(limit=21, period=1.0, burst=1)
+
+
+def test_burst_without_waiting():
+    async def run():
+        bucket = TokenBucket(limit=100, period=10.0, burst=5)
+        for _ in range(5):
+            await bucket.acquire()
+        return bucket
+
+    bucket = asyncio.run(run())
+    assert bucket.acquired == 5
+    assert bucket.waited == 0
+
+
+# ожидающие получают токены по приоритету, а не по очереди прихода
+def test_priority_order():
+    async def run():
+        bucket = make_bucket()
+        await bucket.acquire()
+        order = []
+
+        async def request(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(request(name, priority)) for name, priority in [
+            ('metadata', PRIORITY_METADATA), ('fields', PRIORITY_FIELDS),
+            ('card', PRIORITY_CARD), ('card2', PRIORITY_CARD)]]
+        await asyncio.sleep(0)
+        assert bucket.queue_size() == 4
+        await asyncio.gather(*tasks)
+        return order
+
+    # при равном приоритете - по очереди прихода
+    assert asyncio.run(run()) == ['card', 'card2', 'fields', 'metadata']
+
+
+def test_rate():
+    async def run():
+        bucket = make_bucket()
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # первый токен - из корзины, остальные четыре - по одному за 50 мс
+    assert 0.18 < asyncio.run(run()) < 1.0
+
+
+# отмененный запрос не держит очередь и не тратит токен
+def test_cancelled_waiter():
+    async def run():
+        bucket = make_bucket()
+        await bucket.acquire()
+        waiter = asyncio.create_task(bucket.acquire(PRIORITY_CARD))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        assert bucket.queue_size() == 0
+        await asyncio.wait_for(bucket.acquire(PRIORITY_METADATA), 1.0)
+        return bucket
+
+    assert asyncio.run(run()).acquired == 2
+
+
+# 429 от Trello: токены не выдаются до конца паузы
+def test_pause():
+    async def run():
+        bucket = TokenBucket(limit=100, period=10.0, burst=5)
+        bucket.pause(0.2)
+        # более короткая пауза не сокращает текущую
+        bucket.pause(0.05)
+        started = time.monotonic()
+        await bucket.acquire()
+        return bucket, time.monotonic() - started
+
+    bucket, waited = asyncio.run(run())
+    assert waited >= 0.19
+    assert bucket.pauses == 1
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytest
+
+from reminders import format_reminder, reminder_times
+
+
+# время в секундах для местных даты и часа
+def local(year, month, day, hour=0) -> float:
+    return datetime(year, month, day, hour).timestamp()
+
+
+def test_reminder_times():
+    assert reminder_times('25.10.2025', (1, 0), 10, now=local(2025, 10, 1)) == [
+        (1, local(2025, 10, 24, 10)),
+        (0, local(2025, 10, 25, 10)),
+    ]
+
+
+# напоминания, время которых уже прошло, не планируются
+@pytest.mark.parametrize('now, days', [
+    (local(2025, 10, 24, 9), [1, 0]),
+    (local(2025, 10, 24, 10), [0]),
+    (local(2025, 10, 25, 9), [0]),
+    (local(2025, 10, 25, 10), []),
+    (local(2025, 10, 26), []),
+])
+def test_past_reminders_skipped(now, days):
+    assert [days for days, _ in reminder_times('25.10.2025', (1, 0), 10, now=now)] == days
+
+
+@pytest.mark.parametrize('deadline', ['25.10.2025 18:00', '2025-10-25', '25/10/2025'])
+def test_deadline_formats(deadline):
+    assert reminder_times(deadline, (0,), 9, now=local(2025, 10, 1)) == [(0, local(2025, 10, 25, 9))]
+
+
+@pytest.mark.parametrize('deadline', ['', 'завтра', '31.02.2025'])
+def test_invalid_deadline(deadline):
+    assert reminder_times(deadline, (1, 0), 10, now=local(2025, 10, 1)) == []
+
+
+def test_several_days_before():
+    times = reminder_times('25.10.2025', (3, 1), 12, now=local(2025, 10, 1))
+    assert times == [(3, local(2025, 10, 22, 12)), (1, local(2025, 10, 24, 12))]
+
+
+@pytest.mark.parametrize('days, when', [(0, 'сегодня'), (1, 'завтра'), (3, 'через 3 дн.')])
+def test_format_reminder(days, when):
+    text = format_reminder('Шкаф <белый>', 'https://trello.com/c/abc', '25.10.2025', days)
+    assert f"Крайний срок {when}" in text
+    assert 'Шкаф &lt;белый&gt;' in text
+    assert 'https://trello.com/c/abc' in text
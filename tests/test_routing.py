@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from routing import Route, Router
+
+DEFAULT = Route('default-board', 'Заказы')
+
+RULES = [
+    {'field': 'Цех', 'value': ['мебель', 'Кухни'], 'board': 'field-board', 'list': 'Новые'},
+    {'field': 'заказчик', 'value': 'ООО Ромашка', 'board': 'client-board'},
+    {'user': [10], 'board': 'user-board', 'list': 'Личные'},
+    {'chat': -100, 'board': 'chat-board'},
+]
+
+
+@pytest.fixture
+def router():
+    return Router(DEFAULT, RULES)
+
+
+# приоритет: поле заказа, пользователь, чат, доска по умолчанию
+@pytest.mark.parametrize('chat_id, user_id, data, expected', [
+    (-100, 10, {'цех': 'мебель'}, ('field-board', 'Новые')),
+    (-100, 10, {'цех': 'столярка'}, ('user-board', 'Личные')),
+    (-100, 11, {'цех': 'столярка'}, ('chat-board', 'Заказы')),
+    (-101, 11, {'цех': 'столярка'}, ('default-board', 'Заказы')),
+    (-100, None, {}, ('chat-board', 'Заказы')),
+    (None, None, {}, ('default-board', 'Заказы')),
+], ids=['field', 'user', 'chat', 'default', 'no-user', 'no-chat'])
+def test_precedence(router, chat_id, user_id, data, expected):
+    route = router.route(chat_id, user_id, data)
+    assert (route.board_id, route.list_name) == expected
+
+
+# значения сравниваются без учета регистра и пробелов, название поля - через синонимы схемы
+@pytest.mark.parametrize('data, board_id', [
+    ({'цех': ' КУХНИ '}, 'field-board'),
+    ({'клиент': 'ооо ромашка'}, 'client-board'),
+    ({'цех': ''}, 'default-board'),
+], ids=['value-case', 'alias', 'empty-value'])
+def test_field_values(router, data, board_id):
+    assert router.route(None, None, data).board_id == board_id
+
+
+# при пересечении правил действует первое
+def test_first_rule_wins():
+    router = Router(DEFAULT, [{'user': 10, 'board': 'first'}, {'user': [10], 'board': 'second'}])
+    assert router.route(None, 10, {}).board_id == 'first'
+
+
+def test_boards(router):
+    assert router.boards() == ['default-board', 'field-board', 'client-board', 'user-board', 'chat-board']
+
+
+def test_from_file(tmp_path):
+    path = tmp_path / 'routes.json'
+    path.write_text(json.dumps({'rules': RULES}, ensure_ascii=False), encoding='utf-8')
+    assert Router.from_file(str(path), DEFAULT).route(None, 10, {}).board_id == 'user-board'
+    # нет файла - все заказы на доску по умолчанию
+    assert Router.from_file(str(tmp_path / 'missing.json'), DEFAULT).boards() == ['default-board']
+    assert Router.from_file(None, DEFAULT).route(-100, 10, {}) is DEFAULT
@@ -0,0 +1,108 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+
+import pytest
+
+from board_cache import BoardMetadata, BoardMetadataCache
+from trello_webhooks import TrelloWebhookReceiver, trello_signature
+
+BOARD_ID = 'board'
+CALLBACK_URL = 'https://bot.example.com/trello/webhook'
+
+
+def make_metadata() -> BoardMetadata:
+    return BoardMetadata(
+        lists={'новые': 'l1', 'готово': 'l2'},
+        custom_fields={'клиент': {'id': 'f1', 'type': 'text'}, 'цвет': {'id': 'f2', 'type': 'list'}})
+
+
+# применить событие к прогретому кэшу: (результат, метаданные доски, запросов к Trello)
+def apply(action_type, data, warm=True):
+    async def run():
+        fetched = []
+
+        async def fetcher(board_id):
+            fetched.append(board_id)
+            return make_metadata()
+
+        cache = BoardMetadataCache(fetcher)
+        if warm:
+            await cache.warm_up(BOARD_ID)
+            fetched.clear()
+        receiver = TrelloWebhookReceiver(cache, BOARD_ID, CALLBACK_URL, 'secret')
+        result = receiver.apply_action(action_type, data)
+        entry = cache._entries.get(BOARD_ID)
+        snapshot = (dict(entry.lists), dict(entry.custom_fields)) if entry is not None else None
+        await asyncio.sleep(0)
+        await cache.close()
+        return result, snapshot, len(fetched)
+    return asyncio.run(run())
+
+
+def test_signature():
+    body = b'{"action": {}}'
+    expected = base64.b64encode(
+        hmac.new(b'secret', body + CALLBACK_URL.encode(), hashlib.sha1).digest()).decode()
+    assert trello_signature('secret', body, CALLBACK_URL) == expected
+    assert trello_signature('secret', body, CALLBACK_URL + '/') != expected
+    assert trello_signature('other', body, CALLBACK_URL) != expected
+
+
+@pytest.mark.parametrize('action_type, data, lists', [
+    ('createList', {'list': {'id': 'l3', 'name': 'В работе'}},
+     {'новые': 'l1', 'готово': 'l2', 'в работе': 'l3'}),
+    ('updateList', {'list': {'id': 'l1', 'name': 'Входящие'}, 'old': {'name': 'Новые'}},
+     {'входящие': 'l1', 'готово': 'l2'}),
+    ('updateList', {'list': {'id': 'l2', 'name': 'Готово', 'closed': True}, 'old': {'closed': False}},
+     {'новые': 'l1'}),
+    ('moveListFromBoard', {'list': {'id': 'l2', 'name': 'Готово'}}, {'новые': 'l1'}),
+], ids=['create', 'rename', 'archive', 'move-away'])
+def test_list_patched(action_type, data, lists):
+    result, (patched_lists, _), fetched = apply(action_type, data)
+    assert result == 'patched'
+    assert patched_lists == lists
+    assert fetched == 0
+
+
+def test_delete_custom_field():
+    result, (_, custom_fields), fetched = apply('deleteCustomField', {'customField': {'id': 'f1'}})
+    assert result == 'patched'
+    assert list(custom_fields) == ['цвет']
+    assert fetched == 0
+
+
+def test_rename_custom_field():
+    result, (_, custom_fields), _ = apply(
+        'updateCustomField', {'customField': {'id': 'f1', 'name': 'Заказчик'}, 'old': {'name': 'Клиент'}})
+    assert result == 'patched'
+    assert custom_fields['заказчик'] == {'id': 'f1', 'type': 'text'}
+    assert 'клиент' not in custom_fields
+
+
+# события, которые нельзя применить на месте, перечитывают доску
+@pytest.mark.parametrize('action_type, data, warm', [
+    ('createCustomField', {'customField': {'id': 'f3', 'name': 'Цех'}}, True),
+    ('updateCustomField', {'customField': {'id': 'f2'}, 'old': {'display': {}}}, True),
+    ('createCustomFieldOption', {'customField': {'id': 'f2'}}, True),
+    ('updateCustomField', {'customField': {'id': 'f9', 'name': 'Цех'}, 'old': {'name': 'Клиент'}}, True),
+    ('createList', {'list': {'id': 'l3', 'name': 'В работе'}}, False),
+    ('createList', {'list': {'id': 'l3'}}, True),
+], ids=['new-field', 'field-options', 'new-option', 'rename-mismatch', 'cold-cache', 'no-list-name'])
+def test_refreshed(action_type, data, warm):
+    result, _, fetched = apply(action_type, data, warm)
+    assert result == 'refreshed'
+    assert fetched == 1
+
+
+@pytest.mark.parametrize('action_type, data', [
+    ('createCard', {'card': {'id': 'c1'}}),
+    ('updateList', {'list': {'id': 'l1', 'name': 'Новые'}, 'old': {'pos': 1}}),
+    ('updateList', {'list': {}}),
+], ids=['card', 'list-position', 'no-list-id'])
+def test_ignored(action_type, data):
+    result, snapshot, fetched = apply(action_type, data)
+    assert result == 'ignored'
+    assert snapshot == (make_metadata().lists, make_metadata().custom_fields)
+    assert fetched == 0
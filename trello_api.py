@@ -1,144 +1,217 @@
+import asyncio
+import random
+import time
 import requests
+import aiohttp
+from requests.adapters import HTTPAdapter
 import logging
-from typing import Tuple, Optional, Dict, Any, List
-from datetime import datetime
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from aiohttp.payload import AsyncIterablePayload
+
+from board_cache import BoardMetadata, BoardMetadataCache
+from circuit_breaker import CircuitBreaker, CircuitOpenError, remaining_budget
+from field_schema import parse_date, parse_number
+from metrics import TRELLO_REQUESTS, TRELLO_REQUEST_SECONDS
+from profiling import note_trello_call
+from rate_limiter import TokenBucket, PRIORITY_CARD, PRIORITY_FIELDS, PRIORITY_METADATA
 
 logger = logging.getLogger(__name__)
 
+# сколько карточек Trello отдает за один запрос карточек доски
+BOARD_CARDS_PAGE = 1000
+
+# значения, которые считаются отмеченным чекбоксом
+CHECKBOX_TRUE_VALUES = {'да', 'yes', 'true', '1', '+', 'on', 'x', '✅'}
+
+
+# кастомные поля доски из ответа Trello: {название в нижнем регистре: {'id', 'type', ['options']}}
+def parse_custom_fields(fields: List[Dict[str, Any]]) -> Dict[str, Dict]:
+    custom_fields = {}
+    for field in fields:
+        # Нормализуем название поля (нижний регистр, убираем лишние пробелы)
+        field_name = field['name'].strip().lower()
+        custom_fields[field_name] = {
+            'id': field['id'],
+            'type': field['type']
+        }
+        if field['type'] == 'list':
+            # варианты выпадающего списка: {текст в нижнем регистре: ID}
+            custom_fields[field_name]['options'] = {
+                option['value']['text'].strip().lower(): option['id']
+                for option in field.get('options', [])
+            }
+    return custom_fields
+
+
+# Парсинг даты - используем только дату без времени в формате YYYY-MM-DD
+# форматы дат - общие со схемой полей (field_schema.DATE_FORMATS)
+def parse_date_string(date_string: str) -> Optional[str]:
+    parsed = parse_date(date_string)
+    if parsed is None:
+        logger.warning("Не удалось распарсить дату: %s", date_string)
+        return None
+    # возвращаем в формате YYYY-MM-DD
+    return parsed.strftime('%Y-%m-%d')
+
+
+# тело запроса для значения кастомного поля с учетом типа (None - значение не подходит).
+# подходит и для запроса по одному полю, и для элемента customFieldItems.
+# общая для синхронного и асинхронного клиентов
+def build_field_payload(field_type: str, value: str, options: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+    if field_type == 'date':
+        # для полей с типом дата
+        parsed_date = parse_date_string(value)
+        if not parsed_date:
+            logger.warning("Неверный формат даты для поля: %s", value)
+            return None
+
+        return {
+            "value": {
+                "date": parsed_date
+            }
+        }
+
+    if field_type == 'number':
+        # для числовых полей допускаем запятую как разделитель
+        number = parse_number(value)
+        if number is None:
+            logger.warning("Неверный формат числа для поля: %s", value)
+            return None
+
+        return {
+            "value": {
+                "number": number
+            }
+        }
+
+    if field_type == 'checkbox':
+        checked = value.strip().lower() in CHECKBOX_TRUE_VALUES
+        return {
+            "value": {
+                "checked": "true" if checked else "false"
+            }
+        }
+
+    if field_type == 'list':
+        # для выпадающих списков нужен ID варианта
+        option_id = (options or {}).get(value.strip().lower())
+        if not option_id:
+            logger.warning("Нет такого варианта в списке для поля: %s", value)
+            return None
+
+        return {"idValue": option_id}
+
+    # для текстовых полей
+    return {
+        "value": {
+            "text": value
+        }
+    }
+
 
 class TrelloManager:
-    def __init__(self, api_key: str, token: str, base_url: str = "https://api.trello.com/1"):
+    def __init__(self, api_key: str, token: str, base_url: str = "https://api.trello.com/1", pool_size: int = 10,
+                 cache_ttl: float = 300, max_cached_boards: int = 50):
         self.api_key = api_key
         self.token = token
         self.base_url = base_url
         self.auth_params = {"key": api_key, "token": token}
-        self.custom_fields_cache = {}
+        # {ID доски: (время загрузки, кастомные поля)} - ограничен по времени и числу досок
+        self.custom_fields_cache: 'OrderedDict[str, Tuple[float, Dict[str, Dict]]]' = OrderedDict()
+        self.cache_ttl = cache_ttl
+        self.max_cached_boards = max(1, max_cached_boards)
+
+        # одна сессия с keep-alive вместо нового соединения на каждый запрос
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     # получить ID списка по названию
     def get_list_id(self, board_id: str, list_name: str) -> Optional[str]:
         url = f"{self.base_url}/boards/{board_id}/lists"
 
         try:
-            response = requests.get(url, params=self.auth_params, timeout=10)
+            response = self.session.get(url, params=self.auth_params, timeout=10)
 
             if response.status_code == 200:
                 lists = response.json()
                 for list_item in lists:
                     if list_item['name'].lower() == list_name.lower():
                         return list_item['id']
-                logger.warning(f"Список '{list_name}' не найден в доске")
+                logger.warning("Список '%s' не найден в доске", list_name)
                 return None
             else:
                 logger.error(
-                    f"Ошибка при получении списков: {response.status_code} - {response.text}")
+                    "Ошибка при получении списков: %s - %s", response.status_code, response.text)
                 return None
 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка соединения с Trello: {e}")
+            logger.error("Ошибка соединения с Trello: %s", e)
             return None
 
     # получить кастомные поля доски с информацией о типах
     def get_custom_fields(self, board_id: str) -> Dict[str, Dict]:
-        if board_id in self.custom_fields_cache:
-            return self.custom_fields_cache[board_id]
+        cached = self.custom_fields_cache.get(board_id)
+        if cached is not None and time.monotonic() - cached[0] <= self.cache_ttl:
+            self.custom_fields_cache.move_to_end(board_id)
+            return cached[1]
 
         url = f"{self.base_url}/boards/{board_id}/customFields"
 
         try:
-            response = requests.get(url, params=self.auth_params, timeout=10)
+            response = self.session.get(url, params=self.auth_params, timeout=10)
 
             if response.status_code == 200:
-                custom_fields = {}
-                for field in response.json():
-                    # Нормализуем название поля (нижний регистр, убираем лишние пробелы)
-                    field_name = field['name'].strip().lower()
-                    custom_fields[field_name] = {
-                        'id': field['id'],
-                        'type': field['type']
-                    }
-
-                self.custom_fields_cache[board_id] = custom_fields
+                custom_fields = parse_custom_fields(response.json())
+                self.custom_fields_cache[board_id] = (time.monotonic(), custom_fields)
+                self.custom_fields_cache.move_to_end(board_id)
+                while len(self.custom_fields_cache) > self.max_cached_boards:
+                    self.custom_fields_cache.popitem(last=False)
                 return custom_fields
             else:
                 logger.error(
-                    f"Ошибка при получении кастомных полей: {response.status_code} - {response.text}")
+                    "Ошибка при получении кастомных полей: %s - %s", response.status_code, response.text)
                 return {}
 
         except requests.exceptions.RequestException as e:
             logger.error(
-                f"Ошибка соединения при получении кастомных полей: {e}")
+                "Ошибка соединения при получении кастомных полей: %s", e)
             return {}
 
     # Парсинг даты - используем только дату без времени в формате YYYY-MM-DD
     def parse_date_string(self, date_string: str) -> Optional[str]:
-        try:
-            # берем только часть до пробела (игнорируем время)
-            date_part = date_string.split()[0].strip()
-
-            # убрать возможные кавычки
-            date_part = date_part.replace('"', '').replace("'", "")
+        return parse_date_string(date_string)
 
-            # пробуем основные форматы дат
-            formats = [
-                '%d.%m.%Y',    # 18.08.2025
-                '%Y-%m-%d',    # 2025-08-18
-                '%d/%m/%Y',    # 18/08/2025
-                '%m/%d/%Y'     # 08/18/2025
-            ]
-
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(date_part, fmt)
-                    # возвращаем в формате YYYY-MM-DD
-                    return dt.strftime('%Y-%m-%d')
-                except ValueError:
-                    continue
-
-            logger.warning(f"Не удалось распарсить дату: {date_string}")
-            return None
-
-        except Exception as e:
-            logger.error(f"Ошибка при парсинге даты: {e}")
-            return None
+    # тело запроса для значения кастомного поля с учетом типа (None - значение не подходит)
+    def build_field_payload(self, field_type: str, value: str, options: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        return build_field_payload(field_type, value, options)
 
     # установить значение кастомного поля с учетом типа
-    def set_custom_field_value(self, card_id: str, field_id: str, field_type: str, value: str) -> bool:
+    def set_custom_field_value(self, card_id: str, field_id: str, field_type: str, value: str, options: Optional[Dict[str, str]] = None) -> bool:
         url = f"{self.base_url}/card/{card_id}/customField/{field_id}/item"
 
-        if field_type == 'date':
-            # для полей с типом дата
-            parsed_date = self.parse_date_string(value)
-            if not parsed_date:
-                logger.warning(f"Неверный формат даты для поля: {value}")
-                return False
-
-            payload = {
-                "value": {
-                    "date": parsed_date
-                }
-            }
-        else:
-            # для текстовых полей
-            payload = {
-                "value": {
-                    "text": value
-                }
-            }
+        payload = self.build_field_payload(field_type, value, options)
+        if payload is None:
+            return False
 
         try:
-            response = requests.put(
+            response = self.session.put(
                 url, json=payload, params=self.auth_params, timeout=10)
 
             if response.status_code == 200:
-                logger.info(f"Успешно установлено поле {field_id}: {value}")
+                logger.info("Успешно установлено поле %s: %s", field_id, value)
                 return True
             else:
                 logger.error(
-                    f"Ошибка при установке значения поля: {response.status_code} - {response.text}")
+                    "Ошибка при установке значения поля: %s - %s", response.status_code, response.text)
                 return False
 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка соединения при установке значения поля: {e}")
+            logger.error("Ошибка соединения при установке значения поля: %s", e)
             return False
 
     # создать карточку с кастомными полями
@@ -154,7 +227,7 @@ class TrelloManager:
         }
 
         try:
-            response = requests.post(url, params=params, timeout=10)
+            response = self.session.post(url, params=params, timeout=10)
 
             if response.status_code == 200:
                 card_data = response.json()
@@ -163,25 +236,617 @@ class TrelloManager:
                 # установить значения кастомных полей
                 for field_name, field_info in custom_fields_data.items():
                     success = self.set_custom_field_value(
-                        card_id, field_info['id'], field_info['type'], field_info['value']
+                        card_id, field_info['id'], field_info['type'], field_info['value'], field_info.get('options')
                     )
                     if success:
-                        logger.info(f"Успешно заполнено поле: {field_name}")
+                        logger.info("Успешно заполнено поле: %s", field_name)
                     else:
                         logger.warning(
-                            f"Не удалось установить поле {field_name}")
+                            "Не удалось установить поле %s", field_name)
 
-                logger.info(f"Карточка создана с кастомными полями: {name}")
+                logger.info("Карточка создана с кастомными полями: %s", name)
                 return True, card_data
             else:
                 logger.error(
-                    f"Ошибка при создании карточки: {response.status_code} - {response.text}")
+                    "Ошибка при создании карточки: %s - %s", response.status_code, response.text)
                 return False, response.text
 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Ошибка соединения при создании карточки: {e}")
+            logger.error("Ошибка соединения при создании карточки: %s", e)
             return False, str(e)
 
     # создать карточку в Trello (старый метод для обратной совместимости)
     def create_card(self, list_id: str, name: str, desc: str) -> Tuple[bool, Any]:
         return self.create_card_with_custom_fields(list_id, name, desc, {}, "")
+
+
+# статистика пула соединений: сколько запросов получили готовое соединение,
+# сколько открыли новое и сколько ждали свободного места в пуле
+class PoolStats:
+    def __init__(self):
+        self.requests = 0
+        self.hits = 0
+        self.new_connections = 0
+        self.waiters = 0
+        self.waiting_now = 0
+        self.max_waiting = 0
+
+    # подписка на события aiohttp-клиента
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_reuseconn.append(self._on_reuse)
+        trace_config.on_connection_create_end.append(self._on_create)
+        trace_config.on_connection_queued_start.append(self._on_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_queued_end)
+        return trace_config
+
+    async def _on_request_start(self, session, ctx, params):
+        self.requests += 1
+
+    async def _on_reuse(self, session, ctx, params):
+        self.hits += 1
+
+    async def _on_create(self, session, ctx, params):
+        self.new_connections += 1
+
+    async def _on_queued_start(self, session, ctx, params):
+        self.waiters += 1
+        self.waiting_now += 1
+        self.max_waiting = max(self.max_waiting, self.waiting_now)
+
+    async def _on_queued_end(self, session, ctx, params):
+        self.waiting_now -= 1
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "requests": self.requests,
+            "hits": self.hits,
+            "new_connections": self.new_connections,
+            "waiters": self.waiters,
+            "waiting_now": self.waiting_now,
+            "max_waiting": self.max_waiting,
+        }
+
+
+# асинхронный клиент Trello: не блокирует event loop aiogram,
+# пока одна карточка ждет ответа Trello, остальные апдейты обрабатываются
+class AsyncTrelloManager:
+    def __init__(self, api_key: str, token: str, base_url: str = "https://api.trello.com/1",
+                 timeout: float = 10, connect_timeout: float = 5, pool_size: int = 20,
+                 keepalive_timeout: float = 60, metadata_ttl: float = 300,
+                 metadata_snapshot: Optional[str] = None, max_cached_boards: int = 50,
+                 field_concurrency: int = 5, bulk_custom_fields: bool = True,
+                 rate_limiter: Optional[TokenBucket] = None, max_retries: int = 4,
+                 retry_backoff: float = 0.5, retry_max_delay: float = 30,
+                 breaker: Optional[CircuitBreaker] = None, hedge_delay: float = 0):
+        self.api_key = api_key
+        self.token = token
+        self.base_url = base_url
+        self.auth_params = {"key": api_key, "token": token}
+        self.timeout = aiohttp.ClientTimeout(
+            total=timeout, sock_connect=connect_timeout)
+        self.pool_size = pool_size
+        self.field_concurrency = max(1, field_concurrency)
+        self.bulk_custom_fields = bulk_custom_fields
+        self.keepalive_timeout = keepalive_timeout
+        self.pool_stats = PoolStats()
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.retry_max_delay = retry_max_delay
+        self.breaker = breaker
+        self.hedge_delay = hedge_delay
+        self.hedged_requests = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # единый кэш списков и кастомных полей досок
+        self.metadata = BoardMetadataCache(
+            self.fetch_board_metadata, metadata_ttl, metadata_snapshot, max_cached_boards)
+
+    # сессия создается лениво внутри запущенного event loop и живет до close():
+    # соединения переиспользуются между сообщениями и всеми запросами к Trello
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                trace_configs=[self.pool_stats.trace_config()]
+            )
+        return self._session
+
+    # закрыть HTTP-сессию при остановке бота
+    async def close(self):
+        await self.metadata.close()
+        logger.info("Статистика пула Trello: %s", self.pool_stats.as_dict())
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # выполнить запрос к Trello, вернуть статус и json (при 200) или текст ошибки.
+    # каждый запрос проходит через общий лимитер; 429 и 5xx повторяются (POST - см.
+    # _is_retryable_status) с учетом Retry-After и экспоненциальной задержкой со случайным разбросом.
+    # endpoint - шаблон адреса без ID для метрик, например "PUT /cards/{id}/customFields".
+    # body - фабрика тела запроса (вызывается на каждую попытку: потоковое тело нельзя отправить дважды).
+    # если задан бюджет времени заказа (latency_budget), попытка получает не больше
+    # budget_share оставшегося времени, а повторы, не укладывающиеся в бюджет, не делаются.
+    # при разомкнутой цепи (circuit breaker) сразу выбрасывается CircuitOpenError.
+    # count_slow=False - длительность запроса не учитывается в доле медленных (загрузки, большие выборки)
+    async def _request(self, method: str, url: str, params: Optional[Dict[str, str]] = None,
+                       json: Optional[Dict[str, Any]] = None,
+                       priority: int = PRIORITY_FIELDS, endpoint: str = '',
+                       body: Optional[Callable[[], Any]] = None,
+                       timeout: Optional[aiohttp.ClientTimeout] = None,
+                       budget_share: float = 1.0, hedge: bool = True,
+                       count_slow: bool = True) -> Tuple[int, Any]:
+        endpoint = endpoint or method
+        # метаданные доски общие для всех заказов: их загрузку не ограничиваем
+        # бюджетом одного заказа, а медленный ответ дублируем (hedging)
+        metadata = method == "GET" and priority == PRIORITY_METADATA
+
+        for attempt in range(self.max_retries + 1):
+            budget = None if metadata else remaining_budget()
+            if budget is not None and budget <= 0:
+                raise asyncio.TimeoutError("бюджет времени заказа исчерпан")
+            options = {}
+            if body is not None:
+                options['data'] = body()
+            if budget is not None:
+                options['timeout'] = aiohttp.ClientTimeout(
+                    total=min(self.timeout.total, budget * budget_share), sock_connect=self.timeout.sock_connect)
+            elif timeout is not None:
+                options['timeout'] = timeout
+
+            def send():
+                return self._send(method, url, params, json, options, priority, endpoint, count_slow)
+
+            try:
+                if metadata and hedge and self.hedge_delay > 0:
+                    status, result, retry_after = await self._send_hedged(send)
+                else:
+                    status, result, retry_after = await send()
+
+                if status == 200:
+                    return status, result
+                last_attempt = attempt == self.max_retries
+                if not self._is_retryable_status(status, method, retry_after) or last_attempt:
+                    return status, result
+
+                delay = self._retry_delay(attempt, retry_after)
+                if status == 429 and self.rate_limiter is not None:
+                    # квота исчерпана для всех запросов, а не только для этого
+                    self.rate_limiter.pause(delay)
+                if self._exceeds_budget(delay, metadata):
+                    return status, result
+                logger.warning(
+                    "Trello ответил %s на %s %s, повтор через %.1f с", status, method, url, delay)
+
+            except aiohttp.ClientConnectorError as e:
+                # соединение не установлено - запрос точно не дошел до Trello
+                if attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                if self._exceeds_budget(delay, metadata):
+                    raise
+                logger.warning("Нет соединения с Trello (%s), повтор через %.1f с", e, delay)
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # POST повторять нельзя: карточка могла быть уже создана
+                if method == "POST" or attempt == self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                if self._exceeds_budget(delay, metadata):
+                    raise
+                logger.warning("Ошибка запроса к Trello (%s), повтор через %.1f с", e, delay)
+
+            await asyncio.sleep(delay)
+
+    # один HTTP-запрос: разрешение circuit breaker, токен лимитера, метрики.
+    # возвращает (статус, json или текст, Retry-After)
+    async def _send(self, method: str, url: str, params: Optional[Dict[str, str]],
+                    json: Optional[Dict[str, Any]], options: Dict[str, Any],
+                    priority: int, endpoint: str, count_slow: bool = True) -> Tuple[int, Any, Optional[str]]:
+        probe = self.breaker.allow() if self.breaker is not None else False
+        started = time.perf_counter()
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(priority)
+                # ожидание токена - не задержка Trello
+                started = time.perf_counter()
+
+            async with self._get_session().request(method, url, params=params, json=json, **options) as response:
+                elapsed = time.perf_counter() - started
+                TRELLO_REQUEST_SECONDS.observe(elapsed, endpoint)
+                TRELLO_REQUESTS.inc(endpoint, str(response.status))
+                note_trello_call(endpoint, str(response.status), elapsed)
+                if response.status == 200:
+                    result = await response.json(content_type=None)
+                else:
+                    result = await response.text()
+
+        except asyncio.CancelledError:
+            if self.breaker is not None:
+                self.breaker.release(probe)
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            elapsed = time.perf_counter() - started
+            if isinstance(e, aiohttp.ClientConnectorError):
+                error = 'connection_error'
+            else:
+                error = 'timeout' if isinstance(e, asyncio.TimeoutError) else 'error'
+            TRELLO_REQUESTS.inc(endpoint, error)
+            note_trello_call(endpoint, error, elapsed)
+            if self.breaker is not None:
+                self.breaker.record(True, elapsed, probe, count_slow)
+            raise
+
+        if self.breaker is not None:
+            # 429 - Trello работает, просто ограничивает частоту
+            self.breaker.record(response.status >= 500, elapsed, probe, count_slow)
+        return response.status, result, response.headers.get('Retry-After')
+
+    # если ответа нет дольше hedge_delay, отправить такой же запрос еще раз
+    # и взять первый успешный ответ (только для GET - они идемпотентны)
+    async def _send_hedged(self, send: Callable[[], Awaitable[Tuple[int, Any, Optional[str]]]]):
+        first = asyncio.ensure_future(send())
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done:
+            return first.result()
+
+        self.hedged_requests += 1
+        pending = {first, asyncio.ensure_future(send())}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result()[0] == 200:
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # задержка перед повтором не укладывается в оставшийся бюджет заказа
+    @staticmethod
+    def _exceeds_budget(delay: float, metadata: bool) -> bool:
+        if metadata:
+            return False
+        budget = remaining_budget()
+        return budget is not None and delay >= budget
+
+    # 429 и 5xx повторяются. POST - только если Trello точно не выполнил запрос:
+    # 429 или 503 с Retry-After. на другую 5xx карточка могла быть уже создана
+    @staticmethod
+    def _is_retryable_status(status: int, method: str = "GET", retry_after: Optional[str] = None) -> bool:
+        if method == "POST":
+            return status == 429 or (status == 503 and bool(retry_after))
+        return status == 429 or status >= 500
+
+    # задержка перед повтором: Retry-After от Trello или экспоненциальная со случайным разбросом
+    def _retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.retry_max_delay) + random.uniform(0, self.retry_backoff)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(seconds, 0.0), self.retry_max_delay) + random.uniform(0, self.retry_backoff)
+                except (TypeError, ValueError):
+                    pass
+
+        return random.uniform(0, min(self.retry_max_delay, self.retry_backoff * 2 ** attempt))
+
+    # загрузить списки и кастомные поля доски одним запросом:
+    # первые заказы на еще не известную доску ждут одну загрузку (см. BoardMetadataCache)
+    async def fetch_board_metadata(self, board_id: str) -> Optional[BoardMetadata]:
+        url = f"{self.base_url}/boards/{board_id}"
+        params = {**self.auth_params, "fields": "id", "lists": "open", "customFields": "true"}
+
+        try:
+            status, result = await self._request(
+                "GET", url, params=params, priority=PRIORITY_METADATA, endpoint="GET /boards/{id}")
+
+            if status == 200:
+                lists = {list_item['name'].lower(): list_item['id'] for list_item in result.get('lists', [])}
+                return BoardMetadata(lists, parse_custom_fields(result.get('customFields', [])))
+            logger.error("Ошибка при получении метаданных доски %s: %s - %s", board_id, status, result)
+            return None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения с Trello: %s", e)
+            return None
+
+    # прогреть кэш метаданных и включить фоновое обновление
+    # wait=False - взять метаданные из снимка на диске и обновить их в фоне, не дожидаясь Trello
+    async def warm_up(self, board_id: str, wait: bool = True) -> bool:
+        loaded = self.metadata.load_snapshot()
+        if loaded:
+            logger.info("Метаданные досок загружены из снимка: %s", loaded)
+        warmed = await self.metadata.warm_up(board_id, wait)
+        self.metadata.start_auto_refresh(board_id)
+        return warmed
+
+    # зарегистрировать webhook Trello на доску (если такого еще нет); вернуть ID webhook.
+    # Trello при создании проверяет callback_url запросом HEAD, поэтому сервер должен уже работать
+    async def ensure_webhook(self, board_id: str, callback_url: str, description: str) -> Optional[str]:
+        try:
+            status, board = await self._request(
+                "GET", f"{self.base_url}/boards/{board_id}", params={**self.auth_params, "fields": "id"},
+                priority=PRIORITY_METADATA, endpoint="GET /boards/{id}")
+            if status != 200:
+                logger.error("Ошибка при получении доски для webhook: %s - %s", status, board)
+                return None
+
+            status, webhooks = await self._request(
+                "GET", f"{self.base_url}/tokens/{self.token}/webhooks", params=self.auth_params,
+                priority=PRIORITY_METADATA, endpoint="GET /tokens/{token}/webhooks")
+            if status == 200:
+                for webhook in webhooks:
+                    if webhook.get('idModel') == board['id'] and webhook.get('callbackURL') == callback_url:
+                        return webhook['id']
+
+            status, result = await self._request(
+                "POST", f"{self.base_url}/webhooks",
+                params={**self.auth_params, "idModel": board['id'], "callbackURL": callback_url,
+                        "description": description},
+                priority=PRIORITY_METADATA, endpoint="POST /webhooks")
+            if status == 200:
+                logger.info("Webhook Trello зарегистрирован: %s", result['id'])
+                return result['id']
+            logger.error("Ошибка при регистрации webhook Trello: %s - %s", status, result)
+            return None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения при регистрации webhook Trello: %s", e)
+            return None
+        except CircuitOpenError as e:
+            logger.warning("Webhook Trello не зарегистрирован, Trello недоступен: %s", e)
+            return None
+
+    # все карточки доски, включая архивные, с кастомными полями (для индекса карточек).
+    # Trello отдает не больше BOARD_CARDS_PAGE карточек за запрос, следующая страница -
+    # карточки старше самой старой из полученных. большой ответ медленный сам по себе,
+    # поэтому запрос не дублируется и не считается медленным для circuit breaker.
+    # None - не удалось получить
+    async def get_board_cards(self, board_id: str) -> Optional[List[Dict[str, Any]]]:
+        url = f"{self.base_url}/boards/{board_id}/cards/all"
+        params = {**self.auth_params, "fields": "name,desc,shortUrl,dateLastActivity",
+                  "customFieldItems": "true", "limit": str(BOARD_CARDS_PAGE)}
+        cards: List[Dict[str, Any]] = []
+        try:
+            while True:
+                status, page = await self._request(
+                    "GET", url, params=params, priority=PRIORITY_METADATA, endpoint="GET /boards/{id}/cards",
+                    hedge=False, count_slow=False)
+                if status != 200:
+                    logger.error("Ошибка при получении карточек доски %s: %s - %s", board_id, status, page)
+                    return None
+                cards.extend(page)
+                if len(page) < BOARD_CARDS_PAGE:
+                    return cards
+                params = {**params, "before": min(card['id'] for card in page)}
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения с Trello: %s", e)
+            return None
+
+    # открытые карточки списка (name, desc, shortUrl). None - не удалось получить
+    async def get_list_cards(self, list_id: str) -> Optional[List[Dict[str, Any]]]:
+        url = f"{self.base_url}/lists/{list_id}/cards"
+        try:
+            status, result = await self._request(
+                "GET", url, params={**self.auth_params, "fields": "name,desc,shortUrl"},
+                priority=PRIORITY_CARD, endpoint="GET /lists/{id}/cards")
+            if status == 200:
+                return result
+            logger.error("Ошибка при получении карточек списка %s: %s - %s", list_id, status, result)
+            return None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения с Trello: %s", e)
+            return None
+
+    # прикрепить файл к карточке, не держа его в памяти: части файла из open_stream
+    # сразу уходят в multipart-запрос. open_stream вызывается заново на каждую попытку.
+    # долгая загрузка большого файла - не признак перегрузки Trello для circuit breaker
+    async def upload_attachment(self, card_id: str, file_name: str, mime_type: str,
+                                open_stream: Callable[[], AsyncIterator[bytes]],
+                                timeout: Optional[float] = None) -> bool:
+        url = f"{self.base_url}/cards/{card_id}/attachments"
+
+        def body() -> aiohttp.MultipartWriter:
+            writer = aiohttp.MultipartWriter('form-data')
+            part = writer.append_payload(AsyncIterablePayload(open_stream(), content_type=mime_type))
+            part.set_content_disposition('form-data', name='file', filename=file_name)
+            return writer
+
+        upload_timeout = None
+        if timeout is not None:
+            # время ограничиваем между частями, а не на весь файл
+            upload_timeout = aiohttp.ClientTimeout(
+                total=None, sock_connect=self.timeout.sock_connect, sock_read=timeout)
+
+        try:
+            status, result = await self._request(
+                "POST", url, params={**self.auth_params, "name": file_name, "mimeType": mime_type},
+                priority=PRIORITY_FIELDS, endpoint="POST /cards/{id}/attachments",
+                body=body, timeout=upload_timeout, count_slow=False)
+            if status == 200:
+                return True
+            logger.error("Ошибка при загрузке вложения %s: %s - %s", file_name, status, result)
+            return False
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения при загрузке вложения %s: %s", file_name, e)
+            return False
+
+    # получить ID списка по названию (из кэша метаданных доски)
+    async def get_list_id(self, board_id: str, list_name: str) -> Optional[str]:
+        metadata = await self.metadata.get(board_id)
+        if metadata is None:
+            return None
+
+        list_id = metadata.lists.get(list_name.lower())
+        if list_id is None:
+            logger.warning("Список '%s' не найден в доске", list_name)
+        return list_id
+
+    # получить кастомные поля доски с информацией о типах (из кэша метаданных доски)
+    async def get_custom_fields(self, board_id: str) -> Dict[str, Dict]:
+        metadata = await self.metadata.get(board_id)
+        if metadata is None:
+            return {}
+        return metadata.custom_fields
+
+    # установить значение кастомного поля с учетом типа
+    async def set_custom_field_value(self, card_id: str, field_id: str, field_type: str, value: str, options: Optional[Dict[str, str]] = None) -> bool:
+        url = f"{self.base_url}/card/{card_id}/customField/{field_id}/item"
+
+        payload = build_field_payload(field_type, value, options)
+        if payload is None:
+            return False
+
+        try:
+            status, result = await self._request(
+                "PUT", url, params=self.auth_params, json=payload,
+                endpoint="PUT /card/{id}/customField/{id}/item")
+
+            if status == 200:
+                logger.info("Успешно установлено поле %s: %s", field_id, value)
+                return True
+            else:
+                logger.error(
+                    "Ошибка при установке значения поля: %s - %s", status, result)
+                return False
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error("Ошибка соединения при установке значения поля: %s", e)
+            return False
+
+    # создать карточку без кастомных полей
+    async def post_card(self, list_id: str, name: str, desc: str) -> Tuple[bool, Any]:
+        url = f"{self.base_url}/cards"
+        params = {
+            **self.auth_params,
+            "idList": list_id,
+            "name": name,
+            "desc": desc,
+            "pos": "top"
+        }
+
+        try:
+            # половина оставшегося бюджета заказа - на карточку, остальное - на поля
+            status, result = await self._request(
+                "POST", url, params=params, priority=PRIORITY_CARD, endpoint="POST /cards",
+                budget_share=0.5)
+
+            if status == 200:
+                return True, result
+            else:
+                logger.error(
+                    "Ошибка при создании карточки: %s - %s", status, result)
+                return False, result
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = str(e) or "Trello не ответил вовремя"
+            logger.error("Ошибка соединения при создании карточки: %s", error)
+            return False, error
+
+    # заполнить все кастомные поля карточки одним запросом PUT /cards/{id}/customFields.
+    # None - Trello отклонил запрос, нужно заполнять поля по одному
+    async def set_custom_fields_bulk(self, card_id: str, custom_fields_data: Dict[str, Dict]) -> Optional[Dict[str, bool]]:
+        url = f"{self.base_url}/cards/{card_id}/customFields"
+
+        results = {}
+        items = []
+        for field_name, field_info in custom_fields_data.items():
+            payload = build_field_payload(
+                field_info['type'], field_info['value'], field_info.get('options'))
+            if payload is None:
+                # значение не подходит по типу - в запрос не попадает
+                results[field_name] = False
+                continue
+            items.append({"idCustomField": field_info['id'], **payload})
+            results[field_name] = True
+
+        if not items:
+            return results
+
+        try:
+            status, result = await self._request(
+                "PUT", url, params=self.auth_params, json={"customFieldItems": items},
+                endpoint="PUT /cards/{id}/customFields")
+
+            if status == 200:
+                logger.info("Кастомные поля заполнены одним запросом: %s", len(items))
+                return results
+            elif self._is_retryable_status(status):
+                # Trello перегружен и повторы не помогли: запросы по одному полю только усугубят
+                logger.error(
+                    "Ошибка при массовом заполнении полей: %s - %s", status, result)
+                return {field_name: False for field_name in results}
+            else:
+                logger.warning(
+                    "Trello отклонил массовое заполнение полей: %s - %s", status, result)
+                return None
+
+        except asyncio.TimeoutError:
+            # бюджет заказа исчерпан: на запросы по одному полю времени тоже нет
+            logger.error("Массовое заполнение полей не уложилось в бюджет заказа")
+            return {field_name: False for field_name in results}
+        except aiohttp.ClientError as e:
+            logger.warning("Ошибка соединения при массовом заполнении полей: %s", e)
+            return None
+
+    # заполнить кастомные поля карточки: сначала одним запросом,
+    # при отказе - по одному параллельно, не больше field_concurrency запросов сразу.
+    # результат: {название поля: успешно ли заполнено}
+    async def set_custom_fields(self, card_id: str, custom_fields_data: Dict[str, Dict]) -> Dict[str, bool]:
+        if self.bulk_custom_fields and len(custom_fields_data) > 1:
+            results = await self.set_custom_fields_bulk(card_id, custom_fields_data)
+            if results is not None:
+                return results
+
+        semaphore = asyncio.Semaphore(self.field_concurrency)
+
+        async def set_field(field_name: str, field_info: Dict) -> bool:
+            async with semaphore:
+                try:
+                    success = await self.set_custom_field_value(
+                        card_id, field_info['id'], field_info['type'], field_info['value'], field_info.get('options')
+                    )
+                except CircuitOpenError:
+                    # цепь разомкнулась посреди заполнения: уже заполненные поля не теряем
+                    success = False
+            if success:
+                logger.info("Успешно заполнено поле: %s", field_name)
+            else:
+                logger.warning("Не удалось установить поле %s", field_name)
+            return success
+
+        field_names = list(custom_fields_data.keys())
+        results = await asyncio.gather(
+            *[set_field(field_name, custom_fields_data[field_name]) for field_name in field_names])
+        return dict(zip(field_names, results))
+
+    # создать карточку с кастомными полями.
+    # возвращает (успех, данные карточки или текст ошибки, результаты по полям)
+    async def create_card_with_custom_fields(self, list_id: str, name: str, desc: str, custom_fields_data: Dict[str, Dict], board_id: str) -> Tuple[bool, Any, Dict[str, bool]]:
+        success, result = await self.post_card(list_id, name, desc)
+        if not success:
+            return False, result, {}
+
+        field_results = await self.set_custom_fields(result['id'], custom_fields_data)
+        logger.info("Карточка создана с кастомными полями: %s", name)
+        return True, result, field_results
+
+    # создать карточку в Trello (старый метод для обратной совместимости)
+    async def create_card(self, list_id: str, name: str, desc: str) -> Tuple[bool, Any]:
+        return await self.post_card(list_id, name, desc)
@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+from typing import Any, Dict
+
+from aiohttp import web
+
+from board_cache import BoardMetadata, BoardMetadataCache
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TRELLO_WEBHOOK_ACTIONS = REGISTRY.counter(
+    'trello_webhook_actions_total', 'События webhook Trello по типу и результату', ('type', 'result'))
+
+# изменения кастомных полей, после которых доску нужно перечитать
+# (тип и варианты выпадающего списка в событие не попадают)
+CUSTOM_FIELD_REFRESH_ACTIONS = {'createCustomField', 'updateCustomField',
+                                'createCustomFieldOption', 'updateCustomFieldOption',
+                                'deleteCustomFieldOption'}
+
+
+# подпись Trello: base64(HMAC-SHA1(секрет приложения, тело запроса + callbackURL))
+def trello_signature(secret: str, body: bytes, callback_url: str) -> str:
+    digest = hmac.new(secret.encode('utf-8'), body + callback_url.encode('utf-8'), hashlib.sha1).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+# прием webhook Trello для одной доски: изменения списков и кастомных полей
+# сразу попадают в кэш метаданных, поэтому периодически опрашивать Trello не нужно.
+# списки и удаление/переименование полей правятся на месте, остальное - перечитыванием доски
+class TrelloWebhookReceiver:
+    def __init__(self, metadata: BoardMetadataCache, board_id: str, callback_url: str, secret: str):
+        self.metadata = metadata
+        self.board_id = board_id
+        self.callback_url = callback_url
+        self.secret = secret
+
+    def register(self, app: web.Application, path: str):
+        # Trello проверяет адрес запросом HEAD при создании webhook
+        app.router.add_route('HEAD', path, self.handle_head)
+        app.router.add_post(path, self.handle_post)
+
+    async def handle_head(self, request: web.Request) -> web.Response:
+        return web.Response(status=200)
+
+    async def handle_post(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        expected = trello_signature(self.secret, body, self.callback_url)
+        if not hmac.compare_digest(expected, request.headers.get('X-Trello-Webhook', '')):
+            logger.warning("Webhook Trello с неверной подписью от %s", request.remote)
+            return web.Response(status=401)
+
+        try:
+            action = json.loads(body)['action']
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        action_type = action.get('type', '')
+        result = self.apply_action(action_type, action.get('data', {}))
+        TRELLO_WEBHOOK_ACTIONS.inc(action_type, result)
+        if result != 'ignored':
+            logger.info("Webhook Trello: %s - %s", action_type, result)
+        # Trello повторяет доставку при любом ответе кроме 2xx
+        return web.Response(status=200)
+
+    # применить событие к кэшу: patched - исправлено на месте,
+    # refreshed - доска перечитывается, ignored - метаданные не затронуты
+    def apply_action(self, action_type: str, data: Dict[str, Any]) -> str:
+        if action_type in ('createList', 'updateList', 'moveListToBoard', 'moveListFromBoard'):
+            return self._apply_list_action(action_type, data)
+        if action_type == 'deleteCustomField':
+            return self._patch_or_refresh(lambda entry: self._remove_custom_field(entry, data['customField']['id']))
+        if action_type == 'updateCustomField' and set(data.get('old', {})) == {'name'}:
+            return self._patch_or_refresh(lambda entry: self._rename_custom_field(entry, data))
+        if action_type in CUSTOM_FIELD_REFRESH_ACTIONS:
+            self.metadata.refresh(self.board_id)
+            return 'refreshed'
+        return 'ignored'
+
+    def _apply_list_action(self, action_type: str, data: Dict[str, Any]) -> str:
+        trello_list = data.get('list', {})
+        list_id, name = trello_list.get('id'), trello_list.get('name')
+        if not list_id:
+            return 'ignored'
+
+        removed = action_type == 'moveListFromBoard' or trello_list.get('closed') is True
+        if action_type == 'updateList' and not removed and 'name' not in data.get('old', {}) \
+                and 'closed' not in data.get('old', {}):
+            # позиция, цвет и т.п. - на ID по названию не влияют
+            return 'ignored'
+
+        def change(entry: BoardMetadata):
+            entry.lists = {key: value for key, value in entry.lists.items() if value != list_id}
+            if not removed:
+                entry.lists[name.lower()] = list_id
+
+        if not removed and not name:
+            self.metadata.refresh(self.board_id)
+            return 'refreshed'
+        return self._patch_or_refresh(change)
+
+    @staticmethod
+    def _remove_custom_field(entry: BoardMetadata, field_id: str):
+        entry.custom_fields = {key: value for key, value in entry.custom_fields.items() if value['id'] != field_id}
+
+    @staticmethod
+    def _rename_custom_field(entry: BoardMetadata, data: Dict[str, Any]):
+        field = data['customField']
+        old_name = data['old']['name'].strip().lower()
+        info = entry.custom_fields.get(old_name)
+        if info is None or info['id'] != field['id']:
+            raise KeyError(old_name)
+        custom_fields = {key: value for key, value in entry.custom_fields.items() if key != old_name}
+        custom_fields[field['name'].strip().lower()] = info
+        entry.custom_fields = custom_fields
+
+    # изменить кэш на месте; если доски в кэше нет или данные не сходятся - перечитать доску
+    def _patch_or_refresh(self, change) -> str:
+        try:
+            if self.metadata.patch(self.board_id, change):
+                return 'patched'
+        except (KeyError, TypeError, AttributeError) as e:
+            logger.warning("Не удалось применить webhook Trello к кэшу (%s), доска будет перечитана", e)
+        self.metadata.refresh(self.board_id)
+        return 'refreshed'
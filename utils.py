@@ -2,49 +2,53 @@ import re
 import logging
 from typing import Dict, Optional, Tuple, List
 
+from field_schema import ORDER_SCHEMA
+
 logger = logging.getLogger(__name__)
 
 
+# строка сообщения: "поле": "значение" или поле: значение.
+# обе формы в одном скомпилированном шаблоне - одна проверка на строку
+LINE_PATTERN = re.compile(r'"([^"]+)":\s*"([^"]+)"|([^:]+):\s*(.+)')
+
+
 # парсинг сообщения и извлечение данных
 def parse_message(text: str) -> Dict[str, str]:
     data = {}
+    log_fields = logger.isEnabledFor(logging.INFO)
+    match_line = LINE_PATTERN.match
+    canonical = ORDER_SCHEMA.aliases.get
+    get_normalizer = ORDER_SCHEMA.normalizers.get
 
-    # Удаляем все лишние пробелы в начале и конце строк
-    text = text.strip()
-
-    # Разбиваем текст на строки
-    lines = text.split('\n')
-
-    for line in lines:
+    # Удаляем лишние пробелы в начале и конце и разбиваем текст на строки
+    for line in text.strip().split('\n'):
         line = line.strip()
         if not line:
             continue
 
-        # Пытаемся найти паттерн: "поле": "значение"
-        quoted_match = re.match(r'"([^"]+)":\s*"([^"]+)"', line, re.IGNORECASE)
-        if quoted_match:
-            field_name = quoted_match.group(1).strip().lower()
-            field_value = quoted_match.group(2).strip()
-
-            # Для дат убираем кавычки и оставляем только дату
-            if field_name in ['дата заказа', 'крайний срок']:
-                field_value = field_value.replace(
-                    '"', '').replace("'", "").split()[0]
-
-            data[field_name] = field_value
-            logger.info(
-                f"Обнаружено поле (с кавычками): {field_name} = {field_value}")
+        match = match_line(line)
+        if match is None:
             continue
-
-        # Пытаемся найти паттерн: поле: значение (без кавычек)
-        unquoted_match = re.match(r'([^:]+):\s*(.+)', line, re.IGNORECASE)
-        if unquoted_match:
-            field_name = unquoted_match.group(1).strip().lower()
-            field_value = unquoted_match.group(2).strip()
+        quoted_name, quoted_value, field_name, field_value = match.groups()
+
+        if quoted_name is not None:
+            # паттерн: "поле": "значение"
+            field_name = quoted_name.strip().lower()
+            field_name = canonical(field_name, field_name)
+            field_value = quoted_value.strip()
+
+            normalize = get_normalizer(field_name)
+            if normalize is not None:
+                field_value = normalize(field_value)
+        else:
+            # паттерн: поле: значение (без кавычек)
+            field_name = field_name.strip().lower()
+            field_value = field_value.strip()
 
             # Убираем кавычки из названия поля, если они есть
             if field_name.startswith('"') and field_name.endswith('"'):
                 field_name = field_name[1:-1].strip()
+            field_name = canonical(field_name, field_name)
 
             # Убираем кавычки из значения, если они есть
             if field_value.startswith('"') and field_value.endswith('"'):
@@ -52,18 +56,51 @@ def parse_message(text: str) -> Dict[str, str]:
             elif field_value.startswith("'") and field_value.endswith("'"):
                 field_value = field_value[1:-1].strip()
 
-            # Для дат убираем кавычки и оставляем только дату
-            if field_name in ['дата заказа', 'крайний срок']:
-                field_value = field_value.replace(
-                    '"', '').replace("'", "").split()[0]
+            normalize = get_normalizer(field_name)
+            if normalize is not None:
+                field_value = normalize(field_value)
 
             # Пропускаем пустые значения
             if not field_value:
                 continue
 
-            data[field_name] = field_value
-            logger.info(
-                f"Обнаружено поле (без кавычек): {field_name} = {field_value}")
+        data[field_name] = field_value
+        if log_fields:
+            logger.info("Обнаружено поле: %s = %s", field_name, field_value)
+
+    return data
+
+
+# нормализация готовых пар "поле: значение" (например, строк таблицы)
+# по тем же правилам, что и в parse_message
+def normalize_fields(raw: Dict[str, str]) -> Dict[str, str]:
+    data = {}
+
+    for field_name, field_value in raw.items():
+        field_name = (field_name or '').strip().lower()
+        field_value = (field_value or '').strip()
+
+        # Убираем кавычки из названия поля, если они есть
+        if field_name.startswith('"') and field_name.endswith('"'):
+            field_name = field_name[1:-1].strip()
+        field_name = ORDER_SCHEMA.canonical(field_name)
+
+        # Убираем кавычки из значения, если они есть
+        if field_value.startswith('"') and field_value.endswith('"'):
+            field_value = field_value[1:-1].strip()
+        elif field_value.startswith("'") and field_value.endswith("'"):
+            field_value = field_value[1:-1].strip()
+
+        # даты, числа и т.п. приводим к единому виду по схеме полей
+        normalize = ORDER_SCHEMA.normalizers.get(field_name)
+        if normalize is not None:
+            field_value = normalize(field_value)
+
+        # Пропускаем пустые названия и значения
+        if not field_name or not field_value:
+            continue
+
+        data[field_name] = field_value
 
     return data
 
@@ -74,26 +111,13 @@ def format_card_description(data: Dict[str, str]) -> str:
 
 """
 
-    # Стандартные поля с красивыми labels
-    fields_mapping = {
-        "имя карточки": "📝 **Название карточки:**",
-        "дата заказа": "📅 **Дата заказа:**",
-        "крайний срок": "⏰ **Крайний срок:**",
-        "клиент": "👥 **Клиент:**",
-        "цвет": "🎨 **Цвет:**",
-        "имя": "👤 **Имя:**",
-        "телефон": "📞 **Телефон:**",
-        "дополнительно": "📝 **Дополнительно:**",
-        "telegram пользователь": "👤 **Создал:**"
-    }
-
-    # Сначала добавляем стандартные поля
-    for field_key, field_label in fields_mapping.items():
+    # Сначала добавляем стандартные поля (подписи берутся из схемы полей)
+    for field_key, field_label in ORDER_SCHEMA.labels:
         if field_key in data:
             description += f"{field_label} {data[field_key]}\n"
 
     # Затем добавляем все остальные поля (которые не являются стандартными)
-    other_fields = [key for key in data.keys() if key not in fields_mapping]
+    other_fields = [key for key in data.keys() if key not in ORDER_SCHEMA.specs]
     if other_fields:
         description += "\n📋 **Дополнительные поля:**\n"
         for field in other_fields:
@@ -107,3 +131,8 @@ def validate_required_fields(data: Dict[str, str], required_fields: List[str]) -
     missing_fields = [
         field for field in required_fields if field not in data or not data[field]]
     return len(missing_fields) == 0, missing_fields
+
+
+# проверка значений полей по схеме (даты, числа, варианты списков)
+def validate_field_values(data: Dict[str, str]) -> List[str]:
+    return ORDER_SCHEMA.validate(data)